@@ -1,42 +1,411 @@
 import os 
+import base64
+import bisect
+import csv
+import fcntl
+import functools
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import math
+import multiprocessing
+import random
+import re
+import signal
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import bcrypt as bcrypt_lib
+import click
+import numpy as np
 # Импорт необходимых модулей Flask и расширений
-from flask import Flask, render_template, redirect, request, jsonify
-from flask_cors import CORS
-from datetime import datetime
+from flask import Blueprint, Flask, Response, current_app, g, has_request_context, render_template, redirect, request, jsonify, stream_with_context, url_for
+from datetime import datetime, timedelta
+from sqlalchemy import Engine, Select, and_, delete, event, func, insert, inspect, literal, or_, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session, aliased, joinedload, make_transient_to_detached, object_session, selectinload
 from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-
-# Конфигурация Flask приложения
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///posts.db')  # Путь к базе данных PostgreSQL или SQLite для разработки
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # Отключение отслеживания изменений для производительности
-app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'secret-key-here')  # Секретный ключ для JWT токенов
-CORS(app, origins=['https://sneakersstor.netlify.app'])
-
-@app.after_request
-def after_request(response):
-    response.headers.add('Access-Control-Allow-Origin', 'https://sneakersstor.netlify.app')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-    response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
-    return response
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+from flask_jwt_extended import JWTManager, create_access_token, current_user, jwt_required, get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
+
+# Единый слой CORS и политик кэширования HTTP-ответов
+
+# Политики Cache-Control для успешных ответов: каталог может кэшировать CDN,
+# персональные данные не должны сохраняться ни в каких кэшах
+CATALOG_CACHE_CONTROL = 'public, max-age=60, stale-while-revalidate=300'
+PRIVATE_CACHE_CONTROL = 'private, no-store'
+DEFAULT_CACHE_CONTROL = 'no-store'
+
+def cache_control(value, vary=None):
+    """Декоратор маршрута: Cache-Control и Vary для ответов 2xx/304 этого маршрута"""
+    def decorator(view):
+        view.cache_control = value
+        view.vary = vary
+        return view
+    return decorator
+
+class HttpPolicy:
+    """CORS и Cache-Control для всех ответов приложения.
+
+    Наборы заголовков вычисляются один раз при создании приложения.
+    Preflight-запросы OPTIONS получают пустой ответ 204 с Access-Control-Max-Age,
+    чтобы браузер не повторял их перед каждым запросом.
+    """
+
+    def init_app(self, app):
+        origins = app.config['CORS_ORIGINS']
+        self.origins = frozenset(origins)
+        # При единственном разрешенном источнике ответ не зависит от Origin
+        self.single_origin = origins[0] if len(origins) == 1 else None
+        self.response_headers = [
+            ('Access-Control-Expose-Headers', 'ETag, X-Next-Cursor, Link, Retry-After, X-Export-Snapshot'),
+        ]
+        self.preflight_headers = [
+            ('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS'),
+            ('Access-Control-Allow-Headers', 'Content-Type,Authorization,Idempotency-Key,If-None-Match'),
+            ('Access-Control-Max-Age', str(app.config['CORS_MAX_AGE'])),
+        ]
+        app.before_request(self.answer_preflight)
+        app.after_request(self.apply)
+
+    def _allowed_origin(self):
+        origin = request.headers.get('Origin')
+        if self.single_origin is not None:
+            return self.single_origin
+        return origin if origin in self.origins else None
 
-@app.before_request
-def before_request():
-    if request.method == 'OPTIONS':
-        response = jsonify({'status': 'OK'})
-        response.headers.add('Access-Control-Allow-Origin', 'https://sneakersstor.netlify.app')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+    def answer_preflight(self):
+        if request.method != 'OPTIONS':
+            return None
+        response = Response(status=204)
+        del response.headers['Content-Type']
+        origin = self._allowed_origin()
+        if origin is not None:
+            response.headers['Access-Control-Allow-Origin'] = origin
+            response.headers.extend(self.preflight_headers)
+        if self.single_origin is None:
+            response.vary.add('Origin')
         return response
-    #Включение CORS для всех маршрутов (разрешает запросы с фронтенда)
+
+    def apply(self, response):
+        if request.method == 'OPTIONS':
+            return response
+        origin = self._allowed_origin()
+        if origin is not None:
+            response.headers['Access-Control-Allow-Origin'] = origin
+            response.headers.extend(self.response_headers)
+        if self.single_origin is None:
+            response.vary.add('Origin')
+
+        if 'Cache-Control' not in response.headers:
+            view = current_app.view_functions.get(request.endpoint)
+            policy = getattr(view, 'cache_control', None)
+            if policy is not None and (200 <= response.status_code < 300 or response.status_code == 304):
+                response.headers['Cache-Control'] = policy
+                if view.vary:
+                    response.vary.update(view.vary)
+            else:
+                response.headers['Cache-Control'] = DEFAULT_CACHE_CONTROL
+        return response
+
+http_policy = HttpPolicy()
+
 port = int(os.environ.get("PORT", 10000))
-# Инициализация расширений Flask
-bcrypt = Bcrypt(app)  # Для безопасного хеширования паролей пользователей
-jwt = JWTManager(app)  # Для управления JWT токенами аутентификации
+# Расширения Flask (привязываются к приложению в create_app)
+jwt = JWTManager()  # Для управления JWT токенами аутентификации
+
+# Маршруты API регистрируются на blueprint, CLI-команды - на верхнем уровне flask
+bp = Blueprint('api', __name__, cli_group=None)
+
+# Метрики приложения в формате Prometheus
+
+# Границы гистограмм: время в секундах, число SQL-запросов, размер ответа в байтах
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# Имя метрики -> (тип, описание, метки, границы гистограммы)
+METRICS = {
+    'http_requests_total': ('counter', 'Число обработанных HTTP-запросов', ('endpoint', 'method', 'status'), None),
+    'http_request_duration_seconds': ('histogram', 'Время обработки HTTP-запроса', ('endpoint', 'method'), LATENCY_BUCKETS),
+    'http_request_sql_statements': ('histogram', 'Число SQL-запросов за HTTP-запрос', ('endpoint',), SQL_COUNT_BUCKETS),
+    'http_request_sql_duration_seconds': ('histogram', 'Суммарное время SQL за HTTP-запрос', ('endpoint',), LATENCY_BUCKETS),
+    'http_response_size_bytes': ('histogram', 'Размер тела ответа (без потоковых ответов)', ('endpoint',), SIZE_BUCKETS),
+    'password_hash_duration_seconds': ('histogram', 'Время хеширования и проверки паролей bcrypt', ('operation',), LATENCY_BUCKETS),
+    'password_hash_rejected_total': ('counter', 'Операции bcrypt, отклоненные из-за перегрузки', ('operation',), None),
+}
+
+# Сколько символов SQL выводить в журнал медленных запросов
+SLOW_REQUEST_SQL_MAX_LENGTH = 500
+
+class MetricsRegistry:
+    """Счетчики и гистограммы запросов, SQL и bcrypt с выдачей в формате Prometheus.
+
+    Каждый процесс считает метрики в памяти. Если задан METRICS_DIR, процесс
+    периодически сохраняет свои значения в файл <pid>.json этого каталога,
+    а /metrics суммирует файлы всех воркеров gunicorn. Файлы завершившихся
+    воркеров сливаются в dead.json (см. mark_process_dead), чтобы счетчики
+    не уменьшались при перезапуске воркеров.
+    """
+
+    def __init__(self):
+        self._values = {}  # (имя, значения меток) -> число или [счетчики корзин..., сумма]
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._dirty = False
+        self.directory = None
+        self.flush_interval = 1.0
+        self._flusher_pid = None
+
+    def init_app(self, app):
+        self.directory = app.config['METRICS_DIR']
+        self.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        # Регистрируется первым, поэтому выполняется после остальных after_request
+        # и видит окончательный (в том числе сжатый) ответ
+        app.after_request(self.remember_response)
+        app.before_request(self.start_request)
+        app.teardown_request(self.finish_request)
+
+    def _ensure_process(self):
+        # После fork значения мастер-процесса не должны попасть в метрики воркера
+        if self._pid != os.getpid():
+            self._values = {}
+            self._pid = os.getpid()
+        if self.directory and self._flusher_pid != self._pid:
+            self._flusher_pid = self._pid
+            threading.Thread(target=self._flush_loop, name='metrics-flusher', daemon=True).start()
+
+    def inc(self, name, labels, amount=1):
+        """Увеличить счетчик"""
+        with self._lock:
+            self._ensure_process()
+            key = (name, labels)
+            self._values[key] = self._values.get(key, 0) + amount
+            self._dirty = True
+
+    def observe(self, name, labels, value):
+        """Добавить наблюдение в гистограмму"""
+        buckets = METRICS[name][3]
+        with self._lock:
+            self._ensure_process()
+            key = (name, labels)
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(buckets) + 2)
+            counts[bisect.bisect_left(buckets, value)] += 1
+            counts[-1] += value
+            self._dirty = True
+
+    def reset(self):
+        """Обнулить значения текущего процесса"""
+        with self._lock:
+            self._values = {}
+            self._dirty = True
+
+    # Хранение значений воркеров в METRICS_DIR
+
+    def _snapshot(self):
+        with self._lock:
+            self._dirty = False
+            return [[name, list(labels), value if not isinstance(value, list) else list(value)]
+                    for (name, labels), value in self._values.items()]
+
+    def _write(self, path, snapshot):
+        # Атомарная замена: читатели никогда не видят частично записанный файл
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def flush(self):
+        """Сохранить значения текущего процесса в METRICS_DIR"""
+        if self.directory and self._pid == os.getpid():
+            self._write(os.path.join(self.directory, f'{self._pid}.json'), self._snapshot())
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if self._dirty:
+                self.flush()
+
+    def _locked(self, exclusive):
+        lock_file = open(os.path.join(self.directory, '.lock'), 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return lock_file
+
+    def mark_process_dead(self, pid):
+        """Перенести значения завершившегося воркера в dead.json (вызывается мастером gunicorn)"""
+        path = os.path.join(self.directory, f'{pid}.json')
+        if not os.path.exists(path):
+            return
+        with self._locked(exclusive=True):
+            dead_path = os.path.join(self.directory, 'dead.json')
+            merged = self._merge([self._read(dead_path), self._read(path)])
+            self._write(dead_path, [[name, list(labels), value] for (name, labels), value in merged.items()])
+            os.remove(path)
+
+    @staticmethod
+    def _merge(snapshots):
+        merged = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot:
+                if name not in METRICS:
+                    continue
+                key = (name, tuple(labels))
+                if key not in merged:
+                    merged[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    merged[key] = [a + b for a, b in zip(merged[key], value)]
+                else:
+                    merged[key] += value
+        return merged
+
+    def collect(self):
+        """Значения всех процессов: (имя, метки) -> значение"""
+        own = self._snapshot()
+        if not self.directory:
+            return self._merge([own])
+        own_file = f'{os.getpid()}.json'
+        with self._locked(exclusive=False):
+            others = [self._read(os.path.join(self.directory, name))
+                      for name in os.listdir(self.directory)
+                      if name.endswith('.json') and name != own_file]
+        return self._merge([own] + others)
+
+    def render(self):
+        """Текстовый формат Prometheus (version 0.0.4)"""
+        values = self.collect()
+        lines = []
+        for name, (kind, help_text, label_names, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (metric, labels), value in sorted(values.items()):
+                if metric != name:
+                    continue
+                pairs = [f'{label}="{escape_label_value(v)}"' for label, v in zip(label_names, labels)]
+                if kind == 'counter':
+                    lines.append(f'{name}{{{",".join(pairs)}}} {value:g}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value):
+                    cumulative += count
+                    le = f'le="{bound:g}"' if bound != '+Inf' else 'le="+Inf"'
+                    lines.append(f'{name}_bucket{{{",".join(pairs + [le])}}} {cumulative}')
+                lines.append(f'{name}_sum{{{",".join(pairs)}}} {value[-1]:.6f}')
+                lines.append(f'{name}_count{{{",".join(pairs)}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    # Хуки запроса
+
+    def start_request(self):
+        g.metrics_started = time.perf_counter()
+        g.sql_statements = []
+
+    def remember_response(self, response):
+        g.metrics_response = response
+        return response
+
+    def finish_request(self, error=None):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        response = g.pop('metrics_response', None)
+        statements = g.pop('sql_statements', [])
+        endpoint = request.endpoint or 'unmatched'
+        status = response.status_code if response is not None and error is None else 500
+        sql_time = sum(elapsed for _, elapsed in statements)
+
+        self.inc('http_requests_total', (endpoint, request.method, str(status)))
+        self.observe('http_request_duration_seconds', (endpoint, request.method), duration)
+        self.observe('http_request_sql_statements', (endpoint,), len(statements))
+        self.observe('http_request_sql_duration_seconds', (endpoint,), sql_time)
+        # У потоковых ответов размер заранее неизвестен; calculate_content_length()
+        # прочитал бы генератор целиком и оставил бы клиенту пустое тело
+        size = response.calculate_content_length() if response is not None and not response.is_streamed else None
+        if size is not None:
+            self.observe('http_response_size_bytes', (endpoint,), size)
+
+        if duration >= current_app.config['SLOW_REQUEST_SECONDS']:
+            current_app.logger.warning(
+                'Медленный запрос %s %s -> %s: %.3f с, SQL: %d запросов за %.3f с%s',
+                request.method, request.full_path.rstrip('?'), status, duration, len(statements), sql_time,
+                ''.join(f'\n  [{elapsed * 1000:.1f} мс] {statement[:SLOW_REQUEST_SQL_MAX_LENGTH]}'
+                        for statement, elapsed in statements)
+            )
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+metrics = MetricsRegistry()
+
+# Время каждого SQL-запроса в рамках HTTP-запроса (для всех движков, включая реплику).
+# Начало хранится в контексте выполнения запроса, а не в соединении: если запрос
+# завершился ошибкой и after_cursor_execute не вызван, оно исчезает вместе с контекстом
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_sql_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_query_started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_sql_statement(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'metrics_query_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    if has_request_context():
+        statements = g.get('sql_statements')
+        if statements is not None:
+            statements.append((statement, elapsed))
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Метрики всех воркеров в формате Prometheus.
+
+    Если задан METRICS_TOKEN, требуется заголовок Authorization: Bearer <METRICS_TOKEN>.
+    """
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Сессия с маршрутизацией чтения на реплику
+REPLICA_BIND = 'replica'
+
+class RoutingSession(FlaskSQLAlchemySession):
+    """Сессия, отправляющая SELECT на реплику в маршрутах с @read_from_replica.
+
+    Flush, INSERT/UPDATE/DELETE и любые запросы вне таких маршрутов
+    всегда выполняются в основной базе данных.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and isinstance(clause, Select)
+                and has_request_context() and g.get('use_replica')
+                and REPLICA_BIND in self._db.engines):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
 
 # Инициализация базы данных SQLAlchemy
-db = SQLAlchemy(app)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # Модель базы данных для пользователей системы
 class User(db.Model):
@@ -66,27 +435,89 @@ class User(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+# Денежные суммы хранятся целыми копейками; в API дополнительно отдаются рубли
+KOPECKS_PER_RUBLE = 100
+
+# Наибольшее целое, которое можно передать в запрос к БД (INTEGER SQLite, BIGINT PostgreSQL)
+DB_INTEGER_MAX = 2 ** 63 - 1
+
+def to_rubles(kopecks):
+    """Сумма в рублях для ответа API"""
+    return kopecks / KOPECKS_PER_RUBLE if kopecks is not None else None
+
+def to_kopecks(rubles):
+    """Сумма в рублях (число или строка) в целых копейках.
+
+    Бесконечность, NaN и суммы вне диапазона целых БД дают ValueError.
+    """
+    kopecks = float(rubles) * KOPECKS_PER_RUBLE
+    if not math.isfinite(kopecks) or abs(kopecks) > DB_INTEGER_MAX:
+        raise ValueError(f'Некорректная сумма: {rubles}')
+    return round(kopecks)
+
 # Модель заказа пользователя
 class Order(db.Model):
     # Основные поля заказа для обработки покупок
     id = db.Column(db.Integer, primary_key=True)  # Уникальный идентификатор заказа
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # ID пользователя, сделавшего заказ
-    total_amount = db.Column(db.Float, nullable=False)  # Общая сумма заказа в рублях
+    total_amount_kopecks = db.Column(db.Integer, nullable=False)  # Общая сумма заказа в копейках
     status = db.Column(db.String(20), default='pending')  # Статус заказа (pending, confirmed, shipped, delivered)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)  # Дата и время создания заказа
+    idempotency_key = db.Column(db.String(64))  # Ключ идемпотентности запроса оформления заказа
 
     # Связь с элементами заказа (товары в заказе)
     order_items = db.relationship('OrderItem', backref='order', lazy=True)
 
+    # Один ключ идемпотентности создает не более одного заказа пользователя;
+    # индексы покрывают историю заказов пользователя в порядке (created_at, id)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'idempotency_key', name='uq_order_user_idempotency_key'),
+        db.Index('ix_order_user_created_id', 'user_id', 'created_at', 'id'),
+        db.Index('ix_order_user_status_created_id', 'user_id', 'status', 'created_at', 'id'),
+    )
+
+    # Метод для преобразования заказа в словарь (вместе с элементами заказа)
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'total_amount': to_rubles(self.total_amount_kopecks),
+            'total_amount_kopecks': self.total_amount_kopecks,
+            'status': self.status,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'items': [item.to_dict() for item in self.order_items]
+        }
+
 # Модель элемента заказа (конкретный товар в заказе)
 class OrderItem(db.Model):
     # Поля для описания конкретного товара в заказе
     id = db.Column(db.Integer, primary_key=True)  # Уникальный идентификатор элемента заказа
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)  # ID заказа, к которому относится элемент
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)  # ID заказа, к которому относится элемент
     sneaker_id = db.Column(db.Integer, db.ForeignKey('sneaker.id'), nullable=False)  # ID товара (кроссовок)
     size = db.Column(db.Float, nullable=False)  # Размер выбранного товара
     quantity = db.Column(db.Integer, nullable=False)  # Количество единиц товара
-    price = db.Column(db.Float, nullable=False)  # Цена за единицу товара на момент заказа
+    price_kopecks = db.Column(db.Integer, nullable=False)  # Цена за единицу товара на момент заказа в копейках
+
+    # Связь с товаром (загружается вместе с элементами заказа)
+    sneaker = db.relationship('Sneaker')
+
+    # AUTOINCREMENT: SQLite не выдает повторно id удаленных строк,
+    # на этом держится водяной знак SimilarIndex
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    # Метод для преобразования элемента заказа в словарь
+    def to_dict(self):
+        sneaker = self.sneaker
+        return {
+            'id': self.id,
+            'order_id': self.order_id,
+            'sneaker_id': self.sneaker_id,
+            'size': self.size,
+            'quantity': self.quantity,
+            'price': to_rubles(self.price_kopecks),
+            'price_kopecks': self.price_kopecks,
+            'product': sneaker.to_dict() if sneaker else None
+        }
 
 # Модель корзины для хранения товаров пользователя
 class BasketItem(db.Model):
@@ -98,9 +529,21 @@ class BasketItem(db.Model):
     quantity = db.Column(db.Integer, nullable=False, default=1)  # Количество товара в корзине
     added_at = db.Column(db.DateTime, default=datetime.utcnow)  # Дата добавления товара в корзину
 
+    # Связь с товаром (загружается вместе с корзиной одним JOIN-запросом)
+    sneaker = db.relationship('Sneaker')
+
+    # Одна строка корзины на товар и размер: основа для атомарного upsert;
+    # индекс по товару - для поиска корзин, в которых лежит товар;
+    # AUTOINCREMENT - чтобы id строк, удаленных при оформлении заказа, не выдавались повторно
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'sneaker_id', 'size', name='uq_basket_item_user_sneaker_size'),
+        db.Index('ix_basket_item_sneaker_id', 'sneaker_id'),
+        {'sqlite_autoincrement': True},
+    )
+
     # Метод для преобразования объекта корзины в словарь
     def to_dict(self):
-        sneaker = Sneaker.query.get(self.sneaker_id)
+        sneaker = self.sneaker
         return {
             'id': self.id,
             'user_id': self.user_id,
@@ -122,7 +565,7 @@ class Sneaker(db.Model):
     color_code = db.Column(db.String(7))  # HEX код цвета для отображения
 
     # Ценовая информация товара
-    price = db.Column(db.Float, nullable=False)  # Цена товара в рублях
+    price_kopecks = db.Column(db.Integer, nullable=False)  # Цена товара в копейках
 
     # Подробное описание и характеристики товара
     description = db.Column(db.Text)  # Детальное описание товара
@@ -137,7 +580,22 @@ class Sneaker(db.Model):
     image_url = db.Column(db.String(200))  # URL изображения товара
     release_year = db.Column(db.Integer)  # Год выпуска модели
     sku = db.Column(db.String(50))  # Артикул товара (Stock Keeping Unit)
-    
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Время последнего изменения (для инкрементальной выгрузки)
+
+    # Составные индексы для фильтров каталога: id в конце индекса дает
+    # стабильную сортировку и keyset-пагинацию без сканирования всей таблицы
+    __table_args__ = (
+        db.Index('ix_sneaker_brand_id', 'brand', 'id'),
+        db.Index('ix_sneaker_gender_category_id', 'gender', 'category', 'id'),
+        db.Index('ix_sneaker_category_id', 'category', 'id'),
+        db.Index('ix_sneaker_size_id', 'size', 'id'),
+        db.Index('ix_sneaker_price_id', 'price_kopecks', 'id'),
+        db.Index('ix_sneaker_in_stock_id', 'in_stock', 'id'),
+        db.Index('ix_sneaker_updated_at_id', 'updated_at', 'id'),
+        # Ключ импорта каталога (NULL допускается у нескольких товаров)
+        db.Index('uq_sneaker_sku', 'sku', unique=True),
+    )
+
     # Метод для преобразования объекта в словарь (для API)
     def to_dict(self):
         return {
@@ -147,7 +605,8 @@ class Sneaker(db.Model):
             'size': self.size,
             'color_name': self.color_name,
             'color_code': self.color_code,
-            'price': self.price,
+            'price': to_rubles(self.price_kopecks),
+            'price_kopecks': self.price_kopecks,
             'description': self.description,
             'category': self.category,
             'gender': self.gender,
@@ -155,585 +614,3726 @@ class Sneaker(db.Model):
             'condition': self.condition,
             'image_url': self.image_url,
             'release_year': self.release_year,
-            'sku': self.sku
+            'sku': self.sku,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
-# API маршруты для аутентификации пользователей
+# Модель складского остатка товара по размеру
+class Stock(db.Model):
+    # Поля остатка: доступное количество конкретного размера товара
+    id = db.Column(db.Integer, primary_key=True)  # Уникальный идентификатор остатка
+    sneaker_id = db.Column(db.Integer, db.ForeignKey('sneaker.id'), nullable=False)  # ID товара
+    size = db.Column(db.Float, nullable=False)  # Размер товара
+    quantity = db.Column(db.Integer, nullable=False, default=0)  # Количество, доступное для резервирования
 
-@app.route('/auth/register', methods=['POST'])
-def register():
-    """Регистрация нового пользователя в системе"""
-    data = request.get_json()
+    # Один остаток на товар и размер; остаток не может уйти в минус
+    __table_args__ = (
+        db.UniqueConstraint('sneaker_id', 'size', name='uq_stock_sneaker_size'),
+        db.CheckConstraint('quantity >= 0', name='ck_stock_quantity_non_negative'),
+    )
 
-    # Валидация обязательных полей для регистрации
-    if not data.get('email') or not data.get('password'):
-        return jsonify({'error': 'Email и пароль обязательны'}), 400
+# Модель резерва товара под корзину пользователя
+class StockReservation(db.Model):
+    # Поля резерва: списанное со склада количество, удерживаемое до оформления заказа
+    id = db.Column(db.Integer, primary_key=True)  # Уникальный идентификатор резерва
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # ID пользователя
+    sneaker_id = db.Column(db.Integer, db.ForeignKey('sneaker.id'), nullable=False)  # ID товара
+    size = db.Column(db.Float, nullable=False)  # Размер товара
+    quantity = db.Column(db.Integer, nullable=False)  # Зарезервированное количество
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # Когда резерв вернется на склад
 
-    # Проверка на существование пользователя с таким email
-    if User.query.filter_by(email=data['email']).first():
-        return jsonify({'error': 'Пользователь с таким email уже существует'}), 400
+    # Один резерв на строку корзины (пользователь, товар, размер)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'sneaker_id', 'size', name='uq_stock_reservation_user_sneaker_size'),
+    )
 
-    # Создание нового пользователя с хешированием пароля
-    hashed_password = bcrypt.generate_password_hash(data['password']).decode('utf-8')
-    new_user = User(
-        email=data['email'],
-        password_hash=hashed_password,
-        first_name=data.get('first_name'),
-        last_name=data.get('last_name'),
-        phone=data.get('phone')
+# Модель фоновой задачи (см. очередь задач)
+class Job(db.Model):
+    # Поля задачи: что выполнить и состояние выполнения
+    id = db.Column(db.Integer, primary_key=True)  # Уникальный идентификатор задачи
+    kind = db.Column(db.String(50), nullable=False)  # Тип задачи (имя обработчика)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # Аргументы обработчика в JSON
+    status = db.Column(db.String(20), nullable=False, default='queued')  # Статус (queued, running, done, failed)
+    attempts = db.Column(db.Integer, nullable=False, default=0)  # Число начатых попыток
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)  # После стольких неудач задача failed
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Когда задача станет видна воркеру
+    last_error = db.Column(db.Text)  # Ошибка последней неудачной попытки
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)  # Время постановки в очередь
+    finished_at = db.Column(db.DateTime)  # Время выполнения или окончательной неудачи
+
+    # Индекс выборки видимых задач воркером
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
     )
 
-    # Сохранение пользователя в базе данных
-    db.session.add(new_user)
-    db.session.commit()
+    # Метод для преобразования задачи в словарь
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'payload': json.loads(self.payload),
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_at': self.run_at.isoformat() if self.run_at else None,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
 
-    # Генерация JWT токена для автоматического входа после регистрации
-    access_token = create_access_token(identity=new_user.id)
+# Модель примененной миграции схемы (см. MIGRATIONS)
+class SchemaMigration(db.Model):
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)  # Номер миграции
+    name = db.Column(db.String(100), nullable=False)  # Имя миграции
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)  # Когда миграция применена
 
-    return jsonify({
-        'message': 'Пользователь успешно зарегистрирован',
-        'access_token': access_token,
-        'user': new_user.to_dict()
-    }), 201
+# Сжатие ответов с учетом Accept-Encoding
 
-@app.route('/auth/login', methods=['POST'])
-def login():
-    """Аутентификация пользователя и вход в систему"""
-    data = request.get_json()
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/plain', 'text/html', 'text/csv'}
 
-    # Проверка наличия обязательных полей
-    if not data.get('email') or not data.get('password'):
-        return jsonify({'error': 'Email и пароль обязательны'}), 400
+# Кодировки в порядке предпочтения сервера; mtime=0 делает gzip детерминированным
+COMPRESSORS = {
+    'gzip': lambda data, level: gzip.compress(data, compresslevel=level, mtime=0),
+    'deflate': lambda data, level: zlib.compress(data, level),
+}
 
-    # Поиск пользователя в базе данных по email
-    user = User.query.filter_by(email=data['email']).first()
+def negotiate_encoding():
+    """Выбрать кодировку сжатия по заголовку Accept-Encoding или None"""
+    return request.accept_encodings.best_match(list(COMPRESSORS), default=None)
 
-    # Проверка существования пользователя и корректности пароля
-    if not user or not bcrypt.check_password_hash(user.password_hash, data['password']):
-        return jsonify({'error': 'Неверный email или пароль'}), 401
+def compress(data, encoding):
+    """Сжать тело ответа выбранной кодировкой с настроенным уровнем"""
+    return COMPRESSORS[encoding](data, current_app.config['COMPRESS_LEVEL'])
 
-    # Генерация JWT токена для сессии пользователя
-    access_token = create_access_token(identity=user.id)
+def compress_response(response):
+    """Сжать ответ на лету, если клиент это поддерживает и тело достаточно большое.
 
-    return jsonify({
-        'message': 'Вход выполнен успешно',
-        'access_token': access_token,
-        'user': user.to_dict()
-    }), 200
+    Ответы кэша каталога приходят уже сжатыми (Content-Encoding задан) и
+    здесь пропускаются; потоковые ответы не буферизуются.
+    """
+    if (response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or not 200 <= response.status_code < 300):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    data = response.get_data()
+    if encoding is None or len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
 
-@app.route('/auth/profile', methods=['GET'])
-@jwt_required()
-def get_profile():
-    """Получение данных профиля текущего аутентифицированного пользователя"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+# Бэкенды кэшей каталога и пользователей.
+# Записи разложены по пространствам имен; у каждого пространства есть счетчик
+# версий, который растет при любой инвалидации. set() принимает версию,
+# прочитанную до загрузки данных из БД, и не сохраняет запись, если за это
+# время пространство успели инвалидировать. По счетчику воркер также узнает,
+# что каталог изменил другой процесс, а по журналу изменений, который ведет
+# clear(), - что именно изменилось под каждой версией.
 
-    if not user:
-        return jsonify({'error': 'Пользователь не найден'}), 404
+CACHE_CHANGE_LOG_SIZE = 1000  # Сколько последних версий пространства хранит журнал изменений
 
-    return jsonify(user.to_dict()), 200
+class LocalCacheBackend:
+    """Кэш в памяти процесса: LRU с временем жизни записей, свой у каждого воркера"""
 
-@app.route('/auth/profile', methods=['PUT'])
-@jwt_required()
-def update_profile():
-    """Обновление данных профиля текущего пользователя"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    data = request.get_json()
+    def __init__(self):
+        self._entries = {}  # пространство -> OrderedDict(ключ -> (срок действия, значение))
+        self._versions = {}
+        self._changes = {}  # пространство -> {версия: множество изменений или None}
+        self._lock = threading.Lock()
 
-    if not user:
-        return jsonify({'error': 'Пользователь не найден'}), 404
+    def version(self, namespace):
+        return self._versions.get(namespace, 0)
 
-    # Обновление разрешенных полей профиля
-    if 'first_name' in data:
-        user.first_name = data['first_name']
-    if 'last_name' in data:
-        user.last_name = data['last_name']
-    if 'phone' in data:
-        user.phone = data['phone']
+    def get(self, namespace, key):
+        """Вернуть (значение или None, текущая версия пространства)"""
+        with self._lock:
+            version = self._versions.get(namespace, 0)
+            entries = self._entries.get(namespace)
+            entry = entries.get(key) if entries else None
+            if entry is None:
+                return None, version
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del entries[key]
+                return None, version
+            entries.move_to_end(key)
+            return value, version
 
-    # Сохранение изменений в базе данных
-    db.session.commit()
+    def set(self, namespace, key, value, version, ttl=None, max_size=None):
+        """Сохранить значение, если версия пространства не изменилась"""
+        with self._lock:
+            if version != self._versions.get(namespace, 0):
+                return
+            entries = self._entries.setdefault(namespace, OrderedDict())
+            entries[key] = (time.monotonic() + ttl if ttl else None, value)
+            entries.move_to_end(key)
+            while max_size is not None and len(entries) > max_size:
+                entries.popitem(last=False)
 
-    return jsonify({
-        'message': 'Профиль обновлен',
-        'user': user.to_dict()
-    }), 200
+    def delete(self, namespace, keys):
+        """Удалить записи и увеличить версию; возвращает новую версию"""
+        with self._lock:
+            entries = self._entries.get(namespace, {})
+            for key in keys:
+                entries.pop(key, None)
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            return self._versions[namespace]
 
-# API маршруты для работы с каталогом товаров
+    def clear(self, namespace, change=None):
+        """Удалить все записи пространства и увеличить версию; возвращает новую версию.
 
-@app.route('/catalog', methods=['GET'])
-def get_products():
-    """Получить список всех товаров из каталога кроссовок"""
-    items = Sneaker.query.all()
-    return jsonify([item.to_dict() for item in items])
+        change (коллекция ID или None, если неизвестно) записывается в журнал под новой версией.
+        """
+        with self._lock:
+            self._entries.pop(namespace, None)
+            version = self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            changes = self._changes.setdefault(namespace, {})
+            changes[version] = None if change is None else set(change)
+            changes.pop(version - CACHE_CHANGE_LOG_SIZE, None)
+            return version
 
-@app.route('/catalog/<int:item_id>', methods=['GET'])
-def get_product(item_id):
-    """Получить детальную информацию о конкретном товаре по его ID"""
-    item = Sneaker.query.get(item_id)
-    if item:
-        return jsonify(item.to_dict())
-    return jsonify({'error': 'Товар не найден'}), 404
+    def changes(self, namespace, after, until):
+        """Объединение изменений версий after < версия <= until; None, если какое-то неизвестно"""
+        with self._lock:
+            log = self._changes.get(namespace, {})
+            entries = [log.get(version) for version in range(after + 1, until + 1)]
+        if any(entry is None for entry in entries):
+            return None
+        return set().union(*entries)
 
-# API маршруты для работы с корзиной пользователя
+class SharedCacheBackend:
+    """Кэш в файле SQLite (журнал WAL) на локальном диске, общий для воркеров хоста.
 
-@app.route('/basket', methods=['GET'])
-@jwt_required()
-def get_basket():
-    """Получить содержимое корзины текущего пользователя"""
-    user_id = get_jwt_identity()
-    basket_items = BasketItem.query.filter_by(user_id=user_id).all()
-    return jsonify([item.to_dict() for item in basket_items])
+    Значения сериализуются в JSON (bytes - строкой base64), ключи - repr():
+    в отличие от pickle, чтение подмененного файла кэша не выполняет код.
+    Файл создается с правами 0600. Читатели не блокируют друг
+    друга и писателя; каждому потоку своего процесса - свое соединение.
+    При переполнении пространства удаляются записи, сохраненные раньше всех.
+    Ошибки SQLite (файл занят дольше таймаута) превращаются в промах кэша.
+    """
 
-@app.route('/basket', methods=['POST'])
-@jwt_required()
-def add_to_basket():
-    """Добавить товар в корзину пользователя"""
-    user_id = get_jwt_identity()
-    data = request.get_json()
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS cache_version (namespace TEXT PRIMARY KEY, version INTEGER NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS cache_entry (namespace TEXT NOT NULL, key TEXT NOT NULL, '
+        'value BLOB NOT NULL, expires_at REAL, UNIQUE (namespace, key))',
+        # Индекс (namespace, rowid): порядок сохранения для вытеснения старых записей
+        'CREATE INDEX IF NOT EXISTS ix_cache_entry_namespace ON cache_entry (namespace)',
+        # Журнал изменений: JSON-список ID под каждой версией пространства, NULL - неизвестно
+        'CREATE TABLE IF NOT EXISTS cache_change (namespace TEXT NOT NULL, version INTEGER NOT NULL, '
+        'change TEXT, PRIMARY KEY (namespace, version))',
+    )
 
-    # Проверка обязательных полей
-    if not data.get('sneaker_id') or not data.get('size'):
-        return jsonify({'error': 'ID товара и размер обязательны'}), 400
+    def __init__(self, path, timeout=5):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
 
-    # Проверка существования товара
-    sneaker = Sneaker.query.get(data['sneaker_id'])
-    if not sneaker:
-        return jsonify({'error': 'Товар не найден'}), 404
+    def _connection(self):
+        # Соединение не переживает fork: в новом процессе открывается заново
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            # Файлы -wal и -shm SQLite создает с правами основного файла
+            os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')  # Потеря кэша при сбое питания не страшна
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
 
-    # Поиск существующего товара в корзине
-    existing_item = BasketItem.query.filter_by(
-        user_id=user_id,
-        sneaker_id=data['sneaker_id'],
-        size=data['size']
-    ).first()
+    @staticmethod
+    def _dumps(value):
+        return json.dumps(value, separators=(',', ':'), default=SharedCacheBackend._encode_bytes)
 
-    if existing_item:
-        # Увеличение количества существующего товара
-        existing_item.quantity += data.get('quantity', 1)
-    else:
-        # Создание нового элемента корзины
-        new_item = BasketItem(
-            user_id=user_id,
-            sneaker_id=data['sneaker_id'],
-            size=data['size'],
-            quantity=data.get('quantity', 1)
-        )
-        db.session.add(new_item)
+    @staticmethod
+    def _encode_bytes(value):
+        if isinstance(value, bytes):
+            return {'$bytes': base64.b64encode(value).decode('ascii')}
+        raise TypeError(f'Значение типа {type(value).__name__} нельзя сохранить в общем кэше')
 
-    db.session.commit()
-    return jsonify({'message': 'Товар добавлен в корзину'}), 201
+    @staticmethod
+    def _decode_bytes(obj):
+        if len(obj) == 1 and '$bytes' in obj:
+            return base64.b64decode(obj['$bytes'])
+        return obj
 
-@app.route('/basket/<int:item_id>', methods=['PUT'])
-@jwt_required()
-def update_basket_item(item_id):
-    """Обновить количество товара в корзине"""
-    user_id = get_jwt_identity()
-    data = request.get_json()
+    def _bump(self, connection, namespace):
+        return connection.execute(
+            'INSERT INTO cache_version (namespace, version) VALUES (?, 1) '
+            'ON CONFLICT (namespace) DO UPDATE SET version = version + 1 RETURNING version',
+            (namespace,)
+        ).fetchone()[0]
 
-    item = BasketItem.query.filter_by(id=item_id, user_id=user_id).first()
-    if not item:
-        return jsonify({'error': 'Элемент корзины не найден'}), 404
+    def version(self, namespace):
+        try:
+            row = self._connection().execute(
+                'SELECT version FROM cache_version WHERE namespace = ?', (namespace,)).fetchone()
+        except sqlite3.Error:
+            return -1  # Версия неизвестна: set() с ней ничего не сохранит
+        return row[0] if row else 0
 
-    if 'quantity' in data:
-        if data['quantity'] <= 0:
-            # Удаление товара из корзины при количестве <= 0
-            db.session.delete(item)
-        else:
-            item.quantity = data['quantity']
+    def get(self, namespace, key):
+        """Вернуть (значение или None, текущая версия пространства) одним запросом"""
+        try:
+            row = self._connection().execute(
+                'SELECT coalesce((SELECT version FROM cache_version WHERE namespace = :namespace), 0), '
+                '(SELECT value FROM cache_entry WHERE namespace = :namespace AND key = :key '
+                ' AND (expires_at IS NULL OR expires_at > :now))',
+                {'namespace': namespace, 'key': repr(key), 'now': time.time()}
+            ).fetchone()
+        except sqlite3.Error:
+            return None, -1
+        version, value = row
+        if value is None:
+            return None, version
+        try:
+            return json.loads(value, object_hook=self._decode_bytes), version
+        except ValueError:
+            return None, version  # Запись в старом формате - промах кэша
 
-    db.session.commit()
-    return jsonify({'message': 'Корзина обновлена'}), 200
+    def set(self, namespace, key, value, version, ttl=None, max_size=None):
+        """Сохранить значение, если версия пространства не изменилась (проверка и запись атомарны)"""
+        data = self._dumps(value)
+        try:
+            connection = self._connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute(
+                    'INSERT OR REPLACE INTO cache_entry (namespace, key, value, expires_at) '
+                    'SELECT :namespace, :key, :value, :expires_at '
+                    'WHERE coalesce((SELECT version FROM cache_version WHERE namespace = :namespace), 0) = :version',
+                    {'namespace': namespace, 'key': repr(key), 'value': data,
+                     'expires_at': time.time() + ttl if ttl else None, 'version': version}
+                )
+                if max_size is not None:
+                    connection.execute(
+                        'DELETE FROM cache_entry WHERE namespace = :namespace AND rowid <= ('
+                        ' SELECT rowid FROM cache_entry WHERE namespace = :namespace'
+                        ' ORDER BY rowid DESC LIMIT 1 OFFSET :max_size)',
+                        {'namespace': namespace, 'max_size': max_size}
+                    )
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        except sqlite3.Error:
+            pass
 
-@app.route('/basket/<int:item_id>', methods=['DELETE'])
-@jwt_required()
-def remove_from_basket(item_id):
-    """Удалить товар из корзины"""
-    user_id = get_jwt_identity()
+    def _invalidate(self, namespace, keys=None, change=None):
+        # Инвалидация не подавляет ошибки: иначе другие воркеры молча отдавали бы устаревшие данные
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if keys is None:
+                connection.execute('DELETE FROM cache_entry WHERE namespace = ?', (namespace,))
+            else:
+                connection.executemany('DELETE FROM cache_entry WHERE namespace = ? AND key = ?',
+                                       [(namespace, repr(key)) for key in keys])
+            version = self._bump(connection, namespace)
+            if keys is None:
+                connection.execute(
+                    'INSERT OR REPLACE INTO cache_change (namespace, version, change) VALUES (?, ?, ?)',
+                    (namespace, version, None if change is None else json.dumps(list(change)))
+                )
+                connection.execute('DELETE FROM cache_change WHERE namespace = ? AND version <= ?',
+                                   (namespace, version - CACHE_CHANGE_LOG_SIZE))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return version
 
-    item = BasketItem.query.filter_by(id=item_id, user_id=user_id).first()
-    if not item:
-        return jsonify({'error': 'Элемент корзины не найден'}), 404
+    def delete(self, namespace, keys):
+        """Удалить записи и увеличить версию; возвращает новую версию"""
+        return self._invalidate(namespace, keys)
 
-    db.session.delete(item)
-    db.session.commit()
-    return jsonify({'message': 'Товар удален из корзины'}), 200
+    def clear(self, namespace, change=None):
+        """Удалить все записи пространства и увеличить версию; возвращает новую версию.
 
-@app.route('/basket', methods=['DELETE'])
-@jwt_required()
-def clear_basket():
-    """Очистить всю корзину пользователя"""
-    user_id = get_jwt_identity()
+        change (коллекция ID или None, если неизвестно) записывается в журнал под новой версией.
+        """
+        return self._invalidate(namespace, change=change)
 
-    BasketItem.query.filter_by(user_id=user_id).delete()
-    db.session.commit()
-    return jsonify({'message': 'Корзина очищена'}), 200
+    def changes(self, namespace, after, until):
+        """Объединение изменений версий after < версия <= until; None, если какое-то неизвестно"""
+        try:
+            rows = self._connection().execute(
+                'SELECT change FROM cache_change WHERE namespace = ? AND version > ? AND version <= ?',
+                (namespace, after, until)
+            ).fetchall()
+        except sqlite3.Error:
+            return None
+        # Недостающие версии вытеснены из журнала
+        if len(rows) != until - after or any(change is None for change, in rows):
+            return None
+        return set().union(*(json.loads(change) for change, in rows))
 
-# Запуск Flask приложения и инициализация базы данных
-if __name__ == '__main__':
-    with app.app_context():
-        # Создание всех таблиц базы данных на основе моделей
-        db.create_all()
-
-        # Создание учетной записи администратора при первом запуске
-        if not User.query.filter_by(email='admin@admin.com').first():
-            print("👤 Создание учетной записи администратора...")
-            admin_password = bcrypt.generate_password_hash('admin').decode('utf-8')
-            admin_user = User(
-                email='admin@admin.com',
-                password_hash=admin_password,
-                first_name='Администратор',
-                last_name='Системы',
-                is_admin=True
-            )
-            db.session.add(admin_user)
-            db.session.commit()
-            print("✅ Администратор создан: admin@admin.com / admin")
-
-        # Заполнение каталога начальными товарами при первом запуске
-        if Sneaker.query.count() == 0:
-            print("📦 Заполнение базы данных товарами...")
-
-            # Список товаров для начального заполнения каталога
-            sneakers = [
-                # Мужские кроссовки
-                Sneaker(
-                    brand="Nike",
-                    model="Air Jordan 1 Retro High",
-                    size=42.0,
-                    color_name="Black/Red",
-                    price=18999,
-                    description="Культовая баскетбольная модель 1985 года. Высокое качество материалов.",
-                    category="Basketball",
-                    gender="Men",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1600269452121-4f2416e55c28?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-                Sneaker(
-                    brand="Adidas",
-                    model="Yeezy Boost 350 V2",
-                    size=43.5,
-                    color_name="Zebra",
-                    price=25999,
-                    description="Лимитированная модель от Kanye West. Технология Boost для максимального комфорта.",
-                    category="Lifestyle",
-                    gender="Men",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1560769624-6b03633ba29e?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2022
-                ),
-                Sneaker(
-                    brand="Nike",
-                    model="Dunk Low Retro",
-                    size=41.0,
-                    color_name="Panda",
-                    price=12999,
-                    description="Классические кроссовки для скейтбординга. Универсальный черно-белый дизайн.",
-                    category="Skateboarding",
-                    gender="Men",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1595950653106-6c9ebd614d3a?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-                Sneaker(
-                    brand="New Balance",
-                    model="550",
-                    size=44.0,
-                    color_name="White/Green",
-                    price=14999,
-                    description="Ретро-баскетбольные кроссовки. Премиальная кожа и замша.",
-                    category="Lifestyle",
-                    gender="Men",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1606107557195-0e29a4b5b4aa?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2022
-                ),
-                Sneaker(
-                    brand="Nike",
-                    model="Air Force 1 Low",
-                    size=42.5,
-                    color_name="Triple White",
-                    price=10999,
-                    description="Легендарные кроссовки 1982 года. Чистый белый цвет на каждый день.",
-                    category="Casual",
-                    gender="Men",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1600185365483-26d7a4cc7519?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-                Sneaker(
-                    brand="Nike",
-                    model="Air Max 97",
-                    size=44.5,
-                    color_name="Silver Bullet",
-                    price=16999,
-                    description="Футуристичный дизайн вдохновлен японскими скоростными поездами.",
-                    category="Running",
-                    gender="Men",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1605348532760-6753d2c43329?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2022
-                ),
-                Sneaker(
-                    brand="Nike",
-                    model="Blazer Mid '77",
-                    size=42.0,
-                    color_name="Vintage White",
-                    price=11999,
-                    description="Винтажный баскетбольный стиль. Универсальная модель.",
-                    category="Casual",
-                    gender="Men",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1560769624-6b03633ba29e?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-                Sneaker(
-                    brand="Reebok",
-                    model="Classic Leather",
-                    size=43.0,
-                    color_name="White",
-                    price=7999,
-                    description="Легендарные кроссовки 1983 года. Мягкая кожа и комфорт.",
-                    category="Lifestyle",
-                    gender="Men",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1595950653106-6c9ebd614d3a?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-
-                # Женские кроссовки
-                Sneaker(
-                    brand="Nike",
-                    model="Air Force 1 '07",
-                    size=38.0,
-                    color_name="White/Pink",
-                    price=9999,
-                    description="Иконические кроссовки в нежном розовом цвете. Идеально для повседневного образа.",
-                    category="Casual",
-                    gender="Women",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1549298916-b41d501d3772?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-                Sneaker(
-                    brand="Adidas",
-                    model="Stan Smith",
-                    size=37.5,
-                    color_name="White/Green",
-                    price=8999,
-                    description="Классические теннисные кроссовки. Минималистичный дизайн и комфорт.",
-                    category="Casual",
-                    gender="Women",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1606107557195-0e29a4b5b4aa?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-                Sneaker(
-                    brand="Nike",
-                    model="React Element 55",
-                    size=39.0,
-                    color_name="Light Cream",
-                    price=11999,
-                    description="Стильные кроссовки с амортизацией React. Элегантный бежевый цвет.",
-                    category="Lifestyle",
-                    gender="Women",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1560769624-6b03633ba29e?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-                Sneaker(
-                    brand="Puma",
-                    model="RS-X³ Puzzle",
-                    size=38.5,
-                    color_name="Pink/White",
-                    price=13999,
-                    description="Яркие кроссовки в стиле 90-х. Комфорт и индивидуальность.",
-                    category="Lifestyle",
-                    gender="Women",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1595950653106-6c9ebd614d3a?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-                Sneaker(
-                    brand="Adidas",
-                    model="Superstar",
-                    size=37.0,
-                    color_name="Black/White",
-                    price=10999,
-                    description="Легендарные кроссовки с тремя полосками. Классика уличной моды.",
-                    category="Casual",
-                    gender="Women",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1600185365483-26d7a4cc7519?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-                Sneaker(
-                    brand="Nike",
-                    model="Cortez",
-                    size=38.0,
-                    color_name="White/Purple",
-                    price=9999,
-                    description="Ретро-бегущие кроссовки. Комфорт и стиль в одном.",
-                    category="Running",
-                    gender="Women",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1542291026-7eec264c27ff?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-
-                # Детские кроссовки
-                Sneaker(
-                    brand="Nike",
-                    model="Air Max 90",
-                    size=32.0,
-                    color_name="Black/White",
-                    price=7999,
-                    description="Классические кроссовки с воздушной подушкой. Для активных детей.",
-                    category="Casual",
-                    gender="Kids",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1605348532760-6753d2c43329?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-                Sneaker(
-                    brand="Adidas",
-                    model="Gazelle Kids",
-                    size=31.0,
-                    color_name="Blue/White",
-                    price=6999,
-                    description="Маленькая копия классики. Качественные материалы для детей.",
-                    category="Casual",
-                    gender="Kids",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1606107557195-0e29a4b5b4aa?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-                Sneaker(
-                    brand="Puma",
-                    model="Suede Classic Kids",
-                    size=30.5,
-                    color_name="Red/White",
-                    price=5999,
-                    description="Яркие кроссовки для маленьких модников. Комфорт и стиль.",
-                    category="Casual",
-                    gender="Kids",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1560769624-6b03633ba29e?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-                Sneaker(
-                    brand="Nike",
-                    model="Force 1 Low Kids",
-                    size=29.0,
-                    color_name="White/Blue",
-                    price=6999,
-                    description="Детская версия легенды. Качественные материалы и комфорт.",
-                    category="Casual",
-                    gender="Kids",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1595950653106-6c9ebd614d3a?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-                Sneaker(
-                    brand="Adidas",
-                    model="Superstar Kids",
-                    size=28.0,
-                    color_name="White/Black",
-                    price=6499,
-                    description="Маленькие звездочки уличной моды. Для самых маленьких.",
-                    category="Casual",
-                    gender="Kids",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1600185365483-26d7a4cc7519?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-
-                # Дополнительные мужские
-                Sneaker(
-                    brand="Adidas",
-                    model="Ultraboost 22",
-                    size=43.0,
-                    color_name="Black",
-                    price=18999,
-                    description="Профессиональные беговые кроссовки с технологией Boost.",
-                    category="Running",
-                    gender="Men",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1542291026-7eec264c27ff?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-                Sneaker(
-                    brand="Nike",
-                    model="Pegasus 39",
-                    size=42.0,
-                    color_name="Black/White",
-                    price=12999,
-                    description="Универсальные беговые кроссовки для тренировок.",
-                    category="Running",
-                    gender="Men",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1606107557195-0e29a4b5b4aa?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-
-                # Дополнительные женские
-                Sneaker(
-                    brand="Nike",
-                    model="Zoom Pegasus Turbo",
-                    size=38.5,
-                    color_name="Pink/Black",
-                    price=14999,
-                    description="Быстрые беговые кроссовки для женщин. Максимальная амортизация.",
-                    category="Running",
-                    gender="Women",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1560769624-6b03633ba29e?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                ),
-                Sneaker(
-                    brand="Adidas",
-                    model="NMD_R1",
-                    size=37.5,
-                    color_name="White/Pink",
-                    price=15999,
-                    description="Современные кроссовки с технологией Boost. Урбанистический стиль.",
-                    category="Lifestyle",
-                    gender="Women",
-                    in_stock=True,
-                    condition="New",
-                    image_url="https://images.unsplash.com/photo-1595950653106-6c9ebd614d3a?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
-                    release_year=2023
-                )
-            ]
+def cache_backend(app):
+    """Бэкенд кэшей приложения: общий файл CACHE_PATH или память процесса"""
+    if 'cache_backend' not in app.extensions:
+        path = app.config['CACHE_PATH']
+        app.extensions['cache_backend'] = SharedCacheBackend(path) if path else LocalCacheBackend()
+    return app.extensions['cache_backend']
 
-            # Массовое добавление товаров в базу данных
-            db.session.add_all(sneakers)
-            db.session.commit()
-            print("✅ 25 кроссовок добавлены в базу данных!")
+# Кэш готовых ответов каталога (общий для воркеров при заданном CACHE_PATH)
+
+CATALOG_NAMESPACE = 'catalog'
+
+class CatalogCache:
+    """LRU-кэш сериализованных ответов каталога с ETag.
+
+    Хранит готовые тела JSON-ответов для списка и карточек товаров, чтобы
+    повторные запросы не обращались к базе данных и не вызывали to_dict().
+    Сжатые варианты тела (gzip, deflate) создаются при первом запросе с
+    подходящим Accept-Encoding и хранятся рядом с исходным телом, поэтому
+    сжатие выполняется один раз на изменение каталога, а не на каждый запрос.
+    Сбрасывается целиком при любом изменении таблицы Sneaker. Версия
+    пространства в бэкенде показывает воркеру, что каталог изменил другой
+    процесс, а журнал изменений бэкенда - какие товары нужно переиндексировать.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.backend = LocalCacheBackend()
+        self.seen_version = None  # Версия каталога, с которой согласованы индексы воркера
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_size = app.config['CATALOG_CACHE_SIZE']
+        self.backend = cache_backend(app)
+        self.seen_version = None
+
+    def get(self, key):
+        """Получить (запись (body, etag, headers, сжатые варианты) или None, версию кэша)"""
+        return self.backend.get(CATALOG_NAMESPACE, key)
+
+    def put(self, key, entry, version):
+        """Сохранить запись, если кэш не был сброшен после начала ее построения"""
+        self.backend.set(CATALOG_NAMESPACE, key, entry, version, max_size=self.max_size)
+
+    def invalidate(self, changed_ids, notify):
+        """Сбросить все записи кэша (во всех воркерах при общем бэкенде) и вызвать notify(ID).
+
+        changed_ids записываются в журнал изменений для других процессов.
+        notify получает их вместе с ID товаров, измененных другими процессами
+        с прошлой синхронизации, или None, если часть изменений неизвестна.
+        """
+        version = self.backend.clear(CATALOG_NAMESPACE, changed_ids)
+        with self._lock:
+            seen = self.seen_version
+            if seen is None or changed_ids is None:
+                changes = None
+            elif version > seen + 1:
+                changes = self.backend.changes(CATALOG_NAMESPACE, seen, version - 1)
+                if changes is not None:
+                    changes |= set(changed_ids)
+            else:
+                changes = changed_ids
+            notify(changes)
+            self.seen_version = version if seen is None else max(seen, version)
+
+    def sync(self, notify):
+        """Подхватить изменения каталога другими процессами; вернуть версию каталога.
+
+        Если версия в бэкенде выросла, вызывает notify(ID товаров из журнала
+        изменений или None, если часть изменений неизвестна). Новая версия
+        запоминается только после notify: другие потоки воркера не начнут
+        читать данные этой версии, пока индексы и прилипание к основной БД
+        не обновлены.
+        """
+        version = self.backend.version(CATALOG_NAMESPACE)
+        if version == self.seen_version:
+            return version
+        with self._lock:
+            seen = self.seen_version
+            if seen is not None and version > seen:
+                notify(self.backend.changes(CATALOG_NAMESPACE, seen, version))
+            if seen is None or version > seen:
+                self.seen_version = version
+        return version
+
+    def respond(self, key, build):
+        """Вернуть ответ из кэша или построить его через build().
+
+        build() возвращает (данные для JSON, заголовки) или None, если
+        ответ не нужно кэшировать (например, товар не найден).
+        Запросы с совпадающим If-None-Match получают 304 без обращения к БД.
+        """
+        entry, version = self.get(key)
+        # Если каталог изменили после синхронизации в начале запроса, построенный
+        # ответ мог быть прочитан с отстающей реплики: он отдается, но не сохраняется
+        cacheable = version == g.get('catalog_version', version)
+        if entry is None:
+            built = build()
+            if built is None:
+                return None
+            data, headers = built
+            body = jsonify(data).get_data()
+            entry = (body, hashlib.sha1(body).hexdigest(), headers, {})
+            if cacheable:
+                self.put(key, entry, version)
+
+        body, etag, headers, encoded = entry
+        response = Response(body, mimetype='application/json', headers=headers)
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate_encoding()
+        if encoding is not None and len(body) >= current_app.config['COMPRESS_MIN_SIZE']:
+            if encoding not in encoded:
+                encoded[encoding] = compress(body, encoding)
+                # Общий бэкенд хранит копию записи: сжатый вариант сохраняется явно
+                if cacheable:
+                    self.put(key, entry, version)
+            response.set_data(encoded[encoding])
+            response.headers['Content-Encoding'] = encoding
+            # У каждого варианта представления свой строгий ETag
+            etag = f'{etag}-{encoding}'
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+catalog_cache = CatalogCache()
+
+# Отслеживание изменений каталога через события SQLAlchemy:
+# при flush запоминаем ID измененных товаров в сессии, после успешного
+# commit сбрасываем кэш ответов и передаем ID подписчикам - индексам
+# в памяти воркера (поисковый, фасетный и т.д.)
+catalog_change_listeners = []
+
+def on_catalog_change(func):
+    """Зарегистрировать обработчик func(changed_ids), вызываемый после commit.
+
+    Изменения других процессов приходят из журнала изменений кэша каталога.
+    changed_ids равен None, если измененные товары неизвестны (журнал
+    переполнен или изменений слишком много): индекс нужно обновить целиком.
+    """
+    catalog_change_listeners.append(func)
+    return func
+
+def notify_catalog_listeners(changed_ids):
+    for listener in catalog_change_listeners:
+        listener(changed_ids)
+
+def publish_catalog_change(changed_ids):
+    """Сбросить кэш ответов каталога, записать изменение в журнал и обновить индексы воркера"""
+    catalog_cache.invalidate(changed_ids, notify_catalog_listeners)
+
+def sync_catalog_changes():
+    """Обновить индексы воркера, если каталог изменил другой процесс.
+
+    Проверяет только счетчик версий в бэкенде кэша, без запроса к основной БД;
+    возвращает версию каталога, с которой согласованы индексы воркера.
+    """
+    return catalog_cache.sync(notify_catalog_listeners)
+
+def record_catalog_change(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('catalog_changes', set()).add(target.id)
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Sneaker, _event_name, record_catalog_change)
+
+@event.listens_for(Session, 'after_commit')
+def notify_catalog_change(session):
+    changed_ids = session.info.pop('catalog_changes', None)
+    if changed_ids:
+        publish_catalog_change(changed_ids)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_catalog_changes(session, previous_transaction):
+    session.info.pop('catalog_changes', None)
+
+# Чтение с реплики с гарантией read-your-writes внутри воркера:
+# после изменения каталога или записи пользователя его чтения какое-то
+# время идут в основную БД, пока реплика не догонит
+
+replica_state = {'catalog_written_at': float('-inf')}
+user_written_at = {}  # identity пользователя -> время его последней записи (time.monotonic)
+USER_WRITES_MAX_TRACKED = 10000  # Порог очистки устаревших записей user_written_at
+
+def current_identity():
+    """Identity из уже проверенного JWT текущего запроса или None"""
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        return None
+
+@event.listens_for(Session, 'after_flush')
+def mark_session_wrote(session, flush_context):
+    session.info['wrote'] = True
+
+@event.listens_for(Session, 'do_orm_execute')
+def mark_session_wrote_statement(orm_execute_state):
+    # INSERT/UPDATE/DELETE через session.execute() проходят мимо flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+@event.listens_for(Session, 'after_commit')
+def record_user_write(session):
+    if session.info.pop('wrote', False) and has_request_context():
+        identity = current_identity()
+        if identity is not None:
+            now = time.monotonic()
+            if len(user_written_at) > USER_WRITES_MAX_TRACKED:
+                sticky = current_app.config['REPLICA_STICKY_SECONDS']
+                for key, written_at in list(user_written_at.items()):
+                    if now - written_at > sticky:
+                        user_written_at.pop(key, None)
+            user_written_at[identity] = now
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_session_wrote(session, previous_transaction):
+    session.info.pop('wrote', None)
+
+@on_catalog_change
+def record_catalog_write(changed_ids):
+    replica_state['catalog_written_at'] = time.monotonic()
+
+def replica_is_safe():
+    """Можно ли читать с реплики в текущем запросе"""
+    if REPLICA_BIND not in current_app.config['SQLALCHEMY_BINDS']:
+        return False
+    sticky = current_app.config['REPLICA_STICKY_SECONDS']
+    now = time.monotonic()
+    if now - replica_state['catalog_written_at'] < sticky:
+        return False
+    if user_written_at and request.headers.get('Authorization'):
+        try:
+            verify_jwt_in_request(optional=True)
+        except (JWTExtendedException, PyJWTError):
+            return True
+        written_at = user_written_at.get(current_identity())
+        if written_at is not None and now - written_at < sticky:
+            return False
+    return True
+
+def read_from_replica(view):
+    """Декоратор маршрута: SELECT-запросы идут на реплику, если она настроена"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # Изменения каталога другими процессами подхватываются до выбора базы:
+        # их обработчик включает чтение из основной БД на время отставания реплики
+        g.catalog_version = sync_catalog_changes()
+        g.use_replica = replica_is_safe()
+        return view(*args, **kwargs)
+    return wrapper
+
+# Полнотекстовый поиск по каталогу (инвертированный индекс в памяти воркера)
+
+SEARCH_FIELD_WEIGHTS = {  # Вес совпадения в каждом поле товара
+    'brand': 3.0,
+    'model': 3.0,
+    'color_name': 1.5,
+    'category': 1.5,
+    'description': 1.0,
+}
+SEARCH_PREFIX_FACTOR = 0.5  # Множитель веса для совпадения по префиксу, а не целому слову
+SEARCH_MAX_PREFIX_TERMS = 100  # Максимум термов, в которые раскрывается префикс
+SEARCH_TOKEN_RE = re.compile(r'\w+')
+
+# Окончания для простого стемминга (русские и английские), от длинных к коротким
+SEARCH_SUFFIXES = sorted([
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ой', 'ом', 'ем',
+    'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ей', 'ую', 'юю', 'ью', 'ия', 'ья',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+    'ing', 'ed', 'es', 's',
+], key=len, reverse=True)
+
+def stem(token):
+    """Отбросить типичное окончание слова, оставив основу не короче 3 символов"""
+    if len(token) > 4:
+        for suffix in SEARCH_SUFFIXES:
+            if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+                return token[:-len(suffix)]
+    return token
+
+def tokenize(text):
+    """Разбить текст на нормализованные термы (регистр, ё/е, стемминг)"""
+    text = text.casefold().replace('ё', 'е')
+    return [stem(token) for token in SEARCH_TOKEN_RE.findall(text)]
+
+class SearchIndex:
+    """Инвертированный индекс по текстовым полям Sneaker.
+
+    Строится из базы данных при первом поиске и обновляется инкрементально:
+    после commit измененные ID помечаются и переиндексируются при следующем
+    запросе. Поиск требует совпадения всех слов запроса (целиком или по
+    префиксу) и ранжирует товары по сумме весов полей.
+    """
+
+    def __init__(self):
+        self._postings = {}  # терм -> {id товара: вес}
+        self._doc_terms = {}  # id товара -> множество его термов
+        self._terms = []  # отсортированные термы для префиксного поиска
+        self._dirty_ids = set()
+        self._built = False
+        self._lock = threading.Lock()
+
+    def mark_dirty(self, ids):
+        """Пометить товары для переиндексации; None - перестроить индекс целиком"""
+        with self._lock:
+            if ids is None:
+                self._built = False
+            else:
+                self._dirty_ids.update(ids)
+
+    def _load_rows(self, ids=None):
+        columns = [getattr(Sneaker, field) for field in SEARCH_FIELD_WEIGHTS]
+        query = db.session.query(Sneaker.id, *columns)
+        if ids is not None:
+            query = query.filter(Sneaker.id.in_(ids))
+        return query.all()
+
+    def _add(self, row):
+        doc_id = row[0]
+        weights = {}
+        for field, value in zip(SEARCH_FIELD_WEIGHTS, row[1:]):
+            for term in tokenize(value or ''):
+                weights[term] = weights.get(term, 0) + SEARCH_FIELD_WEIGHTS[field]
+        for term, weight in weights.items():
+            if term not in self._postings:
+                self._postings[term] = {}
+                # При полной перестройке термы сортируются один раз в refresh
+                if self._built:
+                    bisect.insort(self._terms, term)
+            self._postings[term][doc_id] = weight
+        self._doc_terms[doc_id] = set(weights)
+
+    def _remove(self, doc_id):
+        for term in self._doc_terms.pop(doc_id, ()):
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+
+    def refresh(self):
+        """Построить индекс при первом обращении и применить отложенные изменения"""
+        with self._lock:
+            if not self._built:
+                self._postings, self._doc_terms, self._terms = {}, {}, []
+                for row in self._load_rows():
+                    self._add(row)
+                self._terms = sorted(self._postings)
+                self._built = True
+                self._dirty_ids.clear()
+            elif self._dirty_ids:
+                ids = list(self._dirty_ids)
+                self._dirty_ids.clear()
+                rows = self._load_rows(ids)
+                for doc_id in ids:
+                    self._remove(doc_id)
+                for row in rows:
+                    self._add(row)
+
+    def _expand(self, term):
+        """Термы индекса, начинающиеся с term (включая сам term)"""
+        start = bisect.bisect_left(self._terms, term)
+        end = min(start + SEARCH_MAX_PREFIX_TERMS, len(self._terms))
+        for candidate in self._terms[start:end]:
+            if not candidate.startswith(term):
+                break
+            yield candidate
+
+    def search(self, query, limit):
+        """Найти ID товаров по запросу, отсортированные по убыванию релевантности"""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        self.refresh()
+
+        with self._lock:
+            scores = None
+            for term in terms:
+                term_scores = {}
+                for candidate in self._expand(term):
+                    factor = 1.0 if candidate == term else SEARCH_PREFIX_FACTOR
+                    for doc_id, weight in self._postings[candidate].items():
+                        if weight * factor > term_scores.get(doc_id, 0):
+                            term_scores[doc_id] = weight * factor
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {doc_id: scores[doc_id] + score
+                              for doc_id, score in term_scores.items() if doc_id in scores}
+                if not scores:
+                    return []
+
+        ranked = sorted(scores.items(), key=lambda pair: (-pair[1], pair[0]))
+        return [doc_id for doc_id, _ in ranked[:limit]]
+
+search_index = SearchIndex()
+
+@on_catalog_change
+def reindex_changed_sneakers(changed_ids):
+    search_index.mark_dirty(changed_ids)
+
+# Фасетные счетчики каталога на битовых множествах (в памяти воркера)
+
+# Границы ценовых диапазонов фасета price в рублях (верхняя граница не включается)
+FACET_PRICE_BUCKETS = [(0, 5000), (5000, 10000), (10000, 15000), (15000, 20000), (20000, None)]
+
+def price_bucket_label(price):
+    """Название ценового диапазона, в который попадает цена"""
+    for low, high in FACET_PRICE_BUCKETS:
+        if high is None or price < high:
+            return f'{low}-{high}' if high is not None else f'{low}+'
+
+PRICE_BUCKET_LABELS = [price_bucket_label(low) for low, _ in FACET_PRICE_BUCKETS]
+
+def normalize_price_bucket(value):
+    if value not in PRICE_BUCKET_LABELS:
+        raise ValueError(value)
+    return value
+
+# Фасеты: значение фасета для строки каталога и нормализация значения фильтра
+FACETS = {
+    'brand': (lambda row: row.brand, str),
+    'gender': (lambda row: row.gender, str),
+    'category': (lambda row: row.category, str),
+    'size': (lambda row: f'{row.size:g}', lambda value: f'{float(value):g}'),
+    'price': (lambda row: price_bucket_label(to_rubles(row.price_kopecks)), normalize_price_bucket),
+    'in_stock': (lambda row: 'true' if row.in_stock else 'false',
+                 lambda value: 'true' if parse_bool(value) else 'false'),
+}
+
+def ids_to_bitmap(ids, size):
+    """Битовое множество (целое число) с установленными битами ids, каждый id меньше size"""
+    bits = np.zeros(size, dtype=bool)
+    bits[ids] = True
+    # bitorder='little': бит с номером id попадает в разряд 2**id целого числа
+    return int.from_bytes(np.packbits(bits, bitorder='little').tobytes(), 'little')
+
+class FacetIndex:
+    """Битовые множества товаров для каждого значения каждого фасета.
+
+    Бит с номером id товара установлен, если товар имеет это значение.
+    Счетчики для выбранных фильтров считаются пересечением (AND) множеств,
+    значения внутри одного фасета объединяются (OR). Для каждого фасета
+    учитываются фильтры всех остальных фасетов, но не его собственный,
+    чтобы боковая панель показывала доступные альтернативы.
+    Перестраивается лениво при первом запросе после изменения каталога.
+    """
+
+    def __init__(self):
+        self._bitmaps = None  # фасет -> {значение: битовое множество}
+        self._universe = 0  # битовое множество всех товаров
+        self._version = 0  # Растет при каждом изменении каталога
+        self._built_version = -1
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Пометить индекс устаревшим"""
+        with self._lock:
+            self._version += 1
+
+    def refresh(self):
+        """Перестроить битовые множества, если каталог изменился; вернуть (bitmaps, universe)"""
+        with self._lock:
+            if self._built_version == self._version:
+                return self._bitmaps, self._universe
+            version = self._version
+
+        columns = (Sneaker.id, Sneaker.brand, Sneaker.gender, Sneaker.category,
+                   Sneaker.size, Sneaker.price_kopecks, Sneaker.in_stock)
+        # Сначала собираем id по значениям: OR в большое целое на каждой строке
+        # копировал бы все множество, и построение было бы квадратичным
+        ids = {facet: {} for facet in FACETS}
+        all_ids = []
+        for row in db.session.query(*columns):
+            all_ids.append(row.id)
+            for facet, (value_of, _) in FACETS.items():
+                value = value_of(row)
+                if value is not None:
+                    ids[facet].setdefault(value, []).append(row.id)
+
+        size = max(all_ids, default=0) + 1
+        bitmaps = {facet: {value: ids_to_bitmap(value_ids, size) for value, value_ids in values.items()}
+                   for facet, values in ids.items()}
+        universe = ids_to_bitmap(all_ids, size)
+
+        with self._lock:
+            # Если каталог изменился во время построения, индекс останется устаревшим
+            if version >= self._built_version:
+                self._bitmaps, self._universe = bitmaps, universe
+                self._built_version = version
+        return bitmaps, universe
+
+    def counts(self, selected):
+        """Счетчики по всем фасетам для выбранных значений {фасет: множество значений}"""
+        bitmaps, universe = self.refresh()
+        masks = {}
+        for facet, values in selected.items():
+            mask = 0
+            for value in values:
+                mask |= bitmaps[facet].get(value, 0)
+            masks[facet] = mask
+
+        facets = {}
+        for facet, values in bitmaps.items():
+            mask = universe
+            for other, other_mask in masks.items():
+                if other != facet:
+                    mask &= other_mask
+            facets[facet] = {value: (bitmap & mask).bit_count() for value, bitmap in values.items()}
+
+        total = universe
+        for mask in masks.values():
+            total &= mask
+        return {'total': total.bit_count(), 'facets': facets}
+
+facet_index = FacetIndex()
+
+@on_catalog_change
+def invalidate_facet_index(changed_ids):
+    facet_index.invalidate()
+
+# Похожие товары: признаки товаров в массивах NumPy и заранее посчитанные соседи
+
+SIMILAR_TOP_K = 20  # Сколько соседей хранится для каждого товара
+SIMILAR_DEFAULT_LIMIT = 10  # Число похожих товаров в ответе по умолчанию
+SIMILAR_PRICE_WINDOW = 100  # Кандидатов с каждой стороны по цене среди товаров той же категории и пола
+SIMILAR_BLOCK_ROWS = 2048  # Товаров, соседи которых считаются одной операцией над массивами
+SIMILAR_COOCCURRENCE_INTERVAL = 60  # Как часто подхватывать новые заказы и корзины, секунд
+# Вес совпадения категориальных признаков
+SIMILAR_CATEGORICAL_WEIGHTS = {'brand': 3.0, 'category': 2.0, 'gender': 2.0, 'color_name': 1.0}
+SIMILAR_PRICE_WEIGHT = 2.0  # Вес близости цены: exp(-|разность логарифмов цен| / SIMILAR_PRICE_SCALE)
+SIMILAR_PRICE_SCALE = 0.25
+SIMILAR_YEAR_WEIGHT = 1.0  # Вес близости года выпуска: exp(-|разность лет| / SIMILAR_YEAR_SCALE)
+SIMILAR_YEAR_SCALE = 2.0
+SIMILAR_COOCCURRENCE_WEIGHT = 4.0  # Предел прибавки за совместные покупки: вес * n / (n + SIMILAR_COOCCURRENCE_HALF)
+SIMILAR_COOCCURRENCE_HALF = 2.0
+# Источники совместной встречаемости: модель, колонка группировки строк, вес одной пары
+SIMILAR_COOCCURRENCE_SOURCES = ((OrderItem, 'order_id', 2.0), (BasketItem, 'user_id', 1.0))
+
+class SimilarIndex:
+    """Похожие товары для каждого товара каталога, посчитанные заранее.
+
+    Признаки товаров хранятся в массивах NumPy: коды бренда, категории,
+    пола и цвета, логарифм цены и год выпуска. Кандидаты в соседи - товары
+    той же категории и пола, ближайшие по цене (окно в отсортированном
+    порядке), и товары, которые покупали или клали в корзину вместе
+    с данным. Кандидаты ранжируются по взвешенной сумме сходства признаков
+    и совместной встречаемости; SIMILAR_TOP_K лучших хранятся в матрице,
+    и запрос соседей - чтение ее строки.
+    Строится при первом обращении; после изменения каталога и появления
+    новых заказов пересчитываются только товары, чьи кандидаты могли измениться.
+    """
+
+    def __init__(self):
+        self._dirty_ids = set()
+        self._built = False
+        self._resync = False
+        self._cooccurrence_checked = float('-inf')
+        self._lock = threading.Lock()
+
+    def mark_dirty(self, ids):
+        """Пометить товары для пересчета; None - сверить индекс со всем каталогом"""
+        with self._lock:
+            if ids is None:
+                self._resync = True
+            else:
+                self._dirty_ids.update(ids)
+
+    def _load_products(self, ids=None):
+        columns = [getattr(Sneaker, name) for name in SIMILAR_CATEGORICAL_WEIGHTS]
+        query = select(Sneaker.id, Sneaker.model, Sneaker.price_kopecks, Sneaker.release_year, *columns)
+        if ids is not None:
+            query = query.where(Sneaker.id.in_(ids))
+        return db.session.execute(query).all()
+
+    @staticmethod
+    def _code(vocabulary, value):
+        return vocabulary.setdefault(value, len(vocabulary)) if value is not None else -1
+
+    def _set_features(self, row, product):
+        for column, name in enumerate(SIMILAR_CATEGORICAL_WEIGHTS):
+            self._codes[row, column] = self._code(self._vocabularies[column], getattr(product, name))
+        # Размеры одной модели одного цвета не считаются похожими товарами друг для друга
+        self._variants[row] = self._code(self._variant_vocabulary, (product.brand, product.model, product.color_name))
+        self._log_prices[row] = math.log(max(product.price_kopecks, 1))
+        self._years[row] = product.release_year if product.release_year is not None else np.nan
+        self._hashes[row] = hash(tuple(product))
+        self._active[row] = True
+
+    def _append(self, products):
+        """Добавить строки признаков для новых товаров"""
+        start, count = len(self._ids), len(products)
+        self._ids = np.concatenate([self._ids, np.zeros(count, np.int64)])
+        self._codes = np.concatenate([self._codes, np.full((count, len(SIMILAR_CATEGORICAL_WEIGHTS)), -1, np.int32)])
+        self._variants = np.concatenate([self._variants, np.zeros(count, np.int32)])
+        self._log_prices = np.concatenate([self._log_prices, np.zeros(count, np.float32)])
+        self._years = np.concatenate([self._years, np.zeros(count, np.float32)])
+        self._hashes = np.concatenate([self._hashes, np.zeros(count, np.int64)])
+        self._active = np.concatenate([self._active, np.zeros(count, bool)])
+        self._neighbors = np.concatenate([self._neighbors, np.full((count, SIMILAR_TOP_K), -1, np.int64)])
+        for row, product in enumerate(products, start):
+            self._ids[row] = product.id
+            self._positions[product.id] = row
+            self._set_features(row, product)
+
+    def _sort(self):
+        """Упорядочить действующие товары по категории, полу и цене; запомнить границы групп"""
+        gender_codes = len(self._vocabularies[2]) + 1
+        groups = self._codes[:, 1].astype(np.int64) * gender_codes + self._codes[:, 2]
+        rows = np.flatnonzero(self._active)
+        self._order = rows[np.lexsort((self._log_prices[rows], groups[rows]))]
+        sorted_groups = groups[self._order]
+        self._rank = np.full(len(self._ids), -1, np.int64)
+        self._rank[self._order] = np.arange(len(self._order))
+        self._group_start = np.zeros(len(self._ids), np.int64)
+        self._group_end = np.zeros(len(self._ids), np.int64)
+        self._group_start[self._order] = np.searchsorted(sorted_groups, sorted_groups, side='left')
+        self._group_end[self._order] = np.searchsorted(sorted_groups, sorted_groups, side='right')
+
+    def _window_rows(self, rows):
+        """Товары, в окно кандидатов которых попадают rows"""
+        ranks = self._rank[rows]
+        window = (ranks[ranks >= 0][:, None] + np.arange(-SIMILAR_PRICE_WINDOW, SIMILAR_PRICE_WINDOW + 1)).ravel()
+        return self._order[window[(window >= 0) & (window < len(self._order))]]
+
+    def _load_cooccurrence(self):
+        """Учесть пары товаров из заказов и корзин, появившиеся после прошлой проверки.
+
+        Пара засчитывается один раз - строке, добавленной позже. Возвращает
+        ID товаров, у которых изменилась совместная встречаемость.
+        """
+        changed = set()
+        for source, (model, group, weight) in enumerate(SIMILAR_COOCCURRENCE_SOURCES):
+            # id таблиц-источников не повторяются (AUTOINCREMENT), поэтому новые строки - это id выше знака
+            last_id = db.session.scalar(select(func.max(model.id))) or 0
+            if last_id <= self._watermarks[source]:
+                continue
+            new, old = aliased(model), aliased(model)
+            pairs = db.session.execute(
+                select(new.sneaker_id, old.sneaker_id, func.count())
+                .join(old, and_(getattr(old, group) == getattr(new, group), old.id < new.id,
+                                old.sneaker_id != new.sneaker_id))
+                .where(new.id > self._watermarks[source], new.id <= last_id)
+                .group_by(new.sneaker_id, old.sneaker_id)
+            )
+            for first, second, count in pairs:
+                for sneaker_id, other_id in ((first, second), (second, first)):
+                    related = self._cooccurrence.setdefault(sneaker_id, {})
+                    related[other_id] = related.get(other_id, 0) + weight * count
+                changed.update((first, second))
+            self._watermarks[source] = last_id
+        return changed
+
+    def _score(self, rows, candidates):
+        """Сходство товаров rows (B) с кандидатами (B x C строк, -1 - пусто) по признакам"""
+        others = np.where(candidates >= 0, candidates, 0)
+        scores = np.zeros(candidates.shape, np.float32)
+        for column, weight in enumerate(SIMILAR_CATEGORICAL_WEIGHTS.values()):
+            own = self._codes[rows, column][:, None]
+            scores += weight * ((self._codes[others, column] == own) & (own >= 0))
+        price_distance = np.abs(self._log_prices[others] - self._log_prices[rows][:, None])
+        scores += SIMILAR_PRICE_WEIGHT * np.exp(-price_distance / SIMILAR_PRICE_SCALE)
+        year_distance = np.abs(self._years[others] - self._years[rows][:, None])
+        scores += SIMILAR_YEAR_WEIGHT * np.nan_to_num(np.exp(-year_distance / SIMILAR_YEAR_SCALE))
+        scores[(candidates < 0) | ~self._active[others] | (self._variants[others] == self._variants[rows][:, None])] = -np.inf
+        return scores
+
+    def _recompute(self, rows):
+        """Пересчитать соседей товаров rows пачками по SIMILAR_BLOCK_ROWS"""
+        self._neighbors[rows] = -1
+        if not len(self._order):
+            return
+        offsets = np.arange(-SIMILAR_PRICE_WINDOW, SIMILAR_PRICE_WINDOW + 1)
+        for start in range(0, len(rows), SIMILAR_BLOCK_ROWS):
+            block = rows[start:start + SIMILAR_BLOCK_ROWS]
+            ranks = self._rank[block]
+            window = ranks[:, None] + offsets
+            inside = ((ranks[:, None] >= 0) & (window >= self._group_start[block][:, None])
+                      & (window < self._group_end[block][:, None]))
+            candidates = np.where(inside, self._order[np.clip(window, 0, len(self._order) - 1)], -1)
+            bonus = np.zeros(candidates.shape, np.float32)
+
+            # Совместная встречаемость: прибавка кандидатам из окна, остальные связанные товары - дополнительные кандидаты
+            extra = []
+            for i, row in enumerate(block):
+                extra.append([])
+                for other_id, count in self._cooccurrence.get(int(self._ids[row]), {}).items():
+                    other = self._positions.get(other_id)
+                    if other is None:
+                        continue
+                    value = SIMILAR_COOCCURRENCE_WEIGHT * count / (count + SIMILAR_COOCCURRENCE_HALF)
+                    column = self._rank[other] - ranks[i] + SIMILAR_PRICE_WINDOW
+                    if 0 <= column < len(offsets) and candidates[i, column] == other:
+                        bonus[i, column] += value
+                    else:
+                        extra[i].append((other, value))
+            width = max(map(len, extra))
+            if width:
+                extra_candidates = np.full((len(block), width), -1, np.int64)
+                extra_bonus = np.zeros((len(block), width), np.float32)
+                for i, related in enumerate(extra):
+                    for column, (other, value) in enumerate(related):
+                        extra_candidates[i, column], extra_bonus[i, column] = other, value
+                candidates = np.hstack([candidates, extra_candidates])
+                bonus = np.hstack([bonus, extra_bonus])
+
+            scores = self._score(block, candidates) + bonus
+            k = min(SIMILAR_TOP_K, candidates.shape[1])
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable'), axis=1)
+            neighbors = np.take_along_axis(candidates, top, axis=1)
+            neighbors[np.isneginf(np.take_along_axis(scores, top, axis=1))] = -1
+            self._neighbors[block, :k] = neighbors
+
+    def _build(self):
+        self._ids = np.zeros(0, np.int64)
+        self._codes = np.zeros((0, len(SIMILAR_CATEGORICAL_WEIGHTS)), np.int32)
+        self._variants = np.zeros(0, np.int32)
+        self._log_prices = np.zeros(0, np.float32)
+        self._years = np.zeros(0, np.float32)
+        self._hashes = np.zeros(0, np.int64)  # хеш признаков для сверки с каталогом
+        self._active = np.zeros(0, bool)
+        self._neighbors = np.zeros((0, SIMILAR_TOP_K), np.int64)
+        self._positions = {}  # id товара -> строка массивов
+        self._vocabularies = [{} for _ in SIMILAR_CATEGORICAL_WEIGHTS]
+        self._variant_vocabulary = {}
+        self._cooccurrence = {}  # id товара -> {id связанного товара: вес}
+        self._watermarks = [0] * len(SIMILAR_COOCCURRENCE_SOURCES)  # последний учтенный id строки источника
+        self._append(self._load_products())
+        self._load_cooccurrence()
+        self._sort()
+        self._recompute(np.arange(len(self._ids)))
+
+    def _changed_products(self):
+        """Сверить индекс со всем каталогом: ID измененных, новых и удаленных товаров и строки товаров"""
+        products, seen = [], set()
+        for product in self._load_products():
+            seen.add(product.id)
+            row = self._positions.get(product.id)
+            if row is None or not self._active[row] or self._hashes[row] != hash(tuple(product)):
+                products.append(product)
+        removed = [sneaker_id for sneaker_id in self._ids[self._active].tolist() if sneaker_id not in seen]
+        return [product.id for product in products] + removed, products
+
+    def _update_products(self, ids, products):
+        """Обновить признаки измененных товаров; вернуть строки, соседей которых нужно пересчитать"""
+        indexed = [self._positions[sneaker_id] for sneaker_id in ids if sneaker_id in self._positions]
+        affected = [self._window_rows(np.array(indexed, np.int64))]  # окна до изменения
+
+        found = {product.id for product in products}
+        for row in indexed:
+            if int(self._ids[row]) not in found:
+                self._active[row] = False
+        for product in products:
+            if product.id in self._positions:
+                self._set_features(self._positions[product.id], product)
+        self._append([product for product in products if product.id not in self._positions])
+        self._sort()
+
+        changed = np.array([self._positions[sneaker_id] for sneaker_id in ids if sneaker_id in self._positions], np.int64)
+        affected.append(changed)
+        affected.append(self._window_rows(changed))  # окна после изменения
+        affected.append(np.flatnonzero(np.isin(self._neighbors, changed).any(axis=1)))
+        affected.append(np.array([self._positions[other_id] for sneaker_id in ids
+                                  for other_id in self._cooccurrence.get(sneaker_id, ())
+                                  if other_id in self._positions], np.int64))
+        return set(np.concatenate(affected).tolist())
+
+    def refresh(self):
+        """Построить индекс при первом обращении, применить изменения каталога и новые заказы"""
+        with self._lock:
+            now = time.monotonic()
+            if not self._built:
+                self._dirty_ids.clear()
+                self._resync = False
+                self._build()
+                self._built = True
+                self._cooccurrence_checked = now
+                return
+            affected = set()
+            if self._resync:
+                # Каталог изменил другой процесс: ID изменений неизвестны, признаки сверяются по хешам
+                self._resync = False
+                self._dirty_ids.clear()
+                affected |= self._update_products(*self._changed_products())
+            elif self._dirty_ids:
+                ids = list(self._dirty_ids)
+                self._dirty_ids.clear()
+                affected |= self._update_products(ids, self._load_products(ids))
+            if now - self._cooccurrence_checked >= SIMILAR_COOCCURRENCE_INTERVAL:
+                self._cooccurrence_checked = now
+                affected.update(self._positions[sneaker_id] for sneaker_id in self._load_cooccurrence()
+                                if sneaker_id in self._positions)
+            if affected:
+                self._recompute(np.array(sorted(affected), np.int64))
+
+    def similar(self, item_id, limit):
+        """ID похожих товаров по убыванию сходства; None, если товара нет в каталоге"""
+        self.refresh()
+        with self._lock:
+            row = self._positions.get(item_id)
+            if row is None or not self._active[row]:
+                return None
+            neighbors = self._neighbors[row]
+            return self._ids[neighbors[neighbors >= 0][:limit]].tolist()
+
+similar_index = SimilarIndex()
+
+@on_catalog_change
+def reindex_similar_sneakers(changed_ids):
+    similar_index.mark_dirty(changed_ids)
+
+# Кэш пользователей для маршрутов с JWT (общий для воркеров при заданном CACHE_PATH)
+
+USERS_NAMESPACE = 'users'
+
+class UserCache:
+    """LRU-кэш строк User с ограниченным временем жизни записей.
+
+    Хранит поля строк User, загруженных по identity из JWT, и отдает по
+    ним отсоединенные от сессии объекты, чтобы защищенные маршруты не
+    читали пользователя из БД на каждый запрос. Хеш пароля в кэш не
+    попадает. Записи сбрасываются после commit изменений пользователя
+    (во всех воркерах при общем бэкенде).
+    """
+
+    FIELDS = ('id', 'email', 'first_name', 'last_name', 'phone', 'is_admin', 'created_at')
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = LocalCacheBackend()
+
+    def init_app(self, app):
+        self.max_size = app.config['USER_CACHE_SIZE']
+        self.ttl = app.config['USER_CACHE_TTL']
+        self.backend = cache_backend(app)
+
+    def get(self, user_id):
+        """Получить (отсоединенный пользователь или None, версия кэша для последующего put)"""
+        fields, version = self.backend.get(USERS_NAMESPACE, user_id)
+        if fields is None:
+            return None, version
+        user = User(**dict(fields, created_at=fields['created_at'] and datetime.fromisoformat(fields['created_at'])))
+        make_transient_to_detached(user)
+        return user, version
+
+    def put(self, user_id, user, version):
+        """Сохранить пользователя, если кэш не сбрасывался после начала загрузки"""
+        fields = {name: getattr(user, name) for name in self.FIELDS}
+        fields['created_at'] = fields['created_at'] and fields['created_at'].isoformat()
+        self.backend.set(USERS_NAMESPACE, user_id, fields, version, ttl=self.ttl, max_size=self.max_size)
+
+    def invalidate(self, user_ids):
+        """Удалить пользователей из кэша"""
+        self.backend.delete(USERS_NAMESPACE, user_ids)
+
+user_cache = UserCache()
+
+@jwt.user_lookup_loader
+def load_current_user(jwt_header, jwt_data):
+    """Пользователь по identity из JWT: из кэша, при промахе - из БД"""
+    user_id = int(jwt_data['sub'])
+    user, version = user_cache.get(user_id)
+    if user is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        user_cache.put(user_id, user, version)
+    return user
+
+@jwt.user_lookup_error_loader
+def user_not_found(jwt_header, jwt_data):
+    return jsonify({'error': 'Пользователь не найден'}), 404
+
+# Сброс кэша пользователей после commit изменений (по аналогии с каталогом)
+def record_user_change(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('user_changes', set()).add(target.id)
+
+for _event_name in ('after_update', 'after_delete'):
+    event.listen(User, _event_name, record_user_change)
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_changed_users(session):
+    changed_ids = session.info.pop('user_changes', None)
+    if changed_ids:
+        user_cache.invalidate(changed_ids)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_user_changes(session, previous_transaction):
+    session.info.pop('user_changes', None)
+
+# Хеширование паролей в отдельном пуле процессов
+
+# bcrypt учитывает только первые 72 байта пароля; bcrypt>=5 выбрасывает
+# ошибку на более длинных паролях, поэтому обрезаем явно (совместимо со старыми хешами)
+BCRYPT_MAX_PASSWORD_BYTES = 72
+
+def hash_password_blocking(password, rounds):
+    """Вычислить bcrypt-хеш пароля (выполняется в процессе пула)"""
+    password = password.encode('utf-8')[:BCRYPT_MAX_PASSWORD_BYTES]
+    return bcrypt_lib.hashpw(password, bcrypt_lib.gensalt(rounds)).decode('utf-8')
+
+def check_password_blocking(password, password_hash):
+    """Проверить пароль по bcrypt-хешу (выполняется в процессе пула)"""
+    password = password.encode('utf-8')[:BCRYPT_MAX_PASSWORD_BYTES]
+    return bcrypt_lib.checkpw(password, password_hash.encode('utf-8'))
+
+class PasswordHasherBusy(Exception):
+    """Все слоты хеширования паролей заняты"""
+
+class PasswordHasher:
+    """Хеширование паролей в ограниченном пуле процессов с контролем очереди.
+
+    bcrypt занимает CPU на сотни миллисекунд, поэтому вычисления вынесены из
+    потока запроса. Если уже выполняется max_pending операций, новая
+    операция сразу отклоняется с PasswordHasherBusy вместо ожидания в очереди.
+    """
+
+    def __init__(self, rounds=12, workers=2, max_pending=4):
+        self.rounds = rounds
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self._slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_MAX_PENDING'])
+
+    def _get_executor(self):
+        # Пул создается в каждом процессе: пул, унаследованный воркером
+        # gunicorn от мастер-процесса после fork, непригоден.
+        # Процессы пула запускаются через forkserver, а не fork: копия
+        # многопоточного воркера могла бы унаследовать захваченные другими
+        # потоками блокировки (журналирования, пула соединений) и зависнуть.
+        # Сервер fork импортирует модуль приложения один раз, процессы пула
+        # получают его готовым
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([__name__])
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def start(self):
+        """Запустить процессы пула заранее (в воркере gunicorn после fork), а не при первом входе"""
+        if self.workers == 0:
+            return
+        executor = self._get_executor()
+        # Процессы запускаются по мере надобности: одновременные задачи поднимают их все
+        for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def _run(self, operation, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            metrics.inc('password_hash_rejected_total', (operation,))
+            raise PasswordHasherBusy()
+        started = time.perf_counter()
+        try:
+            if self.workers == 0:
+                return fn(*args)
+            return self._get_executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+            metrics.observe('password_hash_duration_seconds', (operation,), time.perf_counter() - started)
+
+    def hash(self, password):
+        """Получить хеш пароля с настроенной стоимостью"""
+        return self._run('hash', hash_password_blocking, password, self.rounds)
+
+    def verify(self, password, password_hash):
+        """Проверить пароль по сохраненному хешу"""
+        return self._run('verify', check_password_blocking, password, password_hash)
+
+    def needs_rehash(self, password_hash):
+        """Отличается ли стоимость сохраненного хеша ($2b$<cost>$...) от настроенной"""
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+password_hasher = PasswordHasher()
+
+def password_hasher_busy_response():
+    """Быстрый отказ при перегрузке хеширования паролей"""
+    response = jsonify({'error': 'Сервер перегружен, повторите попытку позже'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+# API маршруты для аутентификации пользователей
+
+@bp.route('/auth/register', methods=['POST'])
+def register():
+    """Регистрация нового пользователя в системе"""
+    data = request.get_json()
+
+    # Валидация обязательных полей для регистрации
+    if not data.get('email') or not data.get('password'):
+        return jsonify({'error': 'Email и пароль обязательны'}), 400
+
+    # Проверка на существование пользователя с таким email
+    if User.query.filter_by(email=data['email']).first():
+        return jsonify({'error': 'Пользователь с таким email уже существует'}), 400
+
+    # Создание нового пользователя с хешированием пароля
+    try:
+        hashed_password = password_hasher.hash(data['password'])
+    except PasswordHasherBusy:
+        return password_hasher_busy_response()
+    new_user = User(
+        email=data['email'],
+        password_hash=hashed_password,
+        first_name=data.get('first_name'),
+        last_name=data.get('last_name'),
+        phone=data.get('phone')
+    )
+
+    # Сохранение пользователя в базе данных
+    db.session.add(new_user)
+    db.session.commit()
+
+    # Генерация JWT токена для автоматического входа после регистрации
+    access_token = create_access_token(identity=str(new_user.id))
+
+    return jsonify({
+        'message': 'Пользователь успешно зарегистрирован',
+        'access_token': access_token,
+        'user': new_user.to_dict()
+    }), 201
+
+@bp.route('/auth/login', methods=['POST'])
+def login():
+    """Аутентификация пользователя и вход в систему"""
+    data = request.get_json()
+
+    # Проверка наличия обязательных полей
+    if not data.get('email') or not data.get('password'):
+        return jsonify({'error': 'Email и пароль обязательны'}), 400
+
+    # Поиск пользователя в базе данных по email
+    user = User.query.filter_by(email=data['email']).first()
+
+    # Проверка существования пользователя и корректности пароля
+    try:
+        if not user or not password_hasher.verify(data['password'], user.password_hash):
+            return jsonify({'error': 'Неверный email или пароль'}), 401
+    except PasswordHasherBusy:
+        return password_hasher_busy_response()
+
+    # Прозрачное перехеширование, если стоимость bcrypt в конфигурации изменилась
+    if password_hasher.needs_rehash(user.password_hash):
+        try:
+            user.password_hash = password_hasher.hash(data['password'])
+            db.session.commit()
+        except PasswordHasherBusy:
+            pass  # Перехешируем при одном из следующих входов
+
+    # Генерация JWT токена для сессии пользователя
+    access_token = create_access_token(identity=str(user.id))
+
+    return jsonify({
+        'message': 'Вход выполнен успешно',
+        'access_token': access_token,
+        'user': user.to_dict()
+    }), 200
+
+@bp.route('/auth/profile', methods=['GET'])
+@cache_control(PRIVATE_CACHE_CONTROL)
+@jwt_required()
+def get_profile():
+    """Получение данных профиля текущего аутентифицированного пользователя"""
+    return jsonify(current_user.to_dict()), 200
+
+@bp.route('/auth/profile', methods=['PUT'])
+@cache_control(PRIVATE_CACHE_CONTROL)
+@jwt_required()
+def update_profile():
+    """Обновление данных профиля текущего пользователя"""
+    user_id = get_jwt_identity()
+    user = User.query.get(user_id)
+    data = request.get_json()
+
+    if not user:
+        return jsonify({'error': 'Пользователь не найден'}), 404
+
+    # Обновление разрешенных полей профиля
+    if 'first_name' in data:
+        user.first_name = data['first_name']
+    if 'last_name' in data:
+        user.last_name = data['last_name']
+    if 'phone' in data:
+        user.phone = data['phone']
+
+    # Сохранение изменений в базе данных
+    db.session.commit()
+
+    return jsonify({
+        'message': 'Профиль обновлен',
+        'user': user.to_dict()
+    }), 200
+
+# API маршруты для работы с каталогом товаров
+
+# Параметры пагинации каталога
+CATALOG_DEFAULT_LIMIT = 100  # Размер страницы каталога по умолчанию
+CATALOG_MAX_LIMIT = 500  # Максимальный размер страницы каталога
+
+def parse_bool(value):
+    """Разбор булевого параметра строки запроса (true/false, 1/0, yes/no)"""
+    value = value.strip().lower()
+    if value in ('1', 'true', 'yes'):
+        return True
+    if value in ('0', 'false', 'no'):
+        return False
+    raise ValueError(value)
+
+def parse_cursor_id(value):
+    """ID из курсора пагинации; вне диапазона первичных ключей - ValueError"""
+    cursor_id = int(value)
+    if not 1 <= cursor_id <= DB_INTEGER_MAX:
+        raise ValueError(value)
+    return cursor_id
+
+def parse_catalog_args(args):
+    """Разбор фильтров и параметров пагинации каталога из строки запроса.
+
+    Возвращает словарь с фильтрами, курсором after и лимитом страницы.
+    При некорректных значениях выбрасывает ValueError с текстом ошибки.
+    """
+    params = {}
+    for name in ('brand', 'gender', 'category'):
+        if args.get(name):
+            params[name] = args[name]
+    try:
+        if args.get('size'):
+            params['size'] = float(args['size'])
+        # Границы цены задаются в рублях, фильтруются по копейкам
+        for name in ('min_price', 'max_price'):
+            if args.get(name):
+                params[name] = to_kopecks(args[name])
+        if args.get('in_stock'):
+            params['in_stock'] = parse_bool(args['in_stock'])
+        params['after'] = parse_cursor_id(args['after']) if args.get('after') else None
+        params['limit'] = int(args.get('limit', CATALOG_DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError('Некорректные параметры фильтрации каталога')
+    if not 1 <= params['limit'] <= CATALOG_MAX_LIMIT:
+        raise ValueError(f'Параметр limit должен быть от 1 до {CATALOG_MAX_LIMIT}')
+    return params
+
+def catalog_query(params):
+    """Запрос страницы каталога: фильтры, курсор по ID и стабильная сортировка по ID"""
+    query = Sneaker.query
+    for name in ('brand', 'gender', 'category', 'size', 'in_stock'):
+        if name in params:
+            query = query.filter(getattr(Sneaker, name) == params[name])
+    if 'min_price' in params:
+        query = query.filter(Sneaker.price_kopecks >= params['min_price'])
+    if 'max_price' in params:
+        query = query.filter(Sneaker.price_kopecks <= params['max_price'])
+    if params['after'] is not None:
+        query = query.filter(Sneaker.id > params['after'])
+    return query.order_by(Sneaker.id).limit(params['limit'])
+
+@bp.route('/catalog', methods=['GET'])
+@cache_control(CATALOG_CACHE_CONTROL, vary=['Accept-Encoding'])
+@read_from_replica
+def get_products():
+    """Получить страницу товаров каталога с фильтрами и keyset-пагинацией.
+
+    Фильтры: brand, gender, category, size, min_price, max_price, in_stock.
+    Пагинация: ?after=<id последнего товара>&limit=<размер страницы>.
+    Курсор следующей страницы возвращается в заголовке X-Next-Cursor.
+    """
+    try:
+        params = parse_catalog_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    key = ('list',) + tuple(sorted(params.items()))
+    return catalog_cache.respond(key, lambda: build_catalog_page(params))
+
+def build_catalog_page(params):
+    """Построить страницу каталога и заголовки пагинации для кэша"""
+    items = catalog_query(params).all()
+    headers = {}
+
+    # Полная страница означает, что дальше могут быть еще товары
+    if len(items) == params['limit']:
+        next_cursor = str(items[-1].id)
+        next_args = {k: v for k, v in params.items() if v is not None}
+        # Границы цены в параметрах уже в копейках, а строка запроса принимает рубли
+        for name in ('min_price', 'max_price'):
+            if name in next_args:
+                next_args[name] = to_rubles(next_args[name])
+        next_args['after'] = next_cursor
+        headers['X-Next-Cursor'] = next_cursor
+        headers['Link'] = f'<{url_for("api.get_products", **next_args)}>; rel="next"'
+    return [item.to_dict() for item in items], headers
+
+@bp.route('/catalog/facets', methods=['GET'])
+@cache_control(CATALOG_CACHE_CONTROL, vary=['Accept-Encoding'])
+@read_from_replica
+def get_facets():
+    """Счетчики товаров по фасетам (brand, gender, category, size, price, in_stock).
+
+    Фильтры передаются теми же именами, несколько значений одного фасета
+    объединяются: ?brand=Nike&brand=Adidas&price=10000-15000
+    """
+    selected = {}
+    try:
+        for facet, (_, normalize) in FACETS.items():
+            values = request.args.getlist(facet)
+            if values:
+                selected[facet] = {normalize(value) for value in values}
+    except ValueError:
+        return jsonify({'error': 'Некорректные параметры фильтрации каталога'}), 400
+    return jsonify(facet_index.counts(selected))
+
+EXPORT_BATCH_SIZE = 1000  # Строк, читаемых из серверного курсора за раз при выгрузке
+
+@bp.route('/catalog/export', methods=['GET'])
+@read_from_replica
+def export_catalog():
+    """Потоковая выгрузка каталога в формате NDJSON (один товар в строке).
+
+    ?since=<ISO дата> выгружает только товары, измененные начиная с этого момента,
+    в порядке изменения (полная выгрузка идет по ID).
+    Заголовок X-Export-Snapshot содержит время начала выгрузки минус
+    EXPORT_SNAPSHOT_MARGIN: его нужно передать как since при следующей
+    инкрементальной выгрузке. updated_at ставится в момент записи, а строка
+    видна только после коммита, поэтому без запаса транзакция, начатая до
+    выгрузки и закоммиченная после нее, выпала бы из обеих выгрузок; товары
+    из этого окна выгружаются повторно, получатель обновляет их по ID.
+    Память не зависит от размера каталога: строки читаются пачками
+    из серверного курсора и сразу отправляются клиенту.
+    """
+    snapshot = datetime.utcnow() - timedelta(seconds=current_app.config['EXPORT_SNAPSHOT_MARGIN'])
+    query = select(Sneaker).order_by(Sneaker.id)
+    if request.args.get('since'):
+        try:
+            since = datetime.fromisoformat(request.args['since'])
+        except ValueError:
+            return jsonify({'error': 'Некорректный параметр since'}), 400
+        # Порядок (updated_at, id) совпадает с индексом: читаются только измененные товары
+        query = select(Sneaker).where(Sneaker.updated_at >= since).order_by(Sneaker.updated_at, Sneaker.id)
+
+    def generate():
+        result = db.session.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        for partition in result.scalars().partitions():
+            yield ''.join(current_app.json.dumps(item.to_dict()) + '\n' for item in partition)
+        result.close()
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['X-Export-Snapshot'] = snapshot.isoformat()
+    return response
+
+# Параметры поиска по каталогу
+SEARCH_DEFAULT_LIMIT = 20  # Число результатов поиска по умолчанию
+SEARCH_MAX_LIMIT = 100  # Максимальное число результатов поиска
+
+@bp.route('/catalog/search', methods=['GET'])
+@cache_control(CATALOG_CACHE_CONTROL, vary=['Accept-Encoding'])
+@read_from_replica
+def search_products():
+    """Полнотекстовый поиск по каталогу: ?q=<запрос>&limit=<число результатов>"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Параметр q обязателен'}), 400
+    try:
+        limit = int(request.args.get('limit', SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        return jsonify({'error': f'Параметр limit должен быть от 1 до {SEARCH_MAX_LIMIT}'}), 400
+
+    ids = search_index.search(query, limit)
+    if not ids:
+        return jsonify([])
+
+    # Загрузка найденных товаров по первичному ключу с сохранением порядка ранжирования
+    items = {item.id: item for item in Sneaker.query.filter(Sneaker.id.in_(ids))}
+    return jsonify([items[item_id].to_dict() for item_id in ids if item_id in items])
+
+@bp.route('/catalog/<int:item_id>', methods=['GET'])
+@cache_control(CATALOG_CACHE_CONTROL, vary=['Accept-Encoding'])
+@read_from_replica
+def get_product(item_id):
+    """Получить детальную информацию о конкретном товаре по его ID"""
+    def build():
+        item = Sneaker.query.get(item_id)
+        return (item.to_dict(), {}) if item else None
+
+    response = catalog_cache.respond(('item', item_id), build)
+    if response is not None:
+        return response
+    return jsonify({'error': 'Товар не найден'}), 404
+
+@bp.route('/catalog/<int:item_id>/similar', methods=['GET'])
+@cache_control(CATALOG_CACHE_CONTROL, vary=['Accept-Encoding'])
+@read_from_replica
+def get_similar_products(item_id):
+    """Похожие товары: ?limit=<число товаров>.
+
+    Соседи берутся из заранее посчитанного индекса похожих товаров,
+    из базы по первичному ключу читаются только сами найденные товары.
+    """
+    try:
+        limit = int(request.args.get('limit', SIMILAR_DEFAULT_LIMIT))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= SIMILAR_TOP_K:
+        return jsonify({'error': f'Параметр limit должен быть от 1 до {SIMILAR_TOP_K}'}), 400
+
+    ids = similar_index.similar(item_id, limit)
+    if ids is None:
+        return jsonify({'error': 'Товар не найден'}), 404
+    if not ids:
+        return jsonify([])
+    items = {item.id: item for item in Sneaker.query.filter(Sneaker.id.in_(ids))}
+    return jsonify([items[sneaker_id].to_dict() for sneaker_id in ids if sneaker_id in items])
+
+# Резервирование складских остатков
+
+# INSERT ... ON CONFLICT DO UPDATE для поддерживаемых диалектов
+UPSERT_INSERTS = {
+    'postgresql': postgresql_insert,
+    'sqlite': sqlite_insert,
+}
+
+class InsufficientStock(Exception):
+    """На складе недостаточно товара нужного размера"""
+
+    def __init__(self, sneaker_id, size):
+        super().__init__(sneaker_id, size)
+        self.sneaker_id = sneaker_id
+        self.size = size
+
+def insufficient_stock_response(error, **extra):
+    """Ответ 409 для операции, которой не хватило остатка"""
+    return jsonify({
+        'error': 'Недостаточно товара на складе',
+        'sneaker_id': error.sneaker_id,
+        'size': error.size,
+        **extra
+    }), 409
+
+def stock_filter(sneaker_id, size):
+    return (Stock.sneaker_id == sneaker_id) & (Stock.size == size)
+
+def reservation_filter(user_id, sneaker_id, size):
+    return ((StockReservation.user_id == user_id)
+            & (StockReservation.sneaker_id == sneaker_id)
+            & (StockReservation.size == size))
+
+def take_stock(sneaker_id, size, quantity):
+    """Списать quantity со склада одним условным UPDATE (без чтения остатка).
+
+    Возвращает False, если остаток для размера не ведется (товар не
+    ограничен складом), и выбрасывает InsufficientStock, если его не хватает.
+    """
+    result = db.session.execute(
+        update(Stock)
+        .where(stock_filter(sneaker_id, size), Stock.quantity >= quantity)
+        .values(quantity=Stock.quantity - quantity),
+        execution_options={'synchronize_session': False}
+    )
+    if result.rowcount:
+        return True
+    # Дополнительный запрос только на пути отказа: отличаем "нет остатка" от "не ведется"
+    if db.session.scalar(select(Stock.id).where(stock_filter(sneaker_id, size))) is None:
+        return False
+    raise InsufficientStock(sneaker_id, size)
+
+def return_stock(sneaker_id, size, quantity):
+    """Вернуть quantity на склад"""
+    db.session.execute(
+        update(Stock)
+        .where(stock_filter(sneaker_id, size))
+        .values(quantity=Stock.quantity + quantity),
+        execution_options={'synchronize_session': False}
+    )
+
+def reservation_expires_at():
+    """Срок нового или продленного резерва"""
+    return datetime.utcnow() + timedelta(seconds=current_app.config['RESERVATION_TTL'])
+
+def reserve_stock(user_id, sneaker_id, size, quantity):
+    """Списать товар со склада и добавить его в резерв пользователя с новым сроком"""
+    if quantity <= 0 or not take_stock(sneaker_id, size, quantity):
+        return
+    expires_at = reservation_expires_at()
+    stmt = UPSERT_INSERTS[db.session.get_bind().dialect.name](StockReservation).values(
+        user_id=user_id,
+        sneaker_id=sneaker_id,
+        size=size,
+        quantity=quantity,
+        expires_at=expires_at
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id', 'sneaker_id', 'size'],
+        set_={'quantity': StockReservation.quantity + stmt.excluded.quantity, 'expires_at': expires_at}
+    ))
+
+def sync_reservation(user_id, sneaker_id, size, quantity):
+    """Привести резерв строки корзины к quantity (0 - снять резерв полностью).
+
+    Резерв меняется условным UPDATE/DELETE только если он все еще равен
+    прочитанному значению; иначе его успел изменить параллельный запрос,
+    и разница считается заново. Склад меняется ровно на эту разницу.
+    """
+    while True:
+        reserved = db.session.scalar(
+            select(StockReservation.quantity).where(reservation_filter(user_id, sneaker_id, size))
+        )
+        if reserved is None:
+            if quantity <= 0 or not take_stock(sneaker_id, size, quantity):
+                return
+            stmt = UPSERT_INSERTS[db.session.get_bind().dialect.name](StockReservation).values(
+                user_id=user_id,
+                sneaker_id=sneaker_id,
+                size=size,
+                quantity=quantity,
+                expires_at=reservation_expires_at()
+            )
+            if db.session.execute(stmt.on_conflict_do_nothing(index_elements=['user_id', 'sneaker_id', 'size'])).rowcount:
+                return
+            # Резерв создал параллельный запрос: списанное возвращается, разница считается от него
+            return_stock(sneaker_id, size, quantity)
+            continue
+        if reserved == quantity:
+            return
+
+        unchanged = reservation_filter(user_id, sneaker_id, size) & (StockReservation.quantity == reserved)
+        if quantity <= 0:
+            stmt = delete(StockReservation).where(unchanged)
+        elif quantity > reserved:
+            stmt = update(StockReservation).where(unchanged).values(quantity=quantity, expires_at=reservation_expires_at())
+        else:
+            stmt = update(StockReservation).where(unchanged).values(quantity=quantity)
+        if not db.session.execute(stmt, execution_options={'synchronize_session': False}).rowcount:
+            continue
+        if quantity > reserved:
+            take_stock(sneaker_id, size, quantity - reserved)
+        else:
+            return_stock(sneaker_id, size, reserved - max(quantity, 0))
+        return
+
+def consume_reservations(user_id, lines):
+    """Превратить резервы строк корзины в проданный товар при оформлении заказа.
+
+    lines - строки корзины (sneaker_id, size, quantity). Резервы удаляются
+    одним DELETE ... RETURNING, поэтому учитывается ровно то, что не успел
+    вернуть сборщик; недостающее количество списывается со склада заново.
+    """
+    removed = db.session.execute(
+        delete(StockReservation)
+        .where(StockReservation.user_id == user_id)
+        .returning(StockReservation.sneaker_id, StockReservation.size, StockReservation.quantity),
+        execution_options={'synchronize_session': False}
+    ).all()
+    reserved = {(row.sneaker_id, row.size): row.quantity for row in removed}
+    # Какие строки вообще учитываются складом - одним запросом, без проверки по строкам;
+    # фильтр по sneaker_id (а не по паре) идет по индексу uq_stock_sneaker_size,
+    # лишние размеры тех же товаров просто не совпадут со строками корзины
+    tracked = set(db.session.execute(
+        select(Stock.sneaker_id, Stock.size)
+        .where(Stock.sneaker_id.in_({line[0] for line in lines}))
+    ).tuples()) if lines else set()
+    for sneaker_id, size, quantity in lines:
+        missing = quantity - reserved.pop((sneaker_id, size), 0)
+        if missing > 0 and (sneaker_id, size) in tracked:
+            take_stock(sneaker_id, size, missing)
+        elif missing < 0:
+            return_stock(sneaker_id, size, -missing)
+    # Резервы без строки корзины (корзина изменилась в обход API) возвращаются на склад
+    for (sneaker_id, size), quantity in reserved.items():
+        return_stock(sneaker_id, size, quantity)
+
+def release_expired_reservations():
+    """Вернуть на склад все истекшие резервы; возвращает их число"""
+    expired = db.session.execute(
+        delete(StockReservation)
+        .where(StockReservation.expires_at < datetime.utcnow())
+        .returning(StockReservation.sneaker_id, StockReservation.size, StockReservation.quantity),
+        execution_options={'synchronize_session': False}
+    ).all()
+    for row in expired:
+        return_stock(row.sneaker_id, row.size, row.quantity)
+    db.session.commit()
+    return len(expired)
+
+class ReservationSweeper(threading.Thread):
+    """Фоновый поток воркера, периодически возвращающий истекшие резервы на склад.
+
+    Несколько воркеров могут работать одновременно: каждый резерв
+    удаляется одним DELETE ... RETURNING и возвращается ровно один раз.
+    """
+
+    def __init__(self, app, interval):
+        super().__init__(name='reservation-sweeper', daemon=True)
+        self.app = app
+        self.interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.app.app_context():
+                try:
+                    release_expired_reservations()
+                except SQLAlchemyError:
+                    db.session.rollback()
+                    self.app.logger.exception('Не удалось вернуть истекшие резервы на склад')
+                finally:
+                    db.session.remove()
+
+def start_reservation_sweeper(app):
+    """Запустить сборщик истекших резервов (вызывается в каждом воркере после fork)"""
+    interval = app.config['RESERVATION_SWEEP_INTERVAL']
+    if interval > 0:
+        ReservationSweeper(app, interval).start()
+
+# API маршруты для работы с корзиной пользователя
+
+BASKET_BATCH_MAX_OPERATIONS = 100  # Максимум операций в одном запросе /basket/batch
+
+class BasketItemNotFound(Exception):
+    """Операция /basket/batch ссылается на отсутствующую или чужую строку корзины"""
+
+def upsert_basket_item(user_id, sneaker_id, size, quantity, replace=False):
+    """Добавить товар в корзину одним запросом без предварительного чтения.
+
+    Если строка (user_id, sneaker_id, size) уже есть, количество увеличивается
+    на quantity, а при replace=True заменяется им.
+    """
+    dialect = db.session.get_bind().dialect.name
+    stmt = UPSERT_INSERTS[dialect](BasketItem).values(
+        user_id=user_id,
+        sneaker_id=sneaker_id,
+        size=size,
+        quantity=quantity,
+        added_at=datetime.utcnow()
+    )
+    new_quantity = stmt.excluded.quantity if replace else BasketItem.quantity + stmt.excluded.quantity
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id', 'sneaker_id', 'size'],
+        set_={'quantity': new_quantity}
+    ))
+
+def load_basket(user_id):
+    """Элементы корзины пользователя вместе с товарами одним JOIN-запросом"""
+    return (
+        BasketItem.query
+        .options(joinedload(BasketItem.sneaker))
+        .filter_by(user_id=user_id)
+        .all()
+    )
+
+@bp.route('/basket', methods=['GET'])
+@cache_control(PRIVATE_CACHE_CONTROL)
+@jwt_required()
+def get_basket():
+    """Получить содержимое корзины текущего пользователя"""
+    user_id = get_jwt_identity()
+    return jsonify([item.to_dict() for item in load_basket(user_id)])
+
+@bp.route('/basket/summary', methods=['GET'])
+@cache_control(PRIVATE_CACHE_CONTROL)
+@jwt_required()
+def get_basket_summary():
+    """Краткая сводка корзины (число позиций, товаров и сумма) для счетчиков и мини-корзины.
+
+    Считается одним агрегирующим запросом с JOIN на товары, без загрузки строк корзины.
+    """
+    user_id = get_jwt_identity()
+    summary = db.session.execute(
+        select(
+            func.count(BasketItem.id).label('lines'),
+            func.coalesce(func.sum(BasketItem.quantity), 0).label('quantity'),
+            func.coalesce(func.sum(BasketItem.quantity * Sneaker.price_kopecks), 0).label('total_kopecks')
+        )
+        .join(Sneaker, Sneaker.id == BasketItem.sneaker_id)
+        .where(BasketItem.user_id == user_id)
+    ).one()
+    return jsonify({
+        'lines': summary.lines,
+        'quantity': summary.quantity,
+        'total_amount': to_rubles(summary.total_kopecks),
+        'total_amount_kopecks': summary.total_kopecks
+    })
+
+@bp.route('/basket', methods=['POST'])
+@cache_control(PRIVATE_CACHE_CONTROL)
+@jwt_required()
+def add_to_basket():
+    """Добавить товар в корзину пользователя"""
+    user_id = get_jwt_identity()
+    data = request.get_json()
+
+    # Проверка обязательных полей
+    if not data.get('sneaker_id') or not data.get('size'):
+        return jsonify({'error': 'ID товара и размер обязательны'}), 400
+    quantity = data.get('quantity', 1)
+    if not is_quantity(quantity) or quantity <= 0:
+        return jsonify({'error': 'Количество должно быть положительным целым числом'}), 400
+
+    # Проверка существования товара
+    sneaker = Sneaker.query.get(data['sneaker_id'])
+    if not sneaker:
+        return jsonify({'error': 'Товар не найден'}), 404
+
+    # Резерв на складе и создание элемента корзины или увеличение количества
+    try:
+        reserve_stock(user_id, data['sneaker_id'], data['size'], quantity)
+    except InsufficientStock as e:
+        db.session.rollback()
+        return insufficient_stock_response(e)
+    upsert_basket_item(user_id, data['sneaker_id'], data['size'], quantity)
+    db.session.commit()
+    return jsonify({'message': 'Товар добавлен в корзину'}), 201
+
+def is_quantity(value):
+    """Целое ли число количество из JSON (true и false в Python тоже int)"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def validate_basket_operation(operation):
+    """Проверить операцию пакетного изменения корзины, вернуть текст ошибки или None"""
+    if not isinstance(operation, dict) or operation.get('op') not in ('add', 'set', 'remove'):
+        return 'Операция должна быть одной из: add, set, remove'
+    by_item = operation.get('item_id') is not None
+    by_product = operation.get('sneaker_id') is not None and operation.get('size') is not None
+    if operation['op'] == 'add' and not by_product:
+        return 'ID товара и размер обязательны'
+    if operation['op'] != 'add' and not (by_item or by_product):
+        return 'Укажите item_id или ID товара и размер'
+    quantity = operation.get('quantity', 1 if operation['op'] == 'add' else None)
+    if operation['op'] == 'add' and not (is_quantity(quantity) and quantity > 0):
+        return 'Количество должно быть положительным целым числом'
+    if operation['op'] == 'set' and not is_quantity(quantity):
+        return 'Количество должно быть целым числом'
+    return None
+
+def basket_row_filter(user_id, operation):
+    """Условие выбора строки корзины по item_id или по паре (товар, размер)"""
+    if operation.get('item_id') is not None:
+        return (BasketItem.user_id == user_id) & (BasketItem.id == operation['item_id'])
+    return ((BasketItem.user_id == user_id)
+            & (BasketItem.sneaker_id == operation['sneaker_id'])
+            & (BasketItem.size == operation['size']))
+
+@bp.route('/basket/batch', methods=['POST'])
+@cache_control(PRIVATE_CACHE_CONTROL)
+@jwt_required()
+def batch_update_basket():
+    """Применить список операций add/set/remove к корзине в одной транзакции.
+
+    Тело запроса: {"operations": [{"op": "add", "sneaker_id": 1, "size": 42, "quantity": 1},
+    {"op": "set", "item_id": 5, "quantity": 2}, {"op": "remove", "item_id": 7}]}.
+    Операции set и remove принимают item_id или пару sneaker_id и size;
+    set с количеством <= 0 удаляет строку. Возвращает обновленную корзину.
+    Операция с item_id, которого нет в корзине пользователя (в том числе
+    удаленным раньше в этом же запросе), отменяет весь запрос с ответом 404.
+    """
+    user_id = get_jwt_identity()
+    operations = (request.get_json() or {}).get('operations')
+    if not isinstance(operations, list) or not 0 < len(operations) <= BASKET_BATCH_MAX_OPERATIONS:
+        return jsonify({'error': f'Нужен список operations от 1 до {BASKET_BATCH_MAX_OPERATIONS} операций'}), 400
+
+    for index, operation in enumerate(operations):
+        error = validate_basket_operation(operation)
+        if error:
+            return jsonify({'error': error, 'operation': index}), 400
+
+    # Проверка существования всех упомянутых товаров одним запросом
+    sneaker_ids = {op['sneaker_id'] for op in operations if op.get('sneaker_id') is not None}
+    found_ids = set(db.session.scalars(select(Sneaker.id).where(Sneaker.id.in_(sneaker_ids))))
+    for index, operation in enumerate(operations):
+        if operation.get('sneaker_id') is not None and operation['sneaker_id'] not in found_ids:
+            return jsonify({'error': 'Товар не найден', 'operation': index}), 404
+
+    # Строки корзины, на которые ссылаются по item_id, загружаются одним запросом
+    item_ids = {op['item_id'] for op in operations if op.get('item_id') is not None}
+    items_by_id = {
+        item.id: item
+        for item in BasketItem.query.filter(BasketItem.user_id == user_id, BasketItem.id.in_(item_ids))
+    } if item_ids else {}
+
+    try:
+        for index, operation in enumerate(operations):
+            apply_basket_operation(user_id, operation, items_by_id)
+    except InsufficientStock as e:
+        db.session.rollback()
+        return insufficient_stock_response(e, operation=index)
+    except BasketItemNotFound:
+        db.session.rollback()
+        return jsonify({'error': 'Элемент корзины не найден', 'operation': index}), 404
+    db.session.commit()
+
+    return jsonify({
+        'message': 'Корзина обновлена',
+        'basket': [item.to_dict() for item in load_basket(user_id)]
+    }), 200
+
+def apply_basket_operation(user_id, operation, items_by_id):
+    """Выполнить одну операцию /basket/batch вместе с изменением резерва на складе"""
+    if operation.get('item_id') is not None:
+        item = items_by_id.get(operation['item_id'])
+        if item is None:
+            raise BasketItemNotFound(operation['item_id'])
+        sneaker_id, size = item.sneaker_id, item.size
+    else:
+        sneaker_id, size = operation['sneaker_id'], operation['size']
+
+    if operation['op'] == 'add':
+        reserve_stock(user_id, sneaker_id, size, operation.get('quantity', 1))
+        upsert_basket_item(user_id, sneaker_id, size, operation.get('quantity', 1))
+    elif operation['op'] == 'set' and operation['quantity'] > 0:
+        sync_reservation(user_id, sneaker_id, size, operation['quantity'])
+        if operation.get('item_id') is not None:
+            db.session.execute(
+                update(BasketItem)
+                .where(basket_row_filter(user_id, operation))
+                .values(quantity=operation['quantity']),
+                execution_options={'synchronize_session': False}
+            )
+        else:
+            upsert_basket_item(user_id, sneaker_id, size, operation['quantity'], replace=True)
+    else:
+        sync_reservation(user_id, sneaker_id, size, 0)
+        db.session.execute(
+            delete(BasketItem).where(basket_row_filter(user_id, operation)),
+            execution_options={'synchronize_session': False}
+        )
+        # Последующие операции с item_id удаленной строки ее уже не найдут
+        for item_id, item in list(items_by_id.items()):
+            if (item.sneaker_id, item.size) == (sneaker_id, size):
+                del items_by_id[item_id]
+
+@bp.route('/basket/<int:item_id>', methods=['PUT'])
+@cache_control(PRIVATE_CACHE_CONTROL)
+@jwt_required()
+def update_basket_item(item_id):
+    """Обновить количество товара в корзине"""
+    user_id = get_jwt_identity()
+    data = request.get_json()
+    if 'quantity' in data and not is_quantity(data['quantity']):
+        return jsonify({'error': 'Количество должно быть целым числом'}), 400
+
+    item = BasketItem.query.filter_by(id=item_id, user_id=user_id).first()
+    if not item:
+        return jsonify({'error': 'Элемент корзины не найден'}), 404
+
+    if 'quantity' in data:
+        try:
+            sync_reservation(user_id, item.sneaker_id, item.size, max(data['quantity'], 0))
+        except InsufficientStock as e:
+            db.session.rollback()
+            return insufficient_stock_response(e)
+        if data['quantity'] <= 0:
+            # Удаление товара из корзины при количестве <= 0
+            db.session.delete(item)
+        else:
+            item.quantity = data['quantity']
+
+    db.session.commit()
+    return jsonify({'message': 'Корзина обновлена'}), 200
+
+@bp.route('/basket/<int:item_id>', methods=['DELETE'])
+@cache_control(PRIVATE_CACHE_CONTROL)
+@jwt_required()
+def remove_from_basket(item_id):
+    """Удалить товар из корзины"""
+    user_id = get_jwt_identity()
+
+    item = BasketItem.query.filter_by(id=item_id, user_id=user_id).first()
+    if not item:
+        return jsonify({'error': 'Элемент корзины не найден'}), 404
+
+    sync_reservation(user_id, item.sneaker_id, item.size, 0)
+    db.session.delete(item)
+    db.session.commit()
+    return jsonify({'message': 'Товар удален из корзины'}), 200
+
+@bp.route('/basket', methods=['DELETE'])
+@cache_control(PRIVATE_CACHE_CONTROL)
+@jwt_required()
+def clear_basket():
+    """Очистить всю корзину пользователя"""
+    user_id = get_jwt_identity()
+
+    # Все резервы пользователя возвращаются на склад
+    consume_reservations(user_id, [])
+    BasketItem.query.filter_by(user_id=user_id).delete()
+    db.session.commit()
+    return jsonify({'message': 'Корзина очищена'}), 200
+
+# API маршруты для работы с заказами
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 64  # Максимальная длина заголовка Idempotency-Key
+ORDERS_DEFAULT_LIMIT = 20  # Размер страницы истории заказов по умолчанию
+ORDERS_MAX_LIMIT = 100  # Максимальный размер страницы истории заказов
+
+# Элементы заказов и их товары подгружаются вторым запросом (SELECT ... IN)
+# для всех заказов страницы сразу, без N+1
+ORDER_ITEMS_LOADER = selectinload(Order.order_items).joinedload(OrderItem.sneaker)
+
+def find_order_by_idempotency_key(user_id, key):
+    """Найти заказ пользователя, уже созданный с этим ключом идемпотентности"""
+    return (
+        Order.query
+        .options(ORDER_ITEMS_LOADER)
+        .filter_by(user_id=user_id, idempotency_key=key)
+        .first()
+    )
+
+def parse_order_cursor(cursor):
+    """Разбор курсора истории заказов вида <created_at в ISO>_<id>"""
+    created_at, _, order_id = cursor.rpartition('_')
+    return datetime.fromisoformat(created_at), parse_cursor_id(order_id)
+
+@bp.route('/orders', methods=['GET'])
+@cache_control(PRIVATE_CACHE_CONTROL)
+@jwt_required()
+def get_orders():
+    """История заказов текущего пользователя, новые сначала.
+
+    Фильтр: ?status=<статус>. Пагинация: ?after=<курсор>&limit=<размер страницы>,
+    курсор следующей страницы возвращается в заголовке X-Next-Cursor.
+    """
+    user_id = get_jwt_identity()
+    try:
+        limit = int(request.args.get('limit', ORDERS_DEFAULT_LIMIT))
+        after = parse_order_cursor(request.args['after']) if request.args.get('after') else None
+    except ValueError:
+        return jsonify({'error': 'Некорректные параметры пагинации'}), 400
+    if not 1 <= limit <= ORDERS_MAX_LIMIT:
+        return jsonify({'error': f'Параметр limit должен быть от 1 до {ORDERS_MAX_LIMIT}'}), 400
+
+    query = Order.query.options(ORDER_ITEMS_LOADER).filter_by(user_id=user_id)
+    if request.args.get('status'):
+        query = query.filter_by(status=request.args['status'])
+    if after:
+        query = query.filter(tuple_(Order.created_at, Order.id) < tuple_(*after))
+    orders = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit).all()
+
+    response = jsonify([order.to_dict() for order in orders])
+    if len(orders) == limit:
+        last = orders[-1]
+        next_cursor = f'{last.created_at.isoformat()}_{last.id}'
+        next_args = request.args.to_dict()
+        next_args['after'] = next_cursor
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{url_for("api.get_orders", **next_args)}>; rel="next"'
+    return response
+
+@bp.route('/orders/<int:order_id>', methods=['GET'])
+@cache_control(PRIVATE_CACHE_CONTROL)
+@jwt_required()
+def get_order(order_id):
+    """Получить заказ текущего пользователя вместе с элементами и товарами"""
+    user_id = get_jwt_identity()
+    order = Order.query.options(ORDER_ITEMS_LOADER).filter_by(id=order_id, user_id=user_id).first()
+    if not order:
+        return jsonify({'error': 'Заказ не найден'}), 404
+    return jsonify(order.to_dict()), 200
+
+@bp.route('/orders/checkout', methods=['POST'])
+@cache_control(PRIVATE_CACHE_CONTROL)
+@jwt_required()
+def checkout():
+    """Оформить заказ из корзины текущего пользователя в одной транзакции.
+
+    Повторный запрос с тем же заголовком Idempotency-Key возвращает уже
+    созданный заказ и ничего не записывает в базу данных.
+    """
+    user_id = get_jwt_identity()
+    key = request.headers.get('Idempotency-Key')
+    if key is not None and not 0 < len(key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+        return jsonify({'error': 'Некорректный заголовок Idempotency-Key'}), 400
+
+    if key:
+        existing_order = find_order_by_idempotency_key(user_id, key)
+        if existing_order:
+            return jsonify(existing_order.to_dict()), 200
+
+    # Блокировка строк корзины до конца транзакции (FOR UPDATE в PostgreSQL)
+    lines = db.session.execute(
+        select(BasketItem.id, BasketItem.sneaker_id, BasketItem.size, BasketItem.quantity)
+        .where(BasketItem.user_id == user_id)
+        .with_for_update()
+    ).all()
+    if not lines:
+        db.session.rollback()
+        return jsonify({'error': 'Корзина пуста'}), 400
+    basket_ids = [line.id for line in lines]
+
+    order = Order(user_id=user_id, total_amount_kopecks=0, idempotency_key=key)
+    db.session.add(order)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        if not key:
+            raise
+        # Параллельный запрос с тем же ключом успел создать заказ
+        existing_order = find_order_by_idempotency_key(user_id, key)
+        if not existing_order:
+            # Ключ занят, но заказа не видно: конфликт не разрешен, клиент повторит запрос
+            return jsonify({'error': 'Заказ с этим ключом идемпотентности уже оформляется'}), 409
+        return jsonify(existing_order.to_dict()), 200
+
+    # Резервы корзины становятся проданным товаром; недостающее списывается со склада
+    try:
+        consume_reservations(user_id, [(line.sneaker_id, line.size, line.quantity) for line in lines])
+    except InsufficientStock as e:
+        db.session.rollback()
+        return insufficient_stock_response(e)
+
+    # Все элементы заказа одним INSERT ... SELECT с текущими ценами товаров
+    db.session.execute(
+        insert(OrderItem).from_select(
+            ['order_id', 'sneaker_id', 'size', 'quantity', 'price_kopecks'],
+            select(literal(order.id), BasketItem.sneaker_id, BasketItem.size,
+                   BasketItem.quantity, Sneaker.price_kopecks)
+            .join(Sneaker, Sneaker.id == BasketItem.sneaker_id)
+            .where(BasketItem.id.in_(basket_ids))
+        )
+    )
+
+    # Итоговая сумма считается в базе данных по вставленным элементам
+    total = (
+        select(func.coalesce(func.sum(OrderItem.price_kopecks * OrderItem.quantity), 0))
+        .where(OrderItem.order_id == order.id)
+        .scalar_subquery()
+    )
+    db.session.execute(
+        update(Order).where(Order.id == order.id).values(total_amount_kopecks=total),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.execute(
+        delete(BasketItem).where(BasketItem.id.in_(basket_ids)),
+        execution_options={'synchronize_session': False}
+    )
+    # Подтверждение и уведомление - вне запроса, в очереди фоновых задач
+    enqueue_job('set_order_status', {'order_id': order.id, 'status': 'confirmed'})
+    order_id = order.id  # после commit чтение order.id перезагрузило бы заказ отдельным запросом
+    db.session.commit()
+
+    # populate_existing: заказ уже в identity map, без него опции загрузки не применятся
+    order = db.session.get(Order, order_id, options=[ORDER_ITEMS_LOADER], populate_existing=True)
+    return jsonify(order.to_dict()), 201
+
+# Фоновые задачи: очередь в основной базе данных
+#
+# Задача ставится в очередь в той же транзакции, что и изменение, которое ее
+# породило (enqueue_job перед commit), поэтому не теряется и не выполняется
+# для откатившегося заказа. Воркер (flask run-jobs) забирает видимые задачи
+# пачками одним UPDATE ... RETURNING и выполняет их в пуле потоков. Забранная
+# задача становится невидимой до run_at = сейчас + JOB_VISIBILITY_TIMEOUT:
+# если воркер упал, по истечении этого срока задачу заберет другой. Ошибка
+# обработчика откладывает повтор с экспоненциальной задержкой; после
+# max_attempts попыток задача помечается failed.
+
+JOB_HANDLERS = {}  # тип задачи -> обработчик handler(**payload)
+VISIBLE_JOB_STATUSES = ('queued', 'running')
+
+def job_handler(kind):
+    """Зарегистрировать обработчик задач типа kind"""
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+def enqueue_job(kind, payload=None, delay=0):
+    """Добавить задачу в текущую транзакцию сессии; в очереди она появится после commit"""
+    job = Job(kind=kind, payload=json.dumps(payload or {}),
+              max_attempts=current_app.config['JOB_MAX_ATTEMPTS'],
+              run_at=datetime.utcnow() + timedelta(seconds=delay))
+    db.session.add(job)
+    return job
+
+def claim_jobs(limit, visibility_timeout):
+    """Забрать до limit видимых задач; возвращает строки (id, kind, payload, attempts, max_attempts).
+
+    Условие видимости повторяется во внешнем UPDATE: в PostgreSQL оно
+    перепроверяется после ожидания блокировки, поэтому одну задачу не
+    заберут два воркера; занятые строки пропускаются (SKIP LOCKED).
+    """
+    now = datetime.utcnow()
+    visible = Job.status.in_(VISIBLE_JOB_STATUSES) & (Job.run_at <= now)
+    candidates = (
+        select(Job.id).where(visible).order_by(Job.run_at, Job.id).limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    jobs = db.session.execute(
+        update(Job)
+        .where(Job.id.in_(candidates), visible)
+        .values(status='running', attempts=Job.attempts + 1,
+                run_at=now + timedelta(seconds=visibility_timeout))
+        .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts),
+        execution_options={'synchronize_session': False}
+    ).all()
+    db.session.commit()
+    return jobs
+
+def finish_job(job, **values):
+    """Записать итог попытки, если задача все еще принадлежит ей; иначе вернуть False.
+
+    Попытка, у которой истек срок видимости, могла быть забрана повторно:
+    тогда номер попытки в базе уже другой и ее итог не записывается.
+    """
+    result = db.session.execute(
+        update(Job)
+        .where(Job.id == job.id, Job.attempts == job.attempts, Job.status == 'running')
+        .values(**values),
+        execution_options={'synchronize_session': False}
+    )
+    return result.rowcount == 1
+
+def job_retry_delay(attempts):
+    """Задержка перед повтором: экспонента от номера попытки со случайным разбросом"""
+    delay = min(current_app.config['JOB_RETRY_BASE_DELAY'] * 2 ** (attempts - 1),
+                current_app.config['JOB_RETRY_MAX_DELAY'])
+    return delay * random.uniform(0.5, 1)
+
+def run_job(job):
+    """Выполнить одну задачу (в контексте приложения).
+
+    Изменения обработчика фиксируются в одной транзакции с отметкой о
+    выполнении; если задача больше не принадлежит этой попытке, они откатываются.
+    """
+    now = datetime.utcnow()
+    handler = JOB_HANDLERS.get(job.kind)
+    if handler is None or job.attempts > job.max_attempts:
+        error = f'Неизвестный тип задачи {job.kind}' if handler is None else 'Превышено число попыток'
+        finish_job(job, status='failed', last_error=error, finished_at=now)
+        db.session.commit()
+        return
+    try:
+        handler(**json.loads(job.payload))
+        if finish_job(job, status='done', last_error=None, finished_at=datetime.utcnow()):
+            db.session.commit()
+        else:
+            db.session.rollback()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning('Задача %s #%s, попытка %s: %r', job.kind, job.id, job.attempts, e)
+        if job.attempts >= job.max_attempts:
+            finish_job(job, status='failed', last_error=repr(e), finished_at=datetime.utcnow())
+        else:
+            finish_job(job, status='queued', last_error=repr(e),
+                       run_at=datetime.utcnow() + timedelta(seconds=job_retry_delay(job.attempts)))
+        db.session.commit()
+
+class JobWorker:
+    """Выполняет задачи очереди в пуле потоков.
+
+    Забирает пачку задач не больше числа свободных потоков, чтобы
+    задачи не ждали в памяти дольше срока видимости; пока задачи есть,
+    забирает следующую пачку сразу, иначе ждет JOB_POLL_INTERVAL.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.threads = app.config['JOB_WORKER_THREADS']
+        self.batch_size = app.config['JOB_BATCH_SIZE']
+        self.poll_interval = app.config['JOB_POLL_INTERVAL']
+        self.visibility_timeout = app.config['JOB_VISIBILITY_TIMEOUT']
+        self.stopping = threading.Event()
+        self._free = threading.Semaphore(self.threads)
+        self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix='job')
+
+    def _execute(self, job):
+        try:
+            with self.app.app_context():
+                try:
+                    run_job(job)
+                except SQLAlchemyError:
+                    db.session.rollback()
+                    self.app.logger.exception('Не удалось записать итог задачи %s #%s', job.kind, job.id)
+                finally:
+                    db.session.remove()
+        finally:
+            self._free.release()
+
+    def run_once(self):
+        """Забрать и запустить одну пачку задач; возвращает их число"""
+        free = 0
+        while free < self.batch_size and self._free.acquire(blocking=free == 0):
+            free += 1
+        with self.app.app_context():
+            try:
+                jobs = claim_jobs(free, self.visibility_timeout)
+            except SQLAlchemyError:
+                db.session.rollback()
+                self.app.logger.exception('Не удалось забрать задачи из очереди')
+                jobs = []
+            finally:
+                db.session.remove()
+        for _ in range(free - len(jobs)):
+            self._free.release()
+        for job in jobs:
+            self._pool.submit(self._execute, job)
+        return len(jobs)
+
+    def run(self):
+        """Обрабатывать очередь до вызова stop(), затем дождаться начатых задач"""
+        try:
+            while not self.stopping.is_set():
+                if not self.run_once():
+                    self.stopping.wait(self.poll_interval)
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def stop(self):
+        self.stopping.set()
+
+def start_job_worker(app):
+    """Обрабатывать очередь в фоновом потоке текущего процесса (сервер разработки)"""
+    if app.config['JOB_WORKER_THREADS'] > 0:
+        threading.Thread(target=JobWorker(app).run, name='job-worker', daemon=True).start()
+
+# Обработчики задач заказов
+
+# Допустимые переходы статуса заказа: новый статус -> из каких статусов
+ORDER_STATUS_TRANSITIONS = {
+    'confirmed': ('pending',),
+    'shipped': ('confirmed',),
+    'delivered': ('shipped',),
+    'cancelled': ('pending', 'confirmed'),
+}
+
+@job_handler('set_order_status')
+def set_order_status(order_id, status):
+    """Перевести заказ в новый статус, если переход допустим из текущего.
+
+    Отмена возвращает товары заказа на склад; о смене статуса покупателю
+    отправляется уведомление отдельной задачей.
+    """
+    changed = db.session.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status.in_(ORDER_STATUS_TRANSITIONS[status]))
+        .values(status=status),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    if not changed:
+        return
+    if status == 'cancelled':
+        items = db.session.execute(
+            select(OrderItem.sneaker_id, OrderItem.size, OrderItem.quantity).where(OrderItem.order_id == order_id)
+        )
+        for sneaker_id, size, quantity in items:
+            return_stock(sneaker_id, size, quantity)
+    enqueue_job('notify_order_status', {'order_id': order_id, 'status': status})
+
+@job_handler('notify_order_status')
+def notify_order_status(order_id, status):
+    """Уведомить покупателя о смене статуса заказа (пока - запись в журнал приложения)"""
+    email = db.session.scalar(select(User.email).join(Order, Order.user_id == User.id).where(Order.id == order_id))
+    current_app.logger.info('Уведомление %s: заказ #%s, статус %s', email, order_id, status)
+
+def admin_required(view):
+    """Маршрут только для администраторов (проверка JWT и флага is_admin)"""
+    @functools.wraps(view)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        if not current_user.is_admin:
+            return jsonify({'error': 'Доступ только для администратора'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@bp.route('/admin/orders/<int:order_id>/status', methods=['POST'])
+@cache_control(PRIVATE_CACHE_CONTROL)
+@admin_required
+def change_order_status(order_id):
+    """Поставить в очередь смену статуса заказа: {"status": "shipped"}.
+
+    Отвечает 202 сразу; переход и его последствия (возврат товара на склад,
+    уведомление покупателя) выполняет воркер очереди.
+    """
+    data = request.get_json(silent=True) or {}
+    status = data.get('status')
+    if status not in ORDER_STATUS_TRANSITIONS:
+        return jsonify({'error': f'Статус должен быть одним из: {", ".join(ORDER_STATUS_TRANSITIONS)}'}), 400
+    order = db.session.get(Order, order_id)
+    if order is None:
+        return jsonify({'error': 'Заказ не найден'}), 404
+    if order.status not in ORDER_STATUS_TRANSITIONS[status]:
+        return jsonify({'error': f'Переход из статуса {order.status} в {status} невозможен'}), 409
+
+    job = enqueue_job('set_order_status', {'order_id': order_id, 'status': status})
+    db.session.commit()
+    return jsonify(job.to_dict()), 202
+
+@bp.route('/admin/jobs/<int:job_id>', methods=['GET'])
+@cache_control(PRIVATE_CACHE_CONTROL)
+@admin_required
+def get_job(job_id):
+    """Состояние фоновой задачи"""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    return jsonify(job.to_dict())
+
+# Массовый импорт каталога администратором: CSV или NDJSON читается из тела
+# запроса потоком, товары добавляются или обновляются по артикулу (sku)
+# пачками - одним оператором INSERT ... ON CONFLICT на пачку
+
+CATALOG_IMPORT_BATCH_SIZE = 1000  # Товаров в одном операторе upsert (15 параметров на товар, лимит SQLite - 32766)
+CATALOG_IMPORT_MAX_ERRORS = 100  # Сколько ошибочных строк перечислять в отчете импорта
+CATALOG_IMPORT_MAX_CHANGED_IDS = 10000  # При большем числе измененных товаров индексы воркеров перестраиваются целиком
+CATALOG_IMPORT_FORMATS = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson', 'application/jsonl': 'ndjson'}
+CATALOG_IMPORT_REQUIRED = ('sku', 'brand', 'model', 'size', 'color_name')
+CATALOG_IMPORT_STRINGS = ('sku', 'brand', 'model', 'color_name', 'color_code', 'description', 'category',
+                          'gender', 'condition', 'image_url')
+# Колонки, которые импорт перезаписывает у существующего товара
+CATALOG_IMPORT_COLUMNS = ('brand', 'model', 'size', 'color_name', 'color_code', 'price_kopecks', 'description',
+                          'category', 'gender', 'in_stock', 'condition', 'image_url', 'release_year')
+
+def parse_import_number(values, name, convert):
+    try:
+        value = convert(values[name])
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f'Некорректное значение поля {name}')
+    if not math.isfinite(value) or value <= 0:
+        raise ValueError(f'Поле {name} должно быть положительным числом')
+    # Слишком большое целое сорвало бы запись всей пачки
+    if value > DB_INTEGER_MAX:
+        raise ValueError(f'Значение поля {name} слишком велико')
+    return value
+
+def parse_import_row(raw):
+    """Проверить строку импорта и привести ее к колонкам Sneaker.
+
+    Строка описывает товар целиком: пустые и отсутствующие необязательные
+    поля у обновляемого товара очищаются. Цена задается в рублях (price)
+    или в копейках (price_kopecks). При ошибке выбрасывает ValueError.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError('Строка должна быть объектом JSON')
+    values = {}
+    for name, value in raw.items():
+        if isinstance(value, str):
+            value = value.strip()
+        if name is not None and value not in ('', None):
+            values[name] = value
+    missing = [name for name in CATALOG_IMPORT_REQUIRED if name not in values]
+    if 'price' not in values and 'price_kopecks' not in values:
+        missing.append('price')
+    if missing:
+        raise ValueError(f'Не заполнены поля: {", ".join(missing)}')
+
+    row = {}
+    for name in CATALOG_IMPORT_STRINGS:
+        if isinstance(values.get(name), (dict, list)):
+            raise ValueError(f'Некорректное значение поля {name}')
+        value = str(values[name]) if name in values else None
+        length = Sneaker.__table__.c[name].type.length
+        if value is not None and length and len(value) > length:
+            raise ValueError(f'Поле {name} длиннее {length} символов')
+        row[name] = value
+    row['size'] = parse_import_number(values, 'size', float)
+    if 'price_kopecks' in values:
+        row['price_kopecks'] = parse_import_number(values, 'price_kopecks', int)
+    else:
+        row['price_kopecks'] = parse_import_number(values, 'price', to_kopecks)
+    row['release_year'] = parse_import_number(values, 'release_year', int) if 'release_year' in values else None
+    in_stock = values.get('in_stock', True)
+    try:
+        row['in_stock'] = in_stock if isinstance(in_stock, bool) else parse_bool(str(in_stock))
+    except ValueError:
+        raise ValueError('Некорректное значение поля in_stock')
+    row['condition'] = row['condition'] or 'New'
+    return row
+
+def read_import_rows(stream, fmt):
+    """Строки импорта по одной: (номер строки файла, словарь из CSV или строка NDJSON)"""
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'ndjson':
+        for number, line in enumerate(text_stream, 1):
+            if line.strip():
+                yield number, line
+        return
+    reader = csv.DictReader(text_stream)
+    missing = [name for name in CATALOG_IMPORT_REQUIRED if name not in (reader.fieldnames or ())]
+    if 'price' not in (reader.fieldnames or ()) and 'price_kopecks' not in (reader.fieldnames or ()):
+        missing.append('price')
+    if missing:
+        raise ValueError(f'В заголовке CSV нет колонок: {", ".join(missing)}')
+    for raw in reader:
+        yield reader.line_num, raw
+
+def upsert_sneakers(rows):
+    """Добавить или обновить товары по артикулу одним оператором.
+
+    Совпадающие с базой товары не перезаписываются, чтобы не сдвигать
+    updated_at (и не попадать в инкрементальную выгрузку). Возвращает ID
+    добавленных и измененных товаров и число артикулов, уже бывших в каталоге.
+    """
+    table = Sneaker.__table__
+    now = datetime.utcnow()
+    existing = db.session.scalar(
+        select(func.count()).select_from(table).where(table.c.sku.in_([row['sku'] for row in rows]))
+    )
+    stmt = UPSERT_INSERTS[db.session.get_bind().dialect.name](table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.sku],
+        set_={name: stmt.excluded[name] for name in CATALOG_IMPORT_COLUMNS + ('updated_at',)},
+        where=or_(*(table.c[name].is_distinct_from(stmt.excluded[name]) for name in CATALOG_IMPORT_COLUMNS))
+    ).returning(table.c.id)
+    # Список параметров с RETURNING SQLAlchemy отправляет многострочными
+    # INSERT (insertmanyvalues), а сам оператор компилирует один раз
+    return list(db.session.scalars(stmt, [dict(row, updated_at=now) for row in rows])), existing
+
+class CatalogImport:
+    """Накопление проверенных строк импорта и запись их пачками.
+
+    Каждая пачка фиксируется своей транзакцией, поэтому импорт не держит
+    блокировку записи на все время загрузки; измененные ID копятся и
+    публикуются один раз в finish.
+    """
+
+    def __init__(self, batch_size=CATALOG_IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.pending = {}  # sku -> строка текущей пачки
+        self.changed_ids = set()
+        self.report = {'processed': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'failed': 0, 'errors': []}
+
+    def add(self, number, raw):
+        """Проверить строку и добавить ее в пачку; ошибка попадает в отчет"""
+        self.report['processed'] += 1
+        try:
+            try:
+                raw = json.loads(raw) if isinstance(raw, str) else raw
+            except ValueError:
+                raise ValueError('Некорректный JSON')
+            row = parse_import_row(raw)
+        except ValueError as error:
+            self.report['failed'] += 1
+            if len(self.report['errors']) < CATALOG_IMPORT_MAX_ERRORS:
+                self.report['errors'].append({'line': number, 'error': str(error)})
+            return
+        # Повтор артикула в одном операторе ON CONFLICT недопустим: предыдущая пачка записывается раньше
+        if row['sku'] in self.pending:
+            self.flush()
+        self.pending[row['sku']] = row
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Записать текущую пачку"""
+        if not self.pending:
+            return
+        rows = list(self.pending.values())
+        self.pending = {}
+        changed_ids, existing = upsert_sneakers(rows)
+        db.session.commit()
+        inserted = len(rows) - existing
+        self.report['inserted'] += inserted
+        self.report['updated'] += len(changed_ids) - inserted
+        self.report['unchanged'] += existing - (len(changed_ids) - inserted)
+        self.changed_ids.update(changed_ids)
+
+    def finish(self):
+        """Сбросить кэш и обновить индексы каталога один раз на весь импорт"""
+        if self.changed_ids:
+            many = len(self.changed_ids) > CATALOG_IMPORT_MAX_CHANGED_IDS
+            publish_catalog_change(None if many else self.changed_ids)
+            self.changed_ids = set()
+
+def import_catalog_stream(stream, fmt):
+    """Импортировать товары из двоичного потока и вернуть отчет.
+
+    Ошибка чтения самого потока (кодировка, разметка CSV, сжатие) прерывает
+    импорт: прочитанные до нее корректные строки сохраняются, а текст
+    ошибки попадает в отчет под ключом error.
+    """
+    importer = CatalogImport()
+    try:
+        try:
+            for number, raw in read_import_rows(stream, fmt):
+                importer.add(number, raw)
+        except UnicodeDecodeError:
+            importer.report['error'] = 'Файл должен быть в кодировке UTF-8'
+        except csv.Error as error:
+            importer.report['error'] = f'Некорректный CSV: {error}'
+        except (OSError, EOFError):
+            importer.report['error'] = 'Некорректные сжатые данные'
+        except ValueError as error:
+            importer.report['error'] = str(error)
+        importer.flush()
+    finally:
+        importer.finish()
+    return importer.report
+
+@bp.route('/admin/catalog/import', methods=['POST'])
+@cache_control(PRIVATE_CACHE_CONTROL)
+@admin_required
+def import_catalog():
+    """Импорт каталога из тела запроса: CSV с заголовком или NDJSON (товар в строке).
+
+    Формат задается Content-Type (text/csv, application/x-ndjson) или
+    параметром ?format=csv|ndjson; тело может быть сжато (Content-Encoding: gzip).
+    Тело читается потоком, в памяти держится только текущая пачка.
+    Товар с известным sku обновляется, с новым - добавляется.
+    Ответ: число обработанных, добавленных, измененных, неизмененных
+    и ошибочных строк и первые ошибки с номерами строк.
+    """
+    fmt = request.args.get('format') or CATALOG_IMPORT_FORMATS.get(request.mimetype)
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'error': 'Формат импорта: text/csv или application/x-ndjson'}), 400
+    stream = request.stream
+    if request.content_encoding == 'gzip':
+        stream = gzip.GzipFile(fileobj=stream)
+    elif request.content_encoding:
+        return jsonify({'error': 'Поддерживается только сжатие gzip'}), 400
+
+    report = import_catalog_stream(stream, fmt)
+    return jsonify(report), 400 if 'error' in report else 200
+
+# Фабрика приложения
+
+def create_app(config=None):
+    """Создать и настроить экземпляр Flask приложения.
+
+    config - необязательный словарь, переопределяющий настройки из окружения.
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///posts.db')  # Путь к базе данных PostgreSQL или SQLite для разработки
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # Отключение отслеживания изменений для производительности
+    # Необязательная реплика только для чтения (каталог); без нее все запросы идут в основную БД
+    app.config['SQLALCHEMY_BINDS'] = {'replica': os.environ['DATABASE_REPLICA_URL']} if os.environ.get('DATABASE_REPLICA_URL') else {}
+    app.config['REPLICA_STICKY_SECONDS'] = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))  # Сколько секунд после записи читать из основной БД
+    app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'secret-key-here')  # Секретный ключ для JWT токенов
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))  # Стоимость bcrypt (log2 числа раундов)
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', min(2, os.cpu_count() or 1)))  # Процессов для хеширования паролей (0 - в потоке запроса)
+    app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 4))  # Максимум одновременных операций хеширования на воркер
+    app.config['CATALOG_CACHE_SIZE'] = int(os.environ.get('CATALOG_CACHE_SIZE', 256))  # Максимум закэшированных ответов каталога на воркер
+    app.config['RESERVATION_TTL'] = int(os.environ.get('RESERVATION_TTL', 900))  # Сколько секунд товар в корзине удерживается на складе
+    app.config['EXPORT_SNAPSHOT_MARGIN'] = float(os.environ.get('EXPORT_SNAPSHOT_MARGIN', 300))  # На сколько секунд X-Export-Snapshot отстает от начала выгрузки (дольше самой долгой записи каталога и отставания реплики)
+    app.config['RESERVATION_SWEEP_INTERVAL'] = int(os.environ.get('RESERVATION_SWEEP_INTERVAL', 60))  # Период возврата истекших резервов (0 - не запускать)
+    app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))  # Ответы меньше этого размера в байтах не сжимаются
+    app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))  # Уровень сжатия gzip/deflate (1-9)
+    app.config['CORS_ORIGINS'] = os.environ.get('CORS_ORIGINS', 'https://sneakersstor.netlify.app').split(',')  # Источники фронтенда, которым разрешены запросы
+    app.config['CORS_MAX_AGE'] = int(os.environ.get('CORS_MAX_AGE', 86400))  # Сколько секунд браузер может кэшировать preflight
+    app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 1024))  # Максимум закэшированных пользователей на воркер
+    app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 60))  # Время жизни записи кэша пользователей в секундах
+    app.config['JOB_WORKER_THREADS'] = int(os.environ.get('JOB_WORKER_THREADS', 4))  # Потоков воркера очереди задач
+    app.config['JOB_BATCH_SIZE'] = int(os.environ.get('JOB_BATCH_SIZE', 20))  # Максимум задач, забираемых за раз
+    app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', 1))  # Пауза воркера при пустой очереди, секунд
+    app.config['JOB_VISIBILITY_TIMEOUT'] = int(os.environ.get('JOB_VISIBILITY_TIMEOUT', 300))  # Через сколько секунд незавершенную задачу заберет другой воркер
+    app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))  # Попыток до пометки задачи failed
+    app.config['JOB_RETRY_BASE_DELAY'] = float(os.environ.get('JOB_RETRY_BASE_DELAY', 5))  # Задержка первого повтора, секунд (далее удваивается)
+    app.config['JOB_RETRY_MAX_DELAY'] = float(os.environ.get('JOB_RETRY_MAX_DELAY', 3600))  # Максимальная задержка повтора, секунд
+    app.config['CACHE_PATH'] = os.environ.get('CACHE_PATH')  # Файл SQLite общего кэша воркеров на локальном диске (без него - кэш в памяти процесса)
+    app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')  # Каталог для сложения метрик воркеров gunicorn (без него - метрики одного процесса)
+    app.config['METRICS_FLUSH_INTERVAL'] = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))  # Как часто воркер сохраняет метрики в METRICS_DIR, секунд
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')  # Необязательный токен доступа к /metrics
+    app.config['SLOW_REQUEST_SECONDS'] = float(os.environ.get('SLOW_REQUEST_SECONDS', 1))  # Запросы дольше этого попадают в журнал вместе с SQL
+    if config:
+        app.config.update(config)
+
+    # Инициализация расширений и кэшей воркера
+    metrics.init_app(app)  # Первым: его after_request видит окончательный ответ
+    http_policy.init_app(app)  # CORS для всех маршрутов (разрешает запросы с фронтенда) и Cache-Control
+    app.after_request(compress_response)
+    db.init_app(app)
+    jwt.init_app(app)
+    catalog_cache.init_app(app)
+    user_cache.init_app(app)
+    password_hasher.init_app(app)
+
+    app.register_blueprint(bp)
+    return app
+
+def warm_caches():
+    """Прогреть поисковый и фасетный индексы и индекс похожих товаров (в контексте приложения).
+
+    При запуске gunicorn с preload_app индексы строятся один раз в мастер-процессе
+    и достаются воркерам после fork без повторного чтения каталога; запомненная
+    версия каталога покажет воркеру, запущенному позже, что индексы устарели.
+    """
+    sync_catalog_changes()
+    search_index.refresh()
+    facet_index.refresh()
+    similar_index.refresh()
+    db.session.remove()
+
+# Версионные миграции схемы.
+# Каждая миграция - функция от соединения, выполняемая в отдельной транзакции;
+# номер примененной миграции записывается в schema_migration. Новая база
+# создается сразу по моделям и помечается последней версией, поэтому
+# изменения моделей должны сопровождаться миграцией в конце MIGRATIONS.
+# Шаги миграций проверяют текущее состояние схемы: базы, созданные
+# create_all на промежуточных версиях приложения, обновляются так же.
+
+# Ключ advisory-блокировки PostgreSQL, под которой применяются миграции
+MIGRATION_LOCK_KEY = 7302114
+
+def lock_migrations(connection):
+    """Не дать двум процессам применять миграции одновременно"""
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+    elif connection.dialect.name == 'sqlite':
+        # Без явного BEGIN модуль sqlite3 выполняет DDL вне транзакции
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+def column_names(connection, table):
+    return {column['name'] for column in inspect(connection).get_columns(table)}
+
+def add_column(connection, model, name):
+    """Добавить в таблицу колонку модели, если ее еще нет"""
+    table = model.__table__
+    if name in column_names(connection, table.name):
+        return
+    quote = connection.dialect.identifier_preparer.quote
+    column_type = table.c[name].type.compile(dialect=connection.dialect)
+    connection.execute(text(f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(name)} {column_type}'))
+
+def create_index(connection, name, table, columns, unique=False):
+    """Создать индекс, если ни индекса, ни ограничения уникальности с таким именем еще нет"""
+    inspector = inspect(connection)
+    existing = {index['name'] for index in inspector.get_indexes(table)}
+    existing.update(constraint['name'] for constraint in inspector.get_unique_constraints(table))
+    if name in existing:
+        return
+    quote = connection.dialect.identifier_preparer.quote
+    connection.execute(text(
+        f'CREATE {"UNIQUE " if unique else ""}INDEX {name} '
+        f'ON {quote(table)} ({", ".join(quote(column) for column in columns)})'
+    ))
+
+def migrate_stock_and_idempotency(connection):
+    """Остатки и резервы, время изменения товара, ключ идемпотентности заказа
+    и одна строка корзины на товар и размер"""
+    add_column(connection, Sneaker, 'updated_at')
+    connection.execute(text('UPDATE sneaker SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL'))
+    add_column(connection, Order, 'idempotency_key')
+    Stock.__table__.create(connection, checkfirst=True)
+    StockReservation.__table__.create(connection, checkfirst=True)
+    # Повторяющиеся строки корзины сливаются в одну с суммарным количеством
+    connection.execute(text(
+        'UPDATE basket_item SET quantity = ('
+        ' SELECT SUM(other.quantity) FROM basket_item other'
+        ' WHERE other.user_id = basket_item.user_id AND other.sneaker_id = basket_item.sneaker_id'
+        ' AND other.size = basket_item.size)'
+        ' WHERE id IN (SELECT MIN(id) FROM basket_item GROUP BY user_id, sneaker_id, size HAVING COUNT(*) > 1)'
+    ))
+    connection.execute(text(
+        'DELETE FROM basket_item WHERE id NOT IN (SELECT MIN(id) FROM basket_item GROUP BY user_id, sneaker_id, size)'
+    ))
+    create_index(connection, 'uq_basket_item_user_sneaker_size', 'basket_item', ['user_id', 'sneaker_id', 'size'], unique=True)
+    create_index(connection, 'uq_order_user_idempotency_key', 'order', ['user_id', 'idempotency_key'], unique=True)
+
+# Денежные колонки, переведенные из рублей (Float) в копейки (Integer):
+# таблица, старая колонка, новая колонка
+PRICE_COLUMNS_TO_KOPECKS = [
+    ('sneaker', 'price', 'price_kopecks'),
+    ('order_item', 'price', 'price_kopecks'),
+    ('order', 'total_amount', 'total_amount_kopecks'),
+]
+
+def migrate_prices_to_kopecks(connection):
+    """Перевести цены из рублей в целые копейки.
+
+    Для каждой колонки: добавить целочисленную колонку, заполнить ее
+    округленным значением price * 100 и удалить старую колонку.
+    """
+    quote = connection.dialect.identifier_preparer.quote
+    for table, old, new in PRICE_COLUMNS_TO_KOPECKS:
+        columns = column_names(connection, table)
+        if old not in columns or new in columns:
+            continue
+        connection.execute(text(f'ALTER TABLE {quote(table)} ADD COLUMN {new} INTEGER NOT NULL DEFAULT 0'))
+        connection.execute(text(f'UPDATE {quote(table)} SET {new} = CAST(ROUND({old} * {KOPECKS_PER_RUBLE}) AS INTEGER)'))
+        # Индекс по старой колонке мешает ее удалению в SQLite
+        if table == 'sneaker':
+            connection.execute(text('DROP INDEX IF EXISTS ix_sneaker_price_id'))
+        connection.execute(text(f'ALTER TABLE {quote(table)} DROP COLUMN {old}'))
+
+# Индексы горячих запросов: фильтры каталога, история заказов,
+# элементы заказа и внешние ключи корзины
+HOT_PATH_INDEXES = [
+    ('ix_sneaker_brand_id', 'sneaker', ['brand', 'id']),
+    ('ix_sneaker_gender_category_id', 'sneaker', ['gender', 'category', 'id']),
+    ('ix_sneaker_category_id', 'sneaker', ['category', 'id']),
+    ('ix_sneaker_size_id', 'sneaker', ['size', 'id']),
+    ('ix_sneaker_price_id', 'sneaker', ['price_kopecks', 'id']),
+    ('ix_sneaker_in_stock_id', 'sneaker', ['in_stock', 'id']),
+    ('ix_sneaker_updated_at_id', 'sneaker', ['updated_at', 'id']),
+    ('ix_order_user_created_id', 'order', ['user_id', 'created_at', 'id']),
+    ('ix_order_user_status_created_id', 'order', ['user_id', 'status', 'created_at', 'id']),
+    ('ix_order_item_order_id', 'order_item', ['order_id']),
+    ('ix_basket_item_sneaker_id', 'basket_item', ['sneaker_id']),
+]
+
+def migrate_hot_path_indexes(connection):
+    """Индексы внешних ключей и фильтров, используемых маршрутами"""
+    for name, table, columns in HOT_PATH_INDEXES:
+        create_index(connection, name, table, columns)
+    # Прежний индекс только по updated_at заменен составным (updated_at, id)
+    connection.execute(text('DROP INDEX IF EXISTS ix_sneaker_updated_at'))
+
+def migrate_job_queue(connection):
+    """Таблица очереди фоновых задач"""
+    Job.__table__.create(connection, checkfirst=True)
+
+def migrate_unique_sku(connection):
+    """Уникальный артикул товара - ключ импорта каталога"""
+    duplicates = connection.execute(text(
+        'SELECT sku FROM sneaker WHERE sku IS NOT NULL GROUP BY sku HAVING COUNT(*) > 1 LIMIT 10'
+    )).scalars().all()
+    if duplicates:
+        # Товары с одним артикулом нельзя слить автоматически: их должен разделить администратор
+        raise RuntimeError(f'Артикулы повторяются у нескольких товаров: {", ".join(duplicates)}')
+    create_index(connection, 'uq_sneaker_sku', 'sneaker', ['sku'], unique=True)
+
+def migrate_autoincrement_ids(connection):
+    """Пересоздать таблицы-источники SimilarIndex с AUTOINCREMENT в SQLite.
+
+    Без него SQLite выдает новой строке id удаленной последней, и водяной знак
+    max(id) пропускает ее. Последовательности PostgreSQL и так не повторяются.
+    """
+    if connection.dialect.name != 'sqlite':
+        return
+    for model in (OrderItem, BasketItem):
+        table = model.__table__
+        sql = connection.scalar(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                                {'name': table.name})
+        if 'AUTOINCREMENT' in sql.upper():
+            continue
+        old_name = f'{table.name}_old'
+        # Имена индексов в SQLite общие для базы: старые удаляем до создания таблицы по модели
+        indexes = connection.scalars(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :name AND sql IS NOT NULL"
+        ), {'name': table.name}).all()
+        for index in indexes:
+            connection.execute(text(f'DROP INDEX {index}'))
+        connection.execute(text(f'ALTER TABLE {table.name} RENAME TO {old_name}'))
+        table.create(connection)
+        columns = ', '.join(column.name for column in table.columns)
+        connection.execute(text(f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {old_name}'))
+        connection.execute(text(f'DROP TABLE {old_name}'))
+
+# Миграции по порядку: номер версии, имя, функция
+MIGRATIONS = [
+    (1, 'stock_and_idempotency', migrate_stock_and_idempotency),
+    (2, 'prices_to_kopecks', migrate_prices_to_kopecks),
+    (3, 'hot_path_indexes', migrate_hot_path_indexes),
+    (4, 'job_queue', migrate_job_queue),
+    (5, 'unique_sku', migrate_unique_sku),
+    (6, 'autoincrement_ids', migrate_autoincrement_ids),
+]
+
+def upgrade_database():
+    """Применить недостающие миграции; возвращает список примененных.
+
+    Пустая база создается по моделям и сразу помечается последней версией.
+    """
+    with db.engine.begin() as connection:
+        if not inspect(connection).has_table(Sneaker.__tablename__):
+            db.metadata.create_all(connection)
+            connection.execute(insert(SchemaMigration), [
+                {'version': version, 'name': name} for version, name, _ in MIGRATIONS
+            ])
+            return []
+        SchemaMigration.__table__.create(connection, checkfirst=True)
+
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        with db.engine.begin() as connection:
+            lock_migrations(connection)
+            if connection.scalar(select(SchemaMigration.version).where(SchemaMigration.version == version)):
+                continue
+            migrate(connection)
+            connection.execute(insert(SchemaMigration).values(version=version, name=name))
+        applied.append(f'{version:03d}_{name}')
+    return applied
+
+# CLI-команды для создания схемы и начального заполнения базы данных
+
+@bp.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Создать схему базы данных или применить к ней недостающие миграции"""
+    applied = upgrade_database()
+    for migration in applied:
+        print(f"✅ Миграция {migration}")
+    if not applied:
+        print("✅ Схема базы данных актуальна")
+
+# Прежнее имя команды: init-db - то же самое, что db-upgrade
+bp.cli.add_command(db_upgrade_command, 'init-db')
+
+@bp.cli.command('sweep-reservations')
+def sweep_reservations_command():
+    """Вернуть на склад истекшие резервы (для запуска по расписанию)"""
+    print(f"✅ Возвращено резервов: {release_expired_reservations()}")
+
+@bp.cli.command('run-jobs')
+def run_jobs_command():
+    """Обрабатывать очередь фоновых задач до SIGTERM/Ctrl+C"""
+    worker = JobWorker(current_app._get_current_object())
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    print(f"✅ Воркер очереди задач запущен, потоков: {worker.threads}")
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
+    print("✅ Воркер очереди задач остановлен")
+
+@bp.cli.command('import-catalog')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None,
+              help='Формат файла (по умолчанию - по расширению: .csv или .ndjson, можно с .gz)')
+def import_catalog_command(path, fmt):
+    """Импортировать товары из файла CSV или NDJSON (как POST /admin/catalog/import)"""
+    name = path[:-3] if path.endswith('.gz') else path
+    fmt = fmt or ('csv' if name.endswith('.csv') else 'ndjson')
+    with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as stream:
+        report = import_catalog_stream(stream, fmt)
+    for error in report['errors']:
+        print(f"❌ Строка {error['line']}: {error['error']}")
+    if 'error' in report:
+        print(f"❌ {report['error']}")
+    print(f"✅ Обработано строк: {report['processed']}, добавлено: {report['inserted']}, "
+          f"изменено: {report['updated']}, без изменений: {report['unchanged']}, с ошибками: {report['failed']}")
+
+@bp.cli.command('seed')
+def seed_command():
+    """Создать администратора и заполнить каталог начальными товарами"""
+    seed_database()
+
+def seed_database():
+    """Начальное заполнение базы данных: администратор и каталог товаров"""
+    # Создание учетной записи администратора при первом запуске
+    if not User.query.filter_by(email='admin@admin.com').first():
+        print("👤 Создание учетной записи администратора...")
+        admin_password = password_hasher.hash('admin')
+        admin_user = User(
+            email='admin@admin.com',
+            password_hash=admin_password,
+            first_name='Администратор',
+            last_name='Системы',
+            is_admin=True
+        )
+        db.session.add(admin_user)
+        db.session.commit()
+        print("✅ Администратор создан: admin@admin.com / admin")
+
+    # Заполнение каталога начальными товарами при первом запуске
+    if Sneaker.query.count() == 0:
+        print("📦 Заполнение базы данных товарами...")
+
+        # Список товаров для начального заполнения каталога
+        sneakers = [
+            # Мужские кроссовки
+            Sneaker(
+                brand="Nike",
+                model="Air Jordan 1 Retro High",
+                size=42.0,
+                color_name="Black/Red",
+                price_kopecks=1899900,
+                description="Культовая баскетбольная модель 1985 года. Высокое качество материалов.",
+                category="Basketball",
+                gender="Men",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1600269452121-4f2416e55c28?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+            Sneaker(
+                brand="Adidas",
+                model="Yeezy Boost 350 V2",
+                size=43.5,
+                color_name="Zebra",
+                price_kopecks=2599900,
+                description="Лимитированная модель от Kanye West. Технология Boost для максимального комфорта.",
+                category="Lifestyle",
+                gender="Men",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1560769624-6b03633ba29e?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2022
+            ),
+            Sneaker(
+                brand="Nike",
+                model="Dunk Low Retro",
+                size=41.0,
+                color_name="Panda",
+                price_kopecks=1299900,
+                description="Классические кроссовки для скейтбординга. Универсальный черно-белый дизайн.",
+                category="Skateboarding",
+                gender="Men",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1595950653106-6c9ebd614d3a?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+            Sneaker(
+                brand="New Balance",
+                model="550",
+                size=44.0,
+                color_name="White/Green",
+                price_kopecks=1499900,
+                description="Ретро-баскетбольные кроссовки. Премиальная кожа и замша.",
+                category="Lifestyle",
+                gender="Men",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1606107557195-0e29a4b5b4aa?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2022
+            ),
+            Sneaker(
+                brand="Nike",
+                model="Air Force 1 Low",
+                size=42.5,
+                color_name="Triple White",
+                price_kopecks=1099900,
+                description="Легендарные кроссовки 1982 года. Чистый белый цвет на каждый день.",
+                category="Casual",
+                gender="Men",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1600185365483-26d7a4cc7519?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+            Sneaker(
+                brand="Nike",
+                model="Air Max 97",
+                size=44.5,
+                color_name="Silver Bullet",
+                price_kopecks=1699900,
+                description="Футуристичный дизайн вдохновлен японскими скоростными поездами.",
+                category="Running",
+                gender="Men",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1605348532760-6753d2c43329?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2022
+            ),
+            Sneaker(
+                brand="Nike",
+                model="Blazer Mid '77",
+                size=42.0,
+                color_name="Vintage White",
+                price_kopecks=1199900,
+                description="Винтажный баскетбольный стиль. Универсальная модель.",
+                category="Casual",
+                gender="Men",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1560769624-6b03633ba29e?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+            Sneaker(
+                brand="Reebok",
+                model="Classic Leather",
+                size=43.0,
+                color_name="White",
+                price_kopecks=799900,
+                description="Легендарные кроссовки 1983 года. Мягкая кожа и комфорт.",
+                category="Lifestyle",
+                gender="Men",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1595950653106-6c9ebd614d3a?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+
+            # Женские кроссовки
+            Sneaker(
+                brand="Nike",
+                model="Air Force 1 '07",
+                size=38.0,
+                color_name="White/Pink",
+                price_kopecks=999900,
+                description="Иконические кроссовки в нежном розовом цвете. Идеально для повседневного образа.",
+                category="Casual",
+                gender="Women",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1549298916-b41d501d3772?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+            Sneaker(
+                brand="Adidas",
+                model="Stan Smith",
+                size=37.5,
+                color_name="White/Green",
+                price_kopecks=899900,
+                description="Классические теннисные кроссовки. Минималистичный дизайн и комфорт.",
+                category="Casual",
+                gender="Women",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1606107557195-0e29a4b5b4aa?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+            Sneaker(
+                brand="Nike",
+                model="React Element 55",
+                size=39.0,
+                color_name="Light Cream",
+                price_kopecks=1199900,
+                description="Стильные кроссовки с амортизацией React. Элегантный бежевый цвет.",
+                category="Lifestyle",
+                gender="Women",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1560769624-6b03633ba29e?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+            Sneaker(
+                brand="Puma",
+                model="RS-X³ Puzzle",
+                size=38.5,
+                color_name="Pink/White",
+                price_kopecks=1399900,
+                description="Яркие кроссовки в стиле 90-х. Комфорт и индивидуальность.",
+                category="Lifestyle",
+                gender="Women",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1595950653106-6c9ebd614d3a?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+            Sneaker(
+                brand="Adidas",
+                model="Superstar",
+                size=37.0,
+                color_name="Black/White",
+                price_kopecks=1099900,
+                description="Легендарные кроссовки с тремя полосками. Классика уличной моды.",
+                category="Casual",
+                gender="Women",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1600185365483-26d7a4cc7519?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+            Sneaker(
+                brand="Nike",
+                model="Cortez",
+                size=38.0,
+                color_name="White/Purple",
+                price_kopecks=999900,
+                description="Ретро-бегущие кроссовки. Комфорт и стиль в одном.",
+                category="Running",
+                gender="Women",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1542291026-7eec264c27ff?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+
+            # Детские кроссовки
+            Sneaker(
+                brand="Nike",
+                model="Air Max 90",
+                size=32.0,
+                color_name="Black/White",
+                price_kopecks=799900,
+                description="Классические кроссовки с воздушной подушкой. Для активных детей.",
+                category="Casual",
+                gender="Kids",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1605348532760-6753d2c43329?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+            Sneaker(
+                brand="Adidas",
+                model="Gazelle Kids",
+                size=31.0,
+                color_name="Blue/White",
+                price_kopecks=699900,
+                description="Маленькая копия классики. Качественные материалы для детей.",
+                category="Casual",
+                gender="Kids",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1606107557195-0e29a4b5b4aa?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+            Sneaker(
+                brand="Puma",
+                model="Suede Classic Kids",
+                size=30.5,
+                color_name="Red/White",
+                price_kopecks=599900,
+                description="Яркие кроссовки для маленьких модников. Комфорт и стиль.",
+                category="Casual",
+                gender="Kids",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1560769624-6b03633ba29e?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+            Sneaker(
+                brand="Nike",
+                model="Force 1 Low Kids",
+                size=29.0,
+                color_name="White/Blue",
+                price_kopecks=699900,
+                description="Детская версия легенды. Качественные материалы и комфорт.",
+                category="Casual",
+                gender="Kids",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1595950653106-6c9ebd614d3a?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+            Sneaker(
+                brand="Adidas",
+                model="Superstar Kids",
+                size=28.0,
+                color_name="White/Black",
+                price_kopecks=649900,
+                description="Маленькие звездочки уличной моды. Для самых маленьких.",
+                category="Casual",
+                gender="Kids",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1600185365483-26d7a4cc7519?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+
+            # Дополнительные мужские
+            Sneaker(
+                brand="Adidas",
+                model="Ultraboost 22",
+                size=43.0,
+                color_name="Black",
+                price_kopecks=1899900,
+                description="Профессиональные беговые кроссовки с технологией Boost.",
+                category="Running",
+                gender="Men",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1542291026-7eec264c27ff?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+            Sneaker(
+                brand="Nike",
+                model="Pegasus 39",
+                size=42.0,
+                color_name="Black/White",
+                price_kopecks=1299900,
+                description="Универсальные беговые кроссовки для тренировок.",
+                category="Running",
+                gender="Men",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1606107557195-0e29a4b5b4aa?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+
+            # Дополнительные женские
+            Sneaker(
+                brand="Nike",
+                model="Zoom Pegasus Turbo",
+                size=38.5,
+                color_name="Pink/Black",
+                price_kopecks=1499900,
+                description="Быстрые беговые кроссовки для женщин. Максимальная амортизация.",
+                category="Running",
+                gender="Women",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1560769624-6b03633ba29e?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            ),
+            Sneaker(
+                brand="Adidas",
+                model="NMD_R1",
+                size=37.5,
+                color_name="White/Pink",
+                price_kopecks=1599900,
+                description="Современные кроссовки с технологией Boost. Урбанистический стиль.",
+                category="Lifestyle",
+                gender="Women",
+                in_stock=True,
+                condition="New",
+                image_url="https://images.unsplash.com/photo-1595950653106-6c9ebd614d3a?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80",
+                release_year=2023
+            )
+        ]
+
+        # Массовое добавление товаров в базу данных
+        db.session.add_all(sneakers)
+        db.session.commit()
+        print(f"✅ {len(sneakers)} кроссовок добавлены в базу данных!")
+
+# Генератор синтетических данных для нагрузочного тестирования
+
+# Пароль всех сгенерированных пользователей (хеш bcrypt с низкой стоимостью)
+GENERATED_USER_PASSWORD = 'password'
+GENERATED_BCRYPT_ROUNDS = 4
+GENERATED_PASSWORD_HASHES = 16  # Разные соли: одинаковые хеши у всех пользователей нетипичны
+GENERATED_PRICE_SAMPLES = 4096  # Размер выборки цен, из которой цены берутся для товаров
+
+# Популярность брендов, категорий и статусов заказов (веса выбора)
+GENERATED_BRANDS = [('Nike', 30), ('Adidas', 25), ('Puma', 10), ('New Balance', 10), ('Reebok', 7),
+                    ('Asics', 6), ('Converse', 5), ('Vans', 4), ('Jordan', 2), ('Salomon', 1)]
+GENERATED_CATEGORIES = [('Lifestyle', 35), ('Running', 30), ('Casual', 20), ('Basketball', 10), ('Trail', 5)]
+GENERATED_GENDERS = [('Men', 45), ('Women', 40), ('Kids', 10), ('Unisex', 5)]
+GENERATED_COLORS = ['Black', 'White', 'Black/White', 'Grey', 'Navy', 'Red', 'Beige', 'Green']
+GENERATED_ORDER_STATUSES = [('delivered', 70), ('shipped', 10), ('confirmed', 8), ('pending', 7), ('cancelled', 5)]
+
+def timestamp(value):
+    """Время в текстовом формате, одинаково понятном SQLite (как у SQLAlchemy) и COPY PostgreSQL"""
+    return f'{value:%Y-%m-%d %H:%M:%S.%f}'
+
+class BulkWriter:
+    """Массовая вставка пачек строк: COPY в PostgreSQL, executemany в остальных СУБД.
+
+    Пачка - список кортежей в порядке columns. Для executemany оператор
+    INSERT компилируется один раз и выполняется через драйвер без
+    поштучной обработки параметров SQLAlchemy. Неуникальные индексы таблиц
+    на время загрузки удаляются и строятся заново одним проходом в finish -
+    это быстрее, чем обновлять их при вставке каждой строки; уникальные
+    остаются и проверяют загружаемые строки. Удаление индексов идет в той же
+    транзакции, что и загрузка: при ошибке откат возвращает их. Идентификаторы
+    генерируются заранее, поэтому в PostgreSQL после загрузки
+    последовательности id сдвигаются на максимальный id таблицы (finish).
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.copy = connection.dialect.name == 'postgresql'
+        self.quote = connection.dialect.identifier_preparer.quote
+        self.tables = set()
+        if connection.dialect.name == 'sqlite' and not connection.connection.dbapi_connection.in_transaction:
+            # Без явного BEGIN модуль sqlite3 выполняет DROP INDEX вне транзакции
+            connection.exec_driver_sql('BEGIN')
+
+    def write(self, model, columns, batches):
+        """Вставить все пачки; вернуть число строк"""
+        table = model.__table__
+        if table not in self.tables:
+            self.tables.add(table)
+            for index in self._deferred_indexes(table):
+                index.drop(self.connection, checkfirst=True)
+        compiled = insert(table).compile(dialect=self.connection.dialect, column_keys=list(columns))
+        order = [columns.index(name) for name in compiled.positiontup] if compiled.positional else None
+        # Кортежи в порядке колонок таблицы передаются драйверу без перестановки
+        in_order = order == list(range(len(columns)))
+        count = 0
+        for batch in batches:
+            if self.copy:
+                self._copy(table, columns, batch)
+            elif in_order:
+                self.connection.exec_driver_sql(compiled.string, batch)
+            elif order is not None:
+                self.connection.exec_driver_sql(compiled.string, [tuple(row[i] for i in order) for row in batch])
+            else:
+                self.connection.exec_driver_sql(compiled.string, [dict(zip(columns, row)) for row in batch])
+            count += len(batch)
+        return count
+
+    def _copy(self, table, columns, batch):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        cursor = self.connection.connection.dbapi_connection.cursor()
+        try:
+            cursor.copy_expert(f'COPY {self.quote(table.name)} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _deferred_indexes(table):
+        return [index for index in table.indexes if not index.unique]
+
+    def finish(self):
+        """Построить отложенные индексы и сдвинуть последовательности id"""
+        for table in self.tables:
+            for index in self._deferred_indexes(table):
+                index.create(self.connection)
+        if self.copy:
+            for table in self.tables:
+                self.connection.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{self.quote(table.name)}', 'id'), "
+                    f"(SELECT COALESCE(MAX(id), 1) FROM {self.quote(table.name)}))"
+                ))
+
+def next_id(connection, model):
+    return (connection.scalar(select(func.max(model.id))) or 0) + 1
+
+def id_batches(first_id, count, batch_size):
+    """Диапазоны id по batch_size штук"""
+    for start in range(first_id, first_id + count, batch_size):
+        yield range(start, min(start + batch_size, first_id + count))
+
+# Простое число больше любого размера каталога: i -> i * p mod n - перестановка [0, n)
+POPULARITY_PERMUTATION_PRIME = 2147483647
+
+def popular_index(rng, count):
+    """Индекс в [0, count) со смещением к началу: немногие товары и покупатели дают основную долю заказов"""
+    return int(count * rng.random() ** 3)
+
+SNEAKER_COLUMNS = ('id', 'brand', 'model', 'size', 'color_name', 'price_kopecks', 'description',
+                   'category', 'gender', 'in_stock', 'condition', 'release_year', 'sku', 'updated_at')
+USER_COLUMNS = ('id', 'email', 'password_hash', 'first_name', 'last_name', 'is_admin', 'created_at')
+BASKET_ITEM_COLUMNS = ('id', 'user_id', 'sneaker_id', 'size', 'quantity', 'added_at')
+ORDER_COLUMNS = ('id', 'user_id', 'total_amount_kopecks', 'status', 'created_at')
+ORDER_ITEM_COLUMNS = ('id', 'order_id', 'sneaker_id', 'size', 'quantity', 'price_kopecks')
+
+def generate_data(products=0, users=0, basket_users=0, orders=0, batch_size=10000, seed=None):
+    """Сгенерировать товары, пользователей, корзины и заказы с реалистичными распределениями.
+
+    Данные добавляются к уже существующим. Корзины и заказы ссылаются на товары
+    и пользователей из базы (включая только что созданных). Возвращает словарь
+    с числом вставленных строк по таблицам.
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    updated_at = timestamp(now)
+    counts = {}
+
+    def pick(choices, k):
+        """k значений из списка пар (значение, вес)"""
+        values, weights = zip(*choices)
+        return rng.choices(values, weights, k=k)
+
+    def sneaker_batches(first_id):
+        # Распределения считаются заранее, а значения выбираются целыми колонками на пачку:
+        # размеры - нормальные вокруг 42 с шагом 0.5, цены - логнормальные с окончанием на 99 рублей
+        sizes = [size / 2 for size in range(70, 97)]
+        size_weights = [math.exp(-((size - 42) / 2.5) ** 2 / 2) for size in sizes]
+        prices = [(min(max(int(rng.lognormvariate(9.1, 0.45)), 1999), 79999) // 100 * 100 + 99) * KOPECKS_PER_RUBLE
+                  for _ in range(GENERATED_PRICE_SAMPLES)]
+        years = list(range(2015, now.year + 1))
+        for ids in id_batches(first_id, products, batch_size):
+            k = len(ids)
+            brands = pick(GENERATED_BRANDS, k)
+            yield list(zip(
+                ids, brands, [f'{brand} Model {sneaker_id % 5000}' for brand, sneaker_id in zip(brands, ids)],
+                rng.choices(sizes, size_weights, k=k), rng.choices(GENERATED_COLORS, k=k), rng.choices(prices, k=k),
+                [f'{brand}: сгенерированная модель для нагрузочного тестирования.' for brand in brands],
+                pick(GENERATED_CATEGORIES, k), pick(GENERATED_GENDERS, k), rng.choices((True, False), (9, 1), k=k),
+                itertools.repeat('New', k), rng.choices(years, k=k), [f'GEN-{sneaker_id:09d}' for sneaker_id in ids],
+                itertools.repeat(updated_at, k),
+            ))
+
+    def user_batches(first_id):
+        password_hashes = [hash_password_blocking(GENERATED_USER_PASSWORD, GENERATED_BCRYPT_ROUNDS)
+                           for _ in range(GENERATED_PASSWORD_HASHES)]
+        for ids in id_batches(first_id, users, batch_size):
+            yield [
+                (user_id, f'user{user_id}@example.com', password_hashes[user_id % GENERATED_PASSWORD_HASHES],
+                 'Пользователь', str(user_id), False, timestamp(now - timedelta(days=rng.random() * 730)))
+                for user_id in ids
+            ]
+
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'sqlite':
+            # Загрузка тестовых данных: без fsync на каждую транзакцию
+            connection.exec_driver_sql('PRAGMA synchronous = OFF')
+        writer = BulkWriter(connection)
+
+        if products:
+            counts['sneaker'] = writer.write(Sneaker, SNEAKER_COLUMNS, sneaker_batches(next_id(connection, Sneaker)))
+        if users:
+            counts['user'] = writer.write(User, USER_COLUMNS, user_batches(next_id(connection, User)))
+        if not (basket_users or orders):
+            writer.finish()
+            return counts
+
+        # Каталог и пользователи для корзин и заказов
+        catalog = connection.execute(select(Sneaker.id, Sneaker.price_kopecks, Sneaker.size)).all()
+        user_ids = connection.scalars(select(User.id)).all()
+        if not catalog or not user_ids:
+            raise ValueError('Для корзин и заказов нужны товары и пользователи')
+
+        def pick_product():
+            # Умножение на простое число переставляет ранги популярности по каталогу,
+            # чтобы популярность товара не зависела от его id
+            return catalog[popular_index(rng, len(catalog)) * POPULARITY_PERMUTATION_PRIME % len(catalog)]
+
+        def basket_batches(first_id):
+            # Корзины создаются только пользователям, у которых их еще нет
+            with_basket = set(connection.scalars(select(BasketItem.user_id).distinct()))
+            candidates = [user_id for user_id in user_ids if user_id not in with_basket]
+            basket_id = first_id
+            batch = []
+            for user_id in rng.sample(candidates, min(basket_users, len(candidates))):
+                # Экспоненциальное число строк в корзине: чаще 1-2 товара
+                lines = {}
+                for _ in range(min(int(rng.expovariate(0.6)) + 1, 10)):
+                    sneaker_id, _, size = pick_product()
+                    lines[(sneaker_id, size)] = 1 if rng.random() < 0.85 else 2
+                for (sneaker_id, size), quantity in lines.items():
+                    batch.append((basket_id, user_id, sneaker_id, size, quantity,
+                                  timestamp(now - timedelta(hours=rng.random() * 72))))
+                    basket_id += 1
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        if basket_users:
+            counts['basket_item'] = writer.write(BasketItem, BASKET_ITEM_COLUMNS,
+                                                 basket_batches(next_id(connection, BasketItem)))
+
+        if orders:
+            # Заказ и его элементы создаются вместе, элементы пишутся следом за пачкой заказов
+            item_id = next_id(connection, OrderItem)
+            counts['order'] = counts['order_item'] = 0
+            for ids in id_batches(next_id(connection, Order), orders, batch_size):
+                statuses = pick(GENERATED_ORDER_STATUSES, len(ids))
+                order_rows, item_rows = [], []
+                for order_id, status in zip(ids, statuses):
+                    total = 0
+                    for _ in range(min(int(rng.expovariate(0.9)) + 1, 6)):
+                        sneaker_id, price, size = pick_product()
+                        quantity = 1 if rng.random() < 0.9 else 2
+                        item_rows.append((item_id, order_id, sneaker_id, size, quantity, price))
+                        total += price * quantity
+                        item_id += 1
+                    order_rows.append((order_id, user_ids[popular_index(rng, len(user_ids))], total, status,
+                                       timestamp(now - timedelta(days=rng.random() * 365))))
+                counts['order'] += writer.write(Order, ORDER_COLUMNS, [order_rows])
+                counts['order_item'] += writer.write(OrderItem, ORDER_ITEM_COLUMNS, [item_rows])
+
+        writer.finish()
+    return counts
+
+@bp.cli.command('generate-data')
+@click.option('--products', default=100000, show_default=True, help='Сколько товаров создать')
+@click.option('--users', default=10000, show_default=True, help='Сколько пользователей создать')
+@click.option('--basket-users', default=2000, show_default=True, help='У скольких пользователей заполнить корзину')
+@click.option('--orders', default=50000, show_default=True, help='Сколько заказов создать')
+@click.option('--batch-size', default=10000, show_default=True, help='Строк в одной пачке вставки')
+@click.option('--seed', type=int, default=None, help='Зерно генератора для повторяемых данных')
+def generate_data_command(products, users, basket_users, orders, batch_size, seed):
+    """Заполнить базу синтетическими данными для нагрузочного тестирования"""
+    started = time.perf_counter()
+    counts = generate_data(products, users, basket_users, orders, batch_size, seed)
+    for table, count in counts.items():
+        print(f"✅ {table}: {count}")
+    print(f"⏱ {time.perf_counter() - started:.1f} с; пароль пользователей: {GENERATED_USER_PASSWORD}")
+
+# Запуск Flask приложения в режиме разработки
+if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        # Создание или обновление схемы базы данных и начальное заполнение
+        upgrade_database()
+        seed_database()
+    # Перезагрузчик запускает модуль дважды: в наблюдающем процессе и в дочернем,
+    # который обслуживает запросы; фоновые потоки нужны только дочернему
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_reservation_sweeper(app)
+        start_job_worker(app)
 
     # Запуск Flask сервера в режиме разработки с автоматической перезагрузкой
     print("🚀 Запуск сервера на http://127.0.0.1:5000")
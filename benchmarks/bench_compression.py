@@ -0,0 +1,86 @@
+"""Бенчмарк сжатия ответов каталога: байты на проводе и CPU на запрос.
+
+Запуск: python benchmarks/bench_compression.py [--rows 500] [--requests 200]
+
+Заполняет временную SQLite базу товарами и сравнивает для /catalog:
+ответ без сжатия, сжатие на каждый запрос и сжатые варианты из кэша каталога.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import Sneaker, create_app, db, publish_catalog_change  # noqa: E402
+
+
+def seed(rows):
+    db.session.add_all([
+        Sneaker(
+            brand=('Nike', 'Adidas', 'Puma', 'New Balance')[i % 4],
+            model=f'Model {i}',
+            size=36 + i % 10,
+            color_name='Black/White',
+            price_kopecks=(5000 + i * 10) * 100,
+            description='Классические кроссовки для повседневной носки. Качественные материалы и комфорт.',
+            category=('Running', 'Casual', 'Lifestyle')[i % 3],
+            gender=('Men', 'Women', 'Kids')[i % 3],
+            image_url='https://images.unsplash.com/photo-1600269452121-4f2416e55c28?ixlib=rb-4.0.3&auto=format&fit=crop&w=800&q=80',
+            release_year=2020 + i % 4,
+        )
+        for i in range(rows)
+    ])
+    db.session.commit()
+
+
+def drop_cache():
+    """Сбросить кэш ответов каталога, как после изменения товаров"""
+    publish_catalog_change(set())
+
+
+def measure(client, path, headers, requests, before_each=None):
+    """Средние байты тела и CPU-время процесса на один запрос"""
+    size = 0
+    cpu = 0.0
+    for _ in range(requests):
+        if before_each:
+            before_each()
+        start = time.process_time()
+        response = client.get(path, headers=headers)
+        cpu += time.process_time() - start
+        size = len(response.data)
+    return size, cpu / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        db.create_all()
+        seed(args.rows)
+    client = app.test_client()
+    url = f'/catalog?limit={min(args.rows, 500)}'
+    gzip_headers = {'Accept-Encoding': 'gzip'}
+
+    results = [
+        ('без сжатия, кэш', *measure(client, url, {}, args.requests)),
+        ('gzip, сжатие на каждый запрос', *measure(client, url, gzip_headers, args.requests,
+                                                 before_each=drop_cache)),
+        ('без сжатия, промах кэша', *measure(client, url, {}, args.requests,
+                                           before_each=drop_cache)),
+        ('gzip, сжатый вариант из кэша', *measure(client, url, gzip_headers, args.requests)),
+    ]
+    print(f'{"вариант":<32} {"байт":>10} {"CPU мкс/запрос":>16}')
+    for name, size, cpu in results:
+        print(f'{name:<32} {size:>10} {cpu:>16.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Проверка потребления памяти потоковой выгрузкой /catalog/export.
+
+Запуск: python benchmarks/bench_export_memory.py [--checkpoints 50000,500000] [--max-growth 1.5]
+
+Для каждой контрольной точки заполняет временную SQLite базу нужным числом
+товаров и читает выгрузку по частям, измеряя пик выделенной памяти Python
+(tracemalloc) во время выгрузки. Пик не должен расти вместе с размером
+каталога; при росте более чем в --max-growth раз скрипт завершается с кодом 1.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert  # noqa: E402
+
+from app import Sneaker, create_app, db  # noqa: E402
+
+INSERT_CHUNK = 10000
+
+
+def seed(rows):
+    """Быстрое заполнение таблицы через Core executemany"""
+    now = time.time()
+    for start in range(0, rows, INSERT_CHUNK):
+        db.session.execute(insert(Sneaker), [
+            {
+                'brand': 'Nike',
+                'model': f'Model {i}',
+                'size': 36 + i % 10,
+                'color_name': 'Black/White',
+                'price_kopecks': (5000 + i % 1000) * 100,
+                'description': 'Классические кроссовки для повседневной носки.',
+                'category': 'Casual',
+                'gender': 'Men',
+                'in_stock': True,
+                'condition': 'New',
+            }
+            for i in range(start, min(start + INSERT_CHUNK, rows))
+        ])
+    db.session.commit()
+    print(f'  заполнено {rows} строк за {time.time() - now:.1f} с')
+
+
+def export_peak(rows):
+    """Пик памяти (байт) и число строк при чтении полной выгрузки"""
+    path = os.path.join(tempfile.mkdtemp(), 'export.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        db.create_all()
+        seed(rows)
+
+    client = app.test_client()
+    tracemalloc.start()
+    response = client.get('/catalog/export', buffered=False)
+    lines = 0
+    for chunk in response.response:
+        lines += chunk.count(b'\n') if isinstance(chunk, bytes) else chunk.count('\n')
+    response.close()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--checkpoints', default='50000,500000')
+    parser.add_argument('--max-growth', type=float, default=1.5)
+    args = parser.parse_args()
+
+    peaks = []
+    for rows in (int(value) for value in args.checkpoints.split(',')):
+        print(f'{rows} строк:')
+        peak, lines = export_peak(rows)
+        assert lines == rows, f'выгружено {lines} строк вместо {rows}'
+        peaks.append(peak)
+        print(f'  пик памяти при выгрузке: {peak / 1024 / 1024:.1f} МБ')
+
+    growth = peaks[-1] / peaks[0]
+    print(f'рост пика памяти: x{growth:.2f}')
+    if growth > args.max_growth:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
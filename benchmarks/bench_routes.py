@@ -0,0 +1,424 @@
+"""Нагрузочный бенчмарк основных маршрутов API со сравнением с сохраненным базовым уровнем.
+
+Запуск: python benchmarks/bench_routes.py [--mode client|gunicorn|both] [--products 2000]
+        [--users 50] [--iterations 200] [--concurrency 8] [--workers 2]
+        [--baseline benchmarks/baseline.json] [--update-baseline]
+        [--latency-baseline FILE] [--tolerance 0.5] [--p95-tolerance 2.0]
+
+Заполняет временную SQLite базу генератором данных (generate_data) и прогоняет сценарии
+(каталог, карточка товара, вход, операции с корзиной, оформление заказа)
+параллельными клиентами через тестовый клиент Flask и/или через настоящий
+процесс gunicorn. Перед замерами выполняется прогревочный проход чтения,
+чтобы запуск воркеров не попадал в первый шаг. Для каждого шага выводит
+число запросов в секунду, p50/p95/p99 задержки и среднее число SQL-запросов
+(из /metrics приложения).
+
+Скрипт завершается с кодом 1, если шаг вернул неожиданный статус или число
+SQL-запросов выросло по сравнению с --baseline (хранится в репозитории и
+не зависит от машины). --update-baseline перезаписывает его текущими числами
+SQL-запросов.
+
+Задержки сравниваются только по запросу и только с замером на той же машине:
+с --latency-baseline FILE первый запуск сохраняет задержки в FILE, следующие
+завершаются с кодом 1, если p50 или пропускная способность хуже сохраненных
+больше чем на --tolerance, p95 - больше чем на --p95-tolerance (хвосты записи
+в SQLite сильно шумят из-за блокировки базы); к задержкам добавляется
+абсолютный запас --min-delta-ms для быстрых маршрутов. --update-baseline
+вместе с --latency-baseline перезаписывает и FILE.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import select  # noqa: E402
+
+from app import (GENERATED_BCRYPT_ROUNDS, GENERATED_BRANDS, GENERATED_USER_PASSWORD,  # noqa: E402
+                 Sneaker, create_app, db, generate_data, metrics)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+BRANDS = [brand for brand, _ in GENERATED_BRANDS[:5]]
+
+# Шаг сценария -> эндпоинт Flask (для числа SQL-запросов из /metrics)
+STEP_ENDPOINTS = {
+    'GET /catalog': 'api.get_products',
+    'GET /catalog/<id>': 'api.get_product',
+    'POST /auth/login': 'api.login',
+    'POST /basket': 'api.add_to_basket',
+    'GET /basket': 'api.get_basket',
+    'PUT /basket/<id>': 'api.update_basket_item',
+    'DELETE /basket/<id>': 'api.remove_from_basket',
+    'POST /orders/checkout': 'api.checkout',
+}
+
+
+# Клиенты: тестовый клиент Flask и HTTP к gunicorn с keep-alive соединением на поток
+
+class FlaskClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = self.client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+    def metrics_text(self):
+        return metrics.render()
+
+
+class HttpClient:
+    def __init__(self, port):
+        self.port = port
+        self.local = threading.local()
+
+    def _connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        return self.local.connection
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        payload = json.dumps(body) if body is not None else None
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=payload, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # Воркер мог закрыть соединение при перезапуске (max_requests)
+                connection.close()
+                self.local.connection = None
+                if attempt:
+                    raise
+        try:
+            return response.status, json.loads(data)
+        except ValueError:
+            return response.status, None
+
+    def metrics_text(self):
+        # Воркеры сохраняют метрики в METRICS_DIR раз в METRICS_FLUSH_INTERVAL
+        time.sleep(1)
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        connection.request('GET', '/metrics')
+        return connection.getresponse().read().decode()
+
+
+# Сценарии: одна итерация выполняет один или несколько шагов и возвращает
+# список (шаг, ожидаемый статус, фактический статус, секунды)
+
+class Scenarios:
+    def __init__(self, client, product_ids, tokens, users):
+        self.client = client
+        self.product_ids = product_ids
+        self.tokens = tokens
+        self.users = users
+
+    def _call(self, results, step, expected, method, path, body=None, token=None):
+        started = time.perf_counter()
+        status, data = self.client.request(method, path, body, token)
+        results.append((step, expected, status, time.perf_counter() - started))
+        return data
+
+    def catalog(self, i, rng):
+        results = []
+        brand = BRANDS[i % len(BRANDS)]
+        after = rng.choice(self.product_ids)
+        self._call(results, 'GET /catalog', 200, 'GET', f'/catalog?brand={brand.replace(" ", "%20")}&limit=50&after={after}')
+        return results
+
+    def product(self, i, rng):
+        results = []
+        self._call(results, 'GET /catalog/<id>', 200, 'GET', f'/catalog/{rng.choice(self.product_ids)}')
+        return results
+
+    def login(self, i, rng):
+        results = []
+        self._call(results, 'POST /auth/login', 200, 'POST', '/auth/login',
+                   {'email': user_email(i % self.users), 'password': GENERATED_USER_PASSWORD})
+        return results
+
+    def basket(self, i, rng):
+        results = []
+        token = self.tokens[i % len(self.tokens)]
+        sneaker_id = rng.choice(self.product_ids)
+        self._call(results, 'POST /basket', 201, 'POST', '/basket',
+                   {'sneaker_id': sneaker_id, 'size': 42, 'quantity': 1}, token)
+        basket = self._call(results, 'GET /basket', 200, 'GET', '/basket', token=token) or []
+        item = next((row for row in basket if row['sneaker_id'] == sneaker_id), None)
+        if item is not None:
+            self._call(results, 'PUT /basket/<id>', 200, 'PUT', f'/basket/{item["id"]}', {'quantity': 2}, token)
+            self._call(results, 'DELETE /basket/<id>', 200, 'DELETE', f'/basket/{item["id"]}', token=token)
+        return results
+
+    def checkout(self, i, rng):
+        results = []
+        token = self.tokens[i % len(self.tokens)]
+        self._call(results, 'POST /basket', 201, 'POST', '/basket',
+                   {'sneaker_id': rng.choice(self.product_ids), 'size': 42, 'quantity': 1}, token)
+        self._call(results, 'POST /orders/checkout', 201, 'POST', '/orders/checkout', token=token)
+        return results
+
+
+def user_email(index):
+    # Пользователи генератора в пустой базе получают id с 1 и email user<id>@example.com
+    return f'user{index + 1}@example.com'
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_scenario(scenarios, name, iterations, concurrency):
+    """Выполнить сценарий параллельно; вернуть задержки, ошибки и время по шагам"""
+    scenario = getattr(scenarios, name)
+    # Потоки берут итерации по очереди; у каждой итерации свой генератор для повторяемости
+    with ThreadPoolExecutor(concurrency) as pool:
+        started = time.perf_counter()
+        batches = list(pool.map(lambda i: scenario(i, random.Random(i)), range(iterations)))
+        elapsed = time.perf_counter() - started
+    latencies = defaultdict(list)
+    errors = defaultdict(list)
+    for batch in batches:
+        for step, expected, status, seconds in batch:
+            latencies[step].append(seconds)
+            if status != expected:
+                errors[step].append(status)
+    return {
+        step: {
+            'requests': len(values),
+            'rps': len(values) / elapsed,
+            'p50': percentile(values, 0.50) * 1000,
+            'p95': percentile(values, 0.95) * 1000,
+            'p99': percentile(values, 0.99) * 1000,
+            'errors': errors[step],
+        }
+        for step, values in latencies.items()
+    }
+
+
+def sql_per_request(metrics_text):
+    """Среднее число SQL-запросов на запрос по эндпоинтам из текста /metrics"""
+    totals = defaultdict(dict)
+    pattern = re.compile(r'^http_request_sql_statements_(sum|count)\{endpoint="([^"]+)"\} (\S+)$', re.M)
+    for kind, endpoint, value in pattern.findall(metrics_text):
+        totals[endpoint][kind] = float(value)
+    return {endpoint: values['sum'] / values['count'] for endpoint, values in totals.items() if values.get('count')}
+
+
+def run_all(client, product_ids, tokens, args):
+    scenarios = Scenarios(client, product_ids, tokens, args.users)
+    # Прогрев: ответы ждут, пока воркеры не закончат запуск, результаты не учитываются
+    for name in ('catalog', 'product', 'login'):
+        run_scenario(scenarios, name, args.concurrency * 4, args.concurrency)
+    results = {}
+    for name in ('catalog', 'product', 'login', 'basket', 'checkout'):
+        results.update(run_scenario(scenarios, name, args.iterations, args.concurrency))
+    sql = sql_per_request(client.metrics_text())
+    for step, row in results.items():
+        row['sql'] = sql.get(STEP_ENDPOINTS[step])
+    return results
+
+
+def app_config(path, args):
+    return {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 30}},
+        'BCRYPT_LOG_ROUNDS': GENERATED_BCRYPT_ROUNDS,  # Вход без перехеширования паролей генератора
+        'PASSWORD_HASH_MAX_PENDING': args.concurrency,
+        'RESERVATION_SWEEP_INTERVAL': 0,
+        'SLOW_REQUEST_SECONDS': float('inf'),
+    }
+
+
+def prepare_database(args):
+    """Создать и заполнить базу; вернуть путь, id товаров и токены пользователей"""
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = create_app(app_config(path, args))
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        generate_data(products=args.products, users=args.users, seed=1)
+        product_ids = db.session.scalars(select(Sneaker.id)).all()
+        print(f'База: {args.products} товаров, {args.users} пользователей за {time.perf_counter() - started:.1f} с')
+    # Токены выдает сервер: так они действительны и для процесса gunicorn
+    client = FlaskClient(app)
+    tokens = [
+        client.request('POST', '/auth/login',
+                       {'email': user_email(i), 'password': GENERATED_USER_PASSWORD})[1]['access_token']
+        for i in range(args.users)
+    ]
+    return path, product_ids, tokens
+
+
+def run_client_mode(path, product_ids, tokens, args):
+    app = create_app(app_config(path, args))
+    # Метрики процесса накоплены при подготовке базы; считаем только прогон
+    metrics.reset()
+    return run_all(FlaskClient(app), product_ids, tokens, args)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_gunicorn_mode(path, product_ids, tokens, args):
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=f'sqlite:///{path}',
+        PORT=str(port),
+        WEB_CONCURRENCY=str(args.workers),
+        GUNICORN_THREADS=str(args.concurrency),
+        BCRYPT_LOG_ROUNDS=str(GENERATED_BCRYPT_ROUNDS),
+        PASSWORD_HASH_MAX_PENDING=str(args.concurrency),
+        RESERVATION_SWEEP_INTERVAL='0',
+        SLOW_REQUEST_SECONDS='inf',
+        METRICS_DIR=tempfile.mkdtemp(),
+        METRICS_FLUSH_INTERVAL='0.2',
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--log-level', 'warning', 'app:create_app()'],
+        cwd=ROOT, env=env,
+    )
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError('gunicorn не запустился')
+                time.sleep(0.2)
+        return run_all(HttpClient(port), product_ids, tokens, args)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def print_results(mode, results):
+    print(f'\n{mode}')
+    print(f'{"шаг":<24} {"запросов":>9} {"rps":>8} {"p50 мс":>8} {"p95 мс":>8} {"p99 мс":>8} {"SQL":>6} {"ошибок":>7}')
+    for step, row in results.items():
+        sql = f'{row["sql"]:.1f}' if row['sql'] is not None else '-'
+        print(f'{step:<24} {row["requests"]:>9} {row["rps"]:>8.0f} {row["p50"]:>8.2f} {row["p95"]:>8.2f} '
+              f'{row["p99"]:>8.2f} {sql:>6} {len(row["errors"]):>7}')
+
+
+def compare(mode, results, baseline, latency_baseline, args):
+    """Список описаний регрессий: статусы и SQL-запросы, задержки - если есть замер этой машины"""
+    problems = []
+    for step, row in results.items():
+        if row['errors']:
+            problems.append(f'{mode} {step}: неожиданные статусы {sorted(row["errors"])}')
+        base_sql = baseline.get(mode, {}).get(step, {}).get('sql')
+        if row['sql'] is not None and base_sql is not None and row['sql'] > base_sql + 0.5:
+            problems.append(f'{mode} {step}: {row["sql"]:.1f} SQL-запросов, базовый {base_sql:.1f}')
+        base = latency_baseline.get(mode, {}).get(step)
+        if base is None:
+            continue
+        if row['p50'] > base['p50'] * (1 + args.tolerance) + args.min_delta_ms:
+            problems.append(f'{mode} {step}: p50 {row["p50"]:.2f} мс, замер этой машины {base["p50"]:.2f} мс')
+        if row['p95'] > base['p95'] * (1 + args.p95_tolerance) + args.min_delta_ms:
+            problems.append(f'{mode} {step}: p95 {row["p95"]:.2f} мс, замер этой машины {base["p95"]:.2f} мс')
+        if row['rps'] < base['rps'] / (1 + args.tolerance):
+            problems.append(f'{mode} {step}: {row["rps"]:.0f} rps, замер этой машины {base["rps"]:.0f} rps')
+    return problems
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(path, results, keys):
+    """Записать выбранные поля результатов по режимам, сохранив остальные режимы файла"""
+    saved = load_results(path)
+    saved.update({
+        mode: {step: {key: round(row[key], 2) if row[key] is not None else None for key in keys}
+               for step, row in mode_results.items()}
+        for mode, mode_results in results.items()
+    })
+    with open(path, 'w') as f:
+        json.dump(saved, f, indent=2, ensure_ascii=False, sort_keys=True)
+        f.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=('client', 'gunicorn', 'both'), default='both')
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--latency-baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    parser.add_argument('--p95-tolerance', type=float, default=2.0)
+    parser.add_argument('--min-delta-ms', type=float, default=2.0)
+    args = parser.parse_args()
+
+    path, product_ids, tokens = prepare_database(args)
+    modes = ('client', 'gunicorn') if args.mode == 'both' else (args.mode,)
+    runners = {'client': run_client_mode, 'gunicorn': run_gunicorn_mode}
+    results = {}
+    for mode in modes:
+        results[mode] = runners[mode](path, product_ids, tokens, args)
+        print_results(mode, results[mode])
+
+    latency_keys = ('rps', 'p50', 'p95', 'p99')
+    if args.update_baseline:
+        save_results(args.baseline, results, ('sql',))
+        print(f'\nЧисла SQL-запросов сохранены в {args.baseline}')
+        if args.latency_baseline:
+            save_results(args.latency_baseline, results, latency_keys)
+            print(f'Задержки сохранены в {args.latency_baseline}')
+        return
+
+    baseline = load_results(args.baseline)
+    if not baseline:
+        print(f'\nБазовый уровень {args.baseline} не найден, сравнение SQL-запросов пропущено')
+    latency_baseline = {}
+    if args.latency_baseline:
+        latency_baseline = load_results(args.latency_baseline)
+        if not latency_baseline:
+            save_results(args.latency_baseline, results, latency_keys)
+            print(f'\nЗадержки сохранены в {args.latency_baseline}: следующие запуски на этой машине сравниваются с ними')
+    problems = [problem for mode in results
+                for problem in compare(mode, results[mode], baseline, latency_baseline, args)]
+    if problems:
+        print('\nРЕГРЕССИИ:')
+        for problem in problems:
+            print(f'  {problem}')
+        sys.exit(1)
+    print('\nРегрессий нет')
+
+
+if __name__ == '__main__':
+    main()
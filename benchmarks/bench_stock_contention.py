@@ -0,0 +1,97 @@
+"""Проверка резервирования остатков при одновременной покупке одного товара.
+
+Запуск: python benchmarks/bench_stock_contention.py [--stock 50] [--users 200] [--threads 16]
+
+Заводит один товар с остатком --stock и заставляет --users пользователей
+одновременно (в --threads потоках) положить его в корзину и оформить заказ.
+Успешных заказов должно быть ровно столько, сколько было товара, остаток
+не может уйти в минус, а резервов после оформления не остается; при
+нарушении любого условия скрипт завершается с кодом 1.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+from sqlalchemy import func, insert, select  # noqa: E402
+
+from app import Order, Sneaker, Stock, StockReservation, User, create_app, db  # noqa: E402
+
+SIZE = 42.0
+
+
+def prepare(app, stock, users):
+    """Товар с остатком и пользователи; возвращает id товара и токены"""
+    with app.app_context():
+        db.create_all()
+        sneaker = Sneaker(brand='Nike', model='Flash Sale', size=SIZE, color_name='Black',
+                          price_kopecks=999000, description='Лимитированная модель', category='Casual',
+                          gender='Men', in_stock=True)
+        db.session.add(sneaker)
+        db.session.flush()
+        db.session.add(Stock(sneaker_id=sneaker.id, size=SIZE, quantity=stock))
+        db.session.execute(insert(User), [
+            {'email': f'buyer{i}@example.com', 'password_hash': '-', 'first_name': 'Buyer', 'last_name': str(i)}
+            for i in range(users)
+        ])
+        db.session.commit()
+        tokens = [create_access_token(identity=str(user_id)) for user_id in db.session.scalars(select(User.id))]
+        return sneaker.id, tokens
+
+
+def buy(client, sneaker_id, token):
+    """Положить товар в корзину и оформить заказ; возвращает итоговый статус"""
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.post('/basket', json={'sneaker_id': sneaker_id, 'size': SIZE}, headers=headers)
+    if response.status_code != 201:
+        return f'basket {response.status_code}'
+    response = client.post('/orders/checkout', headers=headers)
+    return f'checkout {response.status_code}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stock', type=int, default=50)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'stock.db')
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 30}},
+    })
+    sneaker_id, tokens = prepare(app, args.stock, args.users)
+    client = app.test_client()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        statuses = Counter(pool.map(lambda token: buy(client, sneaker_id, token), tokens))
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        remaining = db.session.scalar(select(Stock.quantity).where(Stock.sneaker_id == sneaker_id))
+        reserved = db.session.scalar(select(func.coalesce(func.sum(StockReservation.quantity), 0)))
+        orders = db.session.scalar(select(func.count()).select_from(Order))
+
+    print(f'{args.users} покупателей, {args.threads} потоков, {elapsed:.2f} с '
+          f'({args.users / elapsed:.0f} покупок/с)')
+    for status, count in sorted(statuses.items()):
+        print(f'  {status}: {count}')
+    print(f'заказов: {orders}, остаток: {remaining}, в резерве: {reserved}')
+
+    expected = min(args.stock, args.users)
+    if statuses['checkout 201'] != expected or orders != expected \
+            or remaining != args.stock - expected or reserved != 0:
+        print(f'ОШИБКА: ожидалось {expected} заказов и остаток {args.stock - expected} без резервов')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Проверка числа SQL-запросов корзины: GET /basket читает корзину одним запросом.
+
+Запуск: python benchmarks/check_basket_queries.py [--items 20]
+
+Заполняет временную SQLite базу генератором данных, кладет в корзины двух
+пользователей 1 и --items товаров и считает SQL-запросы, выполненные
+GET /basket после первого запроса (он загружает пользователя в кэш).
+Товары должны загружаться вместе с корзиной одним JOIN: при любом размере
+корзины ожидается ровно один запрос, иначе скрипт завершается с кодом 1.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+from sqlalchemy import event, insert, select  # noqa: E402
+
+from app import BasketItem, Sneaker, User, create_app, db, generate_data, upgrade_database  # noqa: E402
+
+EXPECTED_STATEMENTS = 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=20)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'basket.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'RESERVATION_SWEEP_INTERVAL': 0})
+    statements = []
+    with app.app_context():
+        upgrade_database()
+        generate_data(products=max(args.items, 1), users=2, seed=1)
+        user_ids = db.session.scalars(select(User.id).order_by(User.id).limit(2)).all()
+        sneakers = db.session.execute(select(Sneaker.id, Sneaker.size).order_by(Sneaker.id).limit(args.items)).all()
+        baskets = dict(zip(user_ids, (sneakers[:1], sneakers)))
+        db.session.execute(insert(BasketItem), [
+            {'user_id': user_id, 'sneaker_id': sneaker_id, 'size': size, 'quantity': 1}
+            for user_id, items in baskets.items() for sneaker_id, size in items
+        ])
+        db.session.commit()
+        tokens = {user_id: create_access_token(identity=str(user_id)) for user_id in user_ids}
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *rest: statements.append(statement))
+    client = app.test_client()
+
+    failures = 0
+    for user_id, items in baskets.items():
+        headers = {'Authorization': f'Bearer {tokens[user_id]}'}
+        client.get('/basket', headers=headers)
+        statements.clear()
+        response = client.get('/basket', headers=headers)
+        ok = (response.status_code == 200 and len(response.get_json()) == len(items)
+              and len(statements) == EXPECTED_STATEMENTS)
+        failures += not ok
+        print(f'{"ok" if ok else "ОШИБКА"} товаров в корзине {len(items)}: '
+              f'статус {response.status_code}, SQL-запросов {len(statements)} (ожидается {EXPECTED_STATEMENTS})')
+        if not ok:
+            for statement in statements:
+                print(f'    {" ".join(statement.split())[:200]}')
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Проверка пагинации каталога: переход по заголовку Link выдает следующую страницу.
+
+Запуск: python benchmarks/check_catalog_pagination.py [--products 2000] [--limit 50]
+
+Заполняет временную SQLite базу генератором данных и для набора фильтров
+(включая границы цены в рублях) проходит каталог страницами по ссылке
+rel="next" из заголовка Link. Товары всех страниц вместе должны совпасть
+с результатом того же фильтра, прочитанным из базы без ограничения размера,
+без пропусков и повторов; иначе скрипт завершается с кодом 1.
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+from urllib.parse import parse_qsl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import catalog_query, create_app, generate_data, parse_catalog_args, upgrade_database  # noqa: E402
+
+FILTERS = [
+    '',
+    'brand=Nike',
+    'min_price=10000&max_price=15000',
+    'min_price=10000&max_price=15000&size=42',
+    'gender=Women&category=Running&in_stock=true',
+]
+NEXT_LINK = re.compile(r'<([^>]+)>; rel="next"')
+
+
+def walk(client, query, limit):
+    """ID товаров всех страниц, пройденных по ссылкам Link; None при ошибке"""
+    ids, path = [], f'/catalog?{query}&limit={limit}'
+    while path:
+        response = client.get(path)
+        if response.status_code != 200:
+            print(f'ОШИБКА: {path} вернул {response.status_code}')
+            return None
+        # Последняя полная страница может ссылаться на пустую: это не ошибка
+        ids += [item['id'] for item in response.get_json()]
+        match = NEXT_LINK.search(response.headers.get('Link', ''))
+        path = match.group(1) if match else None
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'pagination.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'RESERVATION_SWEEP_INTERVAL': 0})
+    with app.app_context():
+        upgrade_database()
+        generate_data(products=args.products, seed=1)
+    client = app.test_client()
+
+    failures = 0
+    for query in FILTERS:
+        with app.app_context():
+            params = dict(parse_catalog_args(dict(parse_qsl(query))), limit=None)
+            expected = [item.id for item in catalog_query(params)]
+        ids = walk(client, query, args.limit)
+        ok = ids == expected
+        failures += not ok
+        print(f'{"ok" if ok else "ОШИБКА"} ?{query or "(без фильтров)"}: '
+              f'товаров на страницах {0 if ids is None else len(ids)}, в базе {len(expected)}')
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
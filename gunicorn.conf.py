@@ -0,0 +1,96 @@
+# Конфигурация gunicorn для запуска приложения (см. Procfile)
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+
+# Приложение импортируется один раз в мастер-процессе: воркеры получают
+# готовые модули, модели и прогретые индексы после fork (copy-on-write)
+preload_app = True
+
+# Число воркеров и потоков по числу CPU; переопределяется переменными окружения
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# Процессы bcrypt делят CPU между всеми воркерами: по умолчанию на воркер
+# приходится доля ядер, но не меньше одного процесса
+os.environ.setdefault('PASSWORD_HASH_WORKERS', str(max(1, multiprocessing.cpu_count() // workers)))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+
+# Периодический перезапуск воркеров ограничивает рост памяти
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = 500
+
+# Общий каталог метрик воркеров для /metrics и общий файл кэша каталога
+# и пользователей; задаются до импорта приложения. По умолчанию лежат в
+# личном каталоге запуска: mkdtemp создает его с непредсказуемым именем и
+# правами 0700, поэтому другие пользователи хоста не подменят эти файлы.
+# Заданные явно пути должны быть так же доступны только пользователю сервера
+runtime_dir = None
+if not (os.environ.get('METRICS_DIR') and os.environ.get('CACHE_PATH')):
+    runtime_dir = tempfile.mkdtemp(prefix='flaskserver-')
+    os.environ.setdefault('METRICS_DIR', os.path.join(runtime_dir, 'metrics'))
+    os.environ.setdefault('CACHE_PATH', os.path.join(runtime_dir, 'cache.db'))
+
+
+def on_starting(server):
+    """Очистка метрик и кэша предыдущего запуска"""
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['METRICS_DIR'], exist_ok=True)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(os.environ['CACHE_PATH'] + suffix):
+            os.remove(os.environ['CACHE_PATH'] + suffix)
+
+
+def when_ready(server):
+    """Прогрев индексов каталога в мастере до запуска воркеров"""
+    from sqlalchemy.exc import SQLAlchemyError
+    from app import db, warm_caches
+
+    flask_app = server.app.wsgi()
+    with flask_app.app_context():
+        try:
+            warm_caches()
+        except SQLAlchemyError as e:
+            server.log.warning("Прогрев индексов каталога пропущен: %s", e)
+        # Соединения мастера не должны переиспользоваться воркерами после fork
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def post_fork(server, worker):
+    """Сброс унаследованных пулов соединений и запуск фоновых задач и пула bcrypt в воркере"""
+    from app import db, password_hasher, start_reservation_sweeper
+
+    app = server.app.wsgi()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    start_reservation_sweeper(app)
+    # Пул поднимается до приема запросов, чтобы первый вход не ждал запуска процессов
+    password_hasher.start()
+
+
+def worker_exit(server, worker):
+    """Сохранение последних метрик воркера перед завершением"""
+    from app import metrics
+
+    metrics.flush()
+
+
+def child_exit(server, worker):
+    """Перенос метрик завершившегося воркера в общий итог (в мастере)"""
+    from app import metrics
+
+    metrics.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    """Удаление личного каталога запуска"""
+    if runtime_dir is not None:
+        shutil.rmtree(runtime_dir, ignore_errors=True)